@@ -1,82 +1,298 @@
-import os
-import time
+import asyncio
 import json
 import logging
+import os
+import random
+import re
 import signal
-import sys
-import websocket
+import struct
+import time
+from collections import defaultdict
+from pathlib import Path
+from urllib.parse import urlparse
+
+import aiohttp
+from aiohttp import web
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
-# Retrieve WebSocket URL from environment variable
-WEBSOCKET_URL = os.getenv("WEBSOCKET_URL", "ws://localhost:3333/signals")
+# Signal endpoints to subscribe to, separated by commas or whitespace. WEBSOCKET_URL is kept for the sidecar setup.
+WEBSOCKET_URLS = os.getenv("WEBSOCKET_URLS", os.getenv("WEBSOCKET_URL", "ws://localhost:3333/signals"))
+# Seconds between summaries of the received signals
+SUMMARY_INTERVAL = float(os.getenv("SUMMARY_INTERVAL", "30"))
+# Also log one line per pod in every summary, only the totals otherwise
+SUMMARY_PER_POD = os.getenv("SUMMARY_PER_POD", "true").lower() == "true"
+# Directory to write the raw signals to, see CaptureWriter. Empty to not capture them.
+CAPTURE_DIR = os.getenv("CAPTURE_DIR", "")
+# Size of a capture file before a new one is started
+CAPTURE_MAX_BYTES = int(os.getenv("CAPTURE_MAX_BYTES", str(256 * 1024 * 1024)))
+# Log every received signal, like the first versions did
+LOG_SIGNALS = os.getenv("LOG_SIGNALS", "false").lower() == "true"
+# Port of the Prometheus endpoint (/metrics), 0 disables it
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9400"))
+
+MIN_RECONNECT_DELAY = 1
+MAX_RECONNECT_DELAY = 60
+
+# status-go serializes the signal envelope with "type" as its first key, so the type is read without decoding the
+# whole payload
+_TYPE_PREFIX = re.compile(rb'\s*\{\s*"type"\s*:\s*"([^"\\]*)"')
+_PEEK_SIZE = 128
+
+# Capture files start with this header, then every signal is a record of its receive time in nanoseconds, the length
+# of the frame and the frame as received
+CAPTURE_MAGIC = b"STATUS-SIGNALS-1\n"
+_RECORD_HEADER = struct.Struct("<QI")
 
 
-ws = None
-should_exit = False
+def parse_urls(urls: str) -> list[str]:
+    return [url for url in re.split(r"[\s,]+", urls) if url]
 
 
-def on_message(ws, message):
+def pod_name(url: str) -> str:
+    parsed = urlparse(url)
+    # Backends served under a prefix, like the mock status-backend (/{node}/signals), are named after it
+    path = parsed.path.strip("/").split("/")
+    if len(path) > 1:
+        return path[-2]
+    # Pod hostnames look like pod.service.namespace, a sidecar connects to localhost and is named after its pod
+    host = parsed.hostname or url
+    if host in ("localhost", "127.0.0.1", "::1"):
+        return os.getenv("HOSTNAME", host)
+    return host.split(".")[0]
+
+
+def signal_type(frame: bytes) -> str:
+    match = _TYPE_PREFIX.match(frame, 0, _PEEK_SIZE)
+    if match:
+        return match.group(1).decode()
     try:
-        data = json.loads(message)
-        logger.info(f"Received valid message: {data}")
-    except json.JSONDecodeError:
-        logger.warning(f"Received invalid JSON message: {message}")
+        return str(json.loads(frame).get("type", "unknown"))
+    except (ValueError, AttributeError):
+        return "invalid"
+
+
+class SignalStats:
+    """
+    Signals and bytes received per pod and signal type, since the start and since the last summary.
+    """
+    def __init__(self):
+        self.total: dict[str, dict[str, list[int]]] = defaultdict(lambda: defaultdict(lambda: [0, 0]))
+        self.interval: dict[str, dict[str, list[int]]] = defaultdict(lambda: defaultdict(lambda: [0, 0]))
+        self.pods: set[str] = set()
+        self.connected: set[str] = set()
+        self.reconnects: dict[str, int] = defaultdict(int)
+        self.interval_started = time.monotonic()
+
+    def record(self, pod: str, kind: str, size: int):
+        for counters in (self.total[pod][kind], self.interval[pod][kind]):
+            counters[0] += 1
+            counters[1] += size
+
+    def summary(self) -> tuple[dict, dict[str, dict]]:
+        """
+        Returns the totals and the per pod summaries of the interval since the last call, and starts a new one.
+        """
+        now = time.monotonic()
+        elapsed = max(now - self.interval_started, 1e-9)
+        per_type: dict[str, int] = defaultdict(int)
+        per_pod = {}
+        for pod, kinds in self.interval.items():
+            for kind, (count, _) in kinds.items():
+                per_type[kind] += count
+            per_pod[pod] = {kind: {"count": count, "rate": round(count / elapsed, 2), "bytes": size}
+                            for kind, (count, size) in sorted(kinds.items())}
+        signals = sum(per_type.values())
+        totals = {
+            "interval": round(elapsed, 2),
+            "connected": len(self.connected),
+            "pods": len(self.pods),
+            "signals": signals,
+            "rate": round(signals / elapsed, 2),
+            "bytes": sum(size for kinds in self.interval.values() for _, size in kinds.values()),
+            "types": dict(sorted(per_type.items())),
+            "total_signals": sum(count for kinds in self.total.values() for count, _ in kinds.values()),
+            "reconnects": sum(self.reconnects.values()),
+        }
+        self.interval.clear()
+        self.interval_started = now
+        return totals, per_pod
+
+    def prometheus(self) -> str:
+        """
+        Counters since the start in the Prometheus text format.
+        """
+        samples = sorted((pod, kind, counters) for pod, kinds in self.total.items() for kind, counters in kinds.items())
+        pods = sorted(self.pods)
+        lines = [
+            *_metric("signals_received_total", "counter", "Signals received per pod and signal type",
+                     [(f'pod="{pod}",type="{kind}"', count) for pod, kind, (count, _) in samples]),
+            *_metric("signal_bytes_received_total", "counter", "Bytes of the signals received per pod and signal type",
+                     [(f'pod="{pod}",type="{kind}"', size) for pod, kind, (_, size) in samples]),
+            *_metric("connected", "gauge", "Whether the signals websocket of the pod is connected",
+                     [(f'pod="{pod}"', int(pod in self.connected)) for pod in pods]),
+            *_metric("reconnects_total", "counter", "Reconnections to the signals websocket of the pod",
+                     [(f'pod="{pod}"', self.reconnects[pod]) for pod in pods]),
+        ]
+        return "\n".join(lines) + "\n"
+
 
+def _metric(name: str, kind: str, help_text: str, samples: list[tuple[str, int]]) -> list[str]:
+    name = f"status_subscriber_{name}"
+    return [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}",
+            *(f"{name}{{{labels}}} {value}" for labels, value in samples)]
 
-def on_error(ws, error):
-    logger.error(f"WebSocket error: {error}")
 
+class CaptureWriter:
+    """
+    Writes the raw signals of a pod to {directory}/{pod}-{start time}.sig files, starting a new one every max_bytes.
+    """
+    def __init__(self, directory: str, pod: str, max_bytes: int = CAPTURE_MAX_BYTES):
+        self.directory = Path(directory)
+        self.pod = pod
+        self.max_bytes = max_bytes
+        self.file = None
+        self.written = 0
 
-def on_close(ws, close_status_code, close_msg):
-    logger.info(f"WebSocket connection closed. Status code: {close_status_code}, Message: {close_msg}")
+    def _open(self):
+        self.close()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f"{self.pod}-{time.time_ns()}.sig"
+        self.file = open(path, "wb", buffering=1024 * 1024)
+        self.file.write(CAPTURE_MAGIC)
+        self.written = len(CAPTURE_MAGIC)
+        logger.info(f"Capturing signals of {self.pod} to {path}")
 
+    def write(self, timestamp: int, frame: bytes):
+        if self.file is None or self.written >= self.max_bytes:
+            self._open()
+        self.file.write(_RECORD_HEADER.pack(timestamp, len(frame)))
+        self.file.write(frame)
+        self.written += _RECORD_HEADER.size + len(frame)
 
-def on_open(ws):
-    logger.info("Successfully connected to WebSocket server.")
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
 
 
-def connect_to_websocket():
-    global ws
-    reconnect_delay = 1
-    max_delay = 60  # Cap the reconnect delay to avoid indefinite growth
+def read_capture(path: str):
+    """
+    Yields (receive time in nanoseconds, frame) for every signal of a capture file.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise ValueError(f"{path} is not a signal capture file")
+        while header := f.read(_RECORD_HEADER.size):
+            if len(header) < _RECORD_HEADER.size:
+                break
+            timestamp, length = _RECORD_HEADER.unpack(header)
+            frame = f.read(length)
+            if len(frame) < length:
+                break
+            yield timestamp, frame
 
-    while not should_exit:
+
+async def subscribe(session: aiohttp.ClientSession, url: str, stats: SignalStats, stop: asyncio.Event):
+    pod = pod_name(url)
+    capture = CaptureWriter(CAPTURE_DIR, pod) if CAPTURE_DIR else None
+    stats.pods.add(pod)
+    reconnect_delay = MIN_RECONNECT_DELAY
+
+    try:
+        while not stop.is_set():
+            try:
+                async with session.ws_connect(url, heartbeat=30) as ws:
+                    logger.info(f"Connected to {url}")
+                    stats.connected.add(pod)
+                    reconnect_delay = MIN_RECONNECT_DELAY
+                    async for message in ws:
+                        if message.type == aiohttp.WSMsgType.TEXT:
+                            frame = message.data.encode()
+                        elif message.type == aiohttp.WSMsgType.BINARY:
+                            frame = message.data
+                        else:
+                            break
+                        stats.record(pod, signal_type(frame), len(frame))
+                        if capture is not None:
+                            capture.write(time.time_ns(), frame)
+                        if LOG_SIGNALS:
+                            logger.info(f"Received signal from {pod}: {frame.decode(errors='replace')}")
+                logger.info(f"Connection to {url} closed")
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+                logger.warning(f"Error in connection to {url}: {type(e).__name__}: {e}")
+            finally:
+                stats.connected.discard(pod)
+
+            if stop.is_set():
+                break
+            stats.reconnects[pod] += 1
+            # Jitter, so pods that restarted together are not reconnected all at once
+            delay = reconnect_delay * random.uniform(0.5, 1)
+            logger.info(f"Reconnecting to {url} in {delay:.1f} seconds...")
+            try:
+                await asyncio.wait_for(stop.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            reconnect_delay = min(reconnect_delay * 2, MAX_RECONNECT_DELAY)
+    finally:
+        if capture is not None:
+            capture.close()
+
+
+def log_summary(stats: SignalStats):
+    totals, per_pod = stats.summary()
+    logger.info(f"Summary {json.dumps(totals, separators=(',', ':'))}")
+    if SUMMARY_PER_POD:
+        for pod, kinds in sorted(per_pod.items()):
+            logger.info(f"Summary {pod} {json.dumps(kinds, separators=(',', ':'))}")
+
+
+async def report(stats: SignalStats, stop: asyncio.Event):
+    while not stop.is_set():
         try:
-            logger.info(f"Connecting to WebSocket endpoint: {WEBSOCKET_URL}")
-            ws = websocket.WebSocketApp(
-                WEBSOCKET_URL,
-                on_message=on_message,
-                on_error=on_error,
-                on_close=on_close,
-                on_open=on_open
-            )
-            ws.run_forever()
-            logger.info("WebSocket connection closed. Retrying...")
-        except Exception as e:
-            logger.error(f"Error in WebSocket connection: {e}")
-
-        # Exponential backoff for reconnection
-        reconnect_delay = min(reconnect_delay * 2, max_delay)
-        if not should_exit:
-            logger.info(f"Reconnecting in {reconnect_delay} seconds...")
-            time.sleep(reconnect_delay)
-
-
-def signal_handler(sig, frame):
-    """Handle termination signals (SIGINT, SIGTERM) for graceful shutdown."""
-    global should_exit
-    logger.info("Received termination signal. Shutting down...")
-    should_exit = True
-    if ws:
-        ws.close()
-    sys.exit(0)
+            await asyncio.wait_for(stop.wait(), SUMMARY_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        log_summary(stats)
 
 
-if __name__ == "__main__":
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
+async def serve_metrics(stats: SignalStats) -> web.AppRunner:
+    async def _handle_metrics(request: web.Request) -> web.Response:
+        return web.Response(text=stats.prometheus(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", METRICS_PORT).start()
+    logger.info(f"Serving metrics on port {METRICS_PORT}")
+    return runner
+
+
+async def main(urls: list[str]):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
 
-    connect_to_websocket()
+    stats = SignalStats()
+    runner = await serve_metrics(stats) if METRICS_PORT else None
+    logger.info(f"Subscribing to {len(urls)} signal endpoints")
+    # One connection per pod, so the per host limit of the connector does not apply
+    connector = aiohttp.TCPConnector(limit=0, limit_per_host=0)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        tasks = [asyncio.create_task(subscribe(session, url, stats, stop)) for url in urls]
+        await report(stats, stop)
+        logger.info("Received termination signal. Shutting down...")
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    if runner is not None:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_urls(WEBSOCKET_URLS)))
@@ -0,0 +1,79 @@
+# Python Imports
+import logging
+import os
+import time
+from dataclasses import dataclass, asdict
+from typing import Optional
+
+# Project Imports
+from src.json_store import read_json_store, update_json_store
+
+logger = logging.getLogger(__name__)
+
+# Accounts created in the pods are kept here, so later runs against the same fleet can log in instead of creating them.
+# Set it to an empty string to always create new accounts.
+ACCOUNT_REGISTRY_PATH = os.getenv("BENCHMARK_ACCOUNT_REGISTRY",
+                                  os.path.expanduser("~/.status-benchmarks/accounts.json"))
+
+
+@dataclass
+class AccountRecord:
+    key_uid: str
+    public_key: str
+    light_client: bool
+    created_at: int
+    last_login: Optional[int] = None
+
+
+class AccountRegistry:
+    """
+    File backed registry of the account of every pod. Several processes (see sharding) can save to the same file,
+    every save merges its records into the file under a lock.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.records: dict[str, AccountRecord] = self._read()
+        self._updated: set[str] = set()
+
+    def _read(self) -> dict[str, AccountRecord]:
+        return {pod: AccountRecord(**record) for pod, record in read_json_store(self.path).items()}
+
+    def get(self, pod: str) -> Optional[AccountRecord]:
+        return self.records.get(pod)
+
+    def put(self, pod: str, record: AccountRecord):
+        self.records[pod] = record
+        self._updated.add(pod)
+
+    def mark_login(self, pod: str):
+        self.records[pod].last_login = int(time.time())
+        self._updated.add(pod)
+
+    def remove(self, pod: str):
+        if self.records.pop(pod, None) is not None:
+            self._updated.add(pod)
+
+    def save(self):
+        if not self._updated:
+            return
+        data = update_json_store(self.path, {pod: asdict(self.records[pod]) if pod in self.records else None
+                                             for pod in self._updated})
+        logger.info(f"Saved {len(self._updated)} accounts to {self.path}")
+        self.records = {pod: AccountRecord(**record) for pod, record in data.items()}
+        self._updated.clear()
+
+
+_account_registry: Optional[AccountRegistry] = None
+
+
+def get_account_registry() -> Optional[AccountRegistry]:
+    global _account_registry
+    if _account_registry is None and ACCOUNT_REGISTRY_PATH:
+        _account_registry = AccountRegistry(ACCOUNT_REGISTRY_PATH)
+    return _account_registry
+
+
+def configure_account_registry(path: str) -> AccountRegistry:
+    global _account_registry
+    _account_registry = AccountRegistry(path)
+    return _account_registry
@@ -1,13 +1,17 @@
 # Python Imports
 import asyncio
 import logging
+import time
 import traceback
 from collections.abc import Callable
 from functools import partial
-from typing import Literal, Any
+from typing import Literal, Any, Optional
 
 # Project Imports
 from src.dataclasses import ResultEntry
+from src.histogram import LatencyHistogram
+from src.metrics_server import get_metrics_registry
+from src.result_sink import record_result, record_result_entry
 
 
 RequestResult = tuple[partial, ResultEntry]
@@ -21,46 +25,155 @@ CollectedItem = tuple[str, ResultEntry]
 
 logger = logging.getLogger(__name__)
 
+IN_FLIGHT_HELP = "Tasks launched by launch_workers that are still running, per task function"
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD limit of in-flight tasks. Every window of completed tasks is compared against the best latency seen so far:
+    while latency stays within tolerance and no task fails, the limit grows (doubling until the first back off, then
+    one by one), otherwise it is multiplied by backoff. The limit reached is the concurrency the system under test
+    sustains, and its evolution is kept in timeline.
+    """
+    def __init__(self, name: str, initial: int = 4, min_limit: int = 1, max_limit: int = 256, window: int = 10,
+                 tolerance: float = 2.0, backoff: float = 0.5, latency_target: Optional[float] = None):
+        self.name = name
+        self.limit = initial
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.window = window
+        self.tolerance = tolerance
+        self.backoff = backoff
+        # When set, latency is healthy below this value instead of tolerance times the best window latency
+        self.latency_target = latency_target
+        self.in_flight = 0
+        self.slow_start = True
+        self.best_latency: Optional[float] = None
+        self.latencies = LatencyHistogram()
+        # (seconds since start, limit, in flight tasks)
+        self.timeline: list[tuple[float, int, int]] = []
+        self._window_latencies: list[float] = []
+        self._window_errors = 0
+        # Tasks launched before the last adjustment, their latency does not reflect the current limit
+        self._stale = 0
+        self._start = time.monotonic()
+        # Set when a task is released, waiters check the limit again
+        self._released = asyncio.Event()
+        self._mark()
+
+    def _mark(self):
+        self.timeline.append((time.monotonic() - self._start, self.limit, self.in_flight))
+
+    async def acquire(self):
+        while self.in_flight >= self.limit:
+            self._released.clear()
+            await self._released.wait()
+        self.in_flight += 1
+
+    def release(self, latency: float, failed: bool):
+        self.in_flight -= 1
+        self.latencies.record(latency)
+        if self._stale:
+            self._stale -= 1
+        elif failed:
+            self._window_errors += 1
+        else:
+            self._window_latencies.append(latency)
+        # A window lasts at least as many completions as the limit, roughly one round trip of every in-flight task
+        if len(self._window_latencies) + self._window_errors >= max(self.window, self.limit):
+            self._adjust()
+        self._released.set()
+
+    def _adjust(self):
+        latencies = sorted(self._window_latencies)
+        # Median of the window, so a single slow task does not trigger a back off
+        latency = latencies[len(latencies) // 2] if latencies else None
+        if latency is not None:
+            self.best_latency = latency if self.best_latency is None else min(self.best_latency, latency)
+        threshold = self.latency_target or (self.best_latency * self.tolerance if self.best_latency else None)
+        healthy = self._window_errors == 0 and latency is not None and (threshold is None or latency <= threshold)
+
+        previous = self.limit
+        if healthy:
+            self.limit = min(self.max_limit, self.limit * 2 if self.slow_start else self.limit + 1)
+        else:
+            self.slow_start = False
+            self.limit = max(self.min_limit, int(self.limit * self.backoff))
+        if self.limit != previous:
+            logger.debug(f"Concurrency of {self.name} {previous} -> {self.limit}, window median latency {latency}, "
+                         f"{self._window_errors} errors")
+            record_result(f"{self.name}_concurrency", timestamp=time.time_ns(), result=self.limit,
+                          value=latency)
+        self._window_latencies = []
+        self._window_errors = 0
+        self._stale = self.in_flight
+        self._mark()
+
+    def summary(self) -> dict:
+        limits = [limit for _, limit, _ in self.timeline]
+        return {"final_limit": self.limit, "max_limit": max(limits), "adjustments": len(self.timeline) - 1,
+                "duration": round(time.monotonic() - self._start, 3), "latency": self.latencies.summary()}
 
-async def launch_workers(worker_tasks: list[partial], done_queue: asyncio.Queue[TaskResult], intermediate_delay: float,
-                         max_in_flight: int = 0) -> None:
 
-    sem = asyncio.Semaphore(max_in_flight) if max_in_flight > 0 else None
+async def launch_workers(worker_tasks: list[partial], done_queue: asyncio.Queue[TaskResult], intermediate_delay: float,
+                         max_in_flight: int = 0, concurrency: Optional[AdaptiveConcurrency] = None) -> None:
+    """
+    Launches the workers in order. With concurrency, the amount of in-flight workers follows its adaptive limit and
+    intermediate_delay is not used.
+    """
+    sem = asyncio.Semaphore(max_in_flight) if max_in_flight > 0 and concurrency is None else None
+    metrics = get_metrics_registry()
 
     for worker in worker_tasks:
-        if sem is not None:
+        if concurrency is not None:
+            await concurrency.acquire()
+        elif sem is not None:
             await sem.acquire()
 
         # worker.args has (nodes, sender, receiver)
         logger.debug(f"Launching task {worker.func.__name__}: {worker.args[1:]}")
+        started = time.monotonic()
         fut = asyncio.create_task(worker())
+        metrics.add_gauge("launch_workers_in_flight", IN_FLIGHT_HELP, 1, task=worker.func.__name__)
 
-        def _on_done(t: asyncio.Task, j=worker) -> None:
+        def _on_done(t: asyncio.Task, j=worker, started=started) -> None:
             if sem is not None:
                 sem.release()
+            metrics.add_gauge("launch_workers_in_flight", IN_FLIGHT_HELP, -1, task=j.func.__name__)
             try:
                 result = t.result()
                 done_queue.put_nowait(("ok", (j, result)))
+                failed = False
             except Exception as e:
                 tb = "".join(traceback.format_exception(type(e), e, e.__traceback__))
                 done_queue.put_nowait(("err", (e, tb)))
+                failed = True
+            if concurrency is not None:
+                concurrency.release(time.monotonic() - started, failed)
 
         fut.add_done_callback(_on_done)
 
-        if intermediate_delay:
+        if intermediate_delay and concurrency is None:
             logger.debug(f"Waiting {intermediate_delay} seconds before launching next task")
             await asyncio.sleep(intermediate_delay)
 
+    if concurrency is not None:
+        logger.info(f"Launched {len(worker_tasks)} tasks of {concurrency.name}: {concurrency.summary()}")
+
 
 async def collect_results_from_tasks(done_queue: asyncio.Queue[TaskResult | None],
                                      results_queue: asyncio.Queue[CollectedItem],
                                      total_tasks: int, finished_evt: asyncio.Event):
+    metrics = get_metrics_registry()
+    metrics.track_queue("done_queue", done_queue)
+    metrics.track_queue("results_queue", results_queue)
     for _ in range(total_tasks):
         status, payload = await done_queue.get()
         if status == "ok":
             partial_object, results = payload
             logger.debug(f"Task completed: {partial_object.func.__name__} {partial_object.args[1:]}")
             results_queue.put_nowait((partial_object.func.__name__, results))
+            record_result_entry(partial_object.func.__name__.lstrip("_"), results)
         else:
             e, tb = payload  # from the launcher callback
             logger.error("Task failed: %s\n%s", e, tb)
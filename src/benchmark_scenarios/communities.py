@@ -6,10 +6,17 @@ import logging
 import src.logger
 from src import kube_utils
 from src import setup_status
-from src.benchmark_scenarios.scenario_utils import create_community_util
+from src import sharding
+from src.async_utils import AdaptiveConcurrency
+from src.benchmark_scenarios.scenario_utils import create_community_util, community_fixture
 from src.enums import SignalType
-from src.inject_messages import inject_messages
-from src.setup_status import login_nodes, accept_community_requests, reject_community_requests
+from src.histogram import get_latency_histograms
+from src.inject_messages import inject_messages, inject, InjectionJob, InjectionTarget
+from src.message_tracking import DeliveryReport
+from src.pod_discovery import PodDiscovery
+from src.readiness import wait_for_peers, wait_for_messages, wait_for_quiet, traffic_counters
+from src.setup_status import login_nodes, accept_community_requests, reject_community_requests, \
+    report_signal_memory_usage, report_rpc_metrics
 
 logger = logging.getLogger(__name__)
 
@@ -25,19 +32,22 @@ async def subscription_performance():
     # -> Start light nodes
     # -> Measure time from start to time messages are being received on filter
     kube_utils.setup_kubernetes_client()
-    backend_relay_pods = kube_utils.get_pods("status-backend-relay", "status-go-test")
-    backend_light_pods = kube_utils.get_pods("status-backend-light", "status-go-test")
+    # Light pods are initialized as they get ready, while the rest of the 500 are still starting
+    backend_relay_pods = PodDiscovery(["status-backend-relay"], "status-go-test")
+    backend_light_pods = PodDiscovery(["status-backend-light"], "status-go-test")
 
     relay_nodes, light_nodes = await asyncio.gather(
         setup_status.initialize_nodes_application(backend_relay_pods),
         setup_status.initialize_nodes_application(backend_light_pods, wakuV2LightClient=True)
     )
 
-    await asyncio.sleep(10)
     status_nodes = {**relay_nodes, **light_nodes}
+    await wait_for_peers(status_nodes, timeout=60)
     community_owner = "status-backend-relay-0"
     nodes_to_join = [key for key in status_nodes.keys() if key != community_owner]
 
+    # A fresh community every run: the chat of a reused one holds the messages of the previous runs, which would be
+    # counted as received and taken as the first message
     community_setup_result = await create_community_util(status_nodes, community_owner, nodes_to_join, accept_community_requests)
 
     logger.info("Logging out light nodes")
@@ -45,6 +55,7 @@ async def subscription_performance():
     await asyncio.sleep(5)
 
     logger.info(f"Started injecting {30} messages")
+    before_injection = await traffic_counters(status_nodes)
     message_task = asyncio.create_task(
         inject_messages(status_nodes[community_owner], 1, community_setup_result.chat_id, 30))
     await asyncio.sleep(15)
@@ -53,21 +64,26 @@ async def subscription_performance():
     await login_nodes(light_nodes, list(light_nodes.keys()))
 
     await message_task
-    await asyncio.sleep(30)
+    await wait_for_messages(status_nodes, 30 * len(nodes_to_join), timeout=30, since=before_injection)
 
     messages = []
     for node in status_nodes.values():
-        messages.append(len(node.signal.signal_queues[SignalType.MESSAGES_NEW.value].messages))
+        messages.append(await sharding.fetch(node.signal.signal_queues[SignalType.MESSAGES_NEW.value],
+                                             "messages", "received"))
     logger.info(f"Messages received: {messages}")
     logger.info(len(set(messages)) == 1)
 
-    times = []
-    for light_node in light_nodes.values():
-        times.append(
-            light_node.signal.signal_queues[SignalType.MESSAGES_NEW.value].messages[0][0] - light_node.last_login)
-    logger.info(f"Average time is {sum(times) / len(times)} seconds")
-    logger.info(f"Times: {times}")
-
+    histograms = get_latency_histograms()
+    for name, light_node in light_nodes.items():
+        first_timestamp = await sharding.fetch(light_node.signal.signal_queues[SignalType.MESSAGES_NEW.value],
+                                               "messages", "first_timestamp")
+        if first_timestamp is None:
+            logger.error(f"{name} did not receive any message")
+            continue
+        histograms.record("subscription_time_to_first_message", name, first_timestamp - light_node.last_login)
+    histograms.log_summary("subscription_time_to_first_message")
+
+    report_rpc_metrics(status_nodes)
     logger.info("Shutting down node connections")
     await asyncio.gather(*[node.shutdown() for node in status_nodes.values()])
     logger.info("Finished subscription_performance")
@@ -87,19 +103,21 @@ async def store_performance():
     # -> Measure time from start to time they get first query
     # -> Measure on wire store query performance
     kube_utils.setup_kubernetes_client()
-    backend_relay_pods = kube_utils.get_pods("status-backend-relay", "status-go-test")
-    backend_light_pods = kube_utils.get_pods("status-backend-light", "status-go-test")
+    # Light pods are initialized as they get ready, while the rest of the 500 are still starting
+    backend_relay_pods = PodDiscovery(["status-backend-relay"], "status-go-test")
+    backend_light_pods = PodDiscovery(["status-backend-light"], "status-go-test")
 
     relay_nodes, light_nodes = await asyncio.gather(
         setup_status.initialize_nodes_application(backend_relay_pods),
         setup_status.initialize_nodes_application(backend_light_pods, wakuV2LightClient=True)
     )
 
-    await asyncio.sleep(10)
     status_nodes = {**relay_nodes, **light_nodes}
+    await wait_for_peers(status_nodes, timeout=60)
     community_owner = "status-backend-relay-0"
     nodes_to_join = [key for key in status_nodes.keys() if key != community_owner]
 
+    # A fresh community every run, for the same reason as in subscription_performance
     community_setup_result = await create_community_util(status_nodes, community_owner, nodes_to_join, accept_community_requests)
 
     await asyncio.gather(*[status_nodes[node].logout() for node in nodes_to_join])
@@ -108,34 +126,38 @@ async def store_performance():
 
     await asyncio.sleep(20)
 
+    before_login = await traffic_counters(status_nodes)
     await login_nodes(status_nodes, nodes_to_join)
 
-    await asyncio.sleep(40)  # Some time to receive signals
-
-    light_times = []
-    relay_times = []
-
-    for relay_node in relay_nodes.values():
-        relay_times.append(
-            relay_node.signal.signal_queues[SignalType.MESSAGES_NEW.value].messages[0][0] - relay_node.last_login)
-    logger.info(f"Average relay time is {sum(relay_times) / len(relay_times)} seconds")
-    logger.info(f"Relay Times: {relay_times}")
-    for light_node in light_nodes.values():
-        light_times.append(
-            light_node.signal.signal_queues[SignalType.MESSAGES_NEW.value].messages[0][0] - light_node.last_login)
-    logger.info(f"Average light time is {sum(light_times) / len(light_times)} seconds")
-    logger.info(f"Light Times: {light_times}")
+    # Every node gets the 30 messages from the store
+    await wait_for_messages(status_nodes, 30 * len(nodes_to_join), timeout=40, since=before_login)
+
+    # Relay and light nodes are reported separately, as histograms are kept per node class
+    histograms = get_latency_histograms()
+    for name, node in status_nodes.items():
+        if name == community_owner:
+            continue
+        first_timestamp = await sharding.fetch(node.signal.signal_queues[SignalType.MESSAGES_NEW.value],
+                                               "messages", "first_timestamp")
+        if first_timestamp is None:
+            logger.error(f"{name} did not receive any message")
+            continue
+        histograms.record("store_time_to_first_message", name, first_timestamp - node.last_login)
+    histograms.log_summary("store_time_to_first_message")
 
     relay_messages = []
     for relay_node in relay_nodes.values():
-        relay_messages.append(len(relay_node.signal.signal_queues[SignalType.MESSAGES_NEW.value].messages))
+        relay_messages.append(await sharding.fetch(relay_node.signal.signal_queues[SignalType.MESSAGES_NEW.value],
+                                                   "messages", "received"))
     logger.info(f"Relay messages received: {relay_messages} for {len(relay_messages)} relay nodes")
 
     light_messages = []
     for light_node in light_nodes.values():
-        light_messages.append(len(light_node.signal.signal_queues[SignalType.MESSAGES_NEW.value].messages))
+        light_messages.append(await sharding.fetch(light_node.signal.signal_queues[SignalType.MESSAGES_NEW.value],
+                                                   "messages", "received"))
     logger.info(f"Light messages received: {light_messages} for {len(light_messages)} light nodes")
 
+    report_rpc_metrics(status_nodes)
     logger.info("Shutting down node connections")
     await asyncio.gather(*[node.shutdown() for node in status_nodes.values()])
     logger.info("Finished store_performance")
@@ -153,17 +175,26 @@ async def message_sending():
     community_owner = "status-backend-relay-0"
     nodes_to_join = [key for key in relay_nodes.keys() if key != community_owner]
 
-    community_setup_result = await create_community_util(relay_nodes, community_owner, nodes_to_join, accept_community_requests)
+    # Requests to join are sent as fast as the community owner can take them
+    join_concurrency = AdaptiveConcurrency("request_to_join_community")
+    community_setup_result = await community_fixture("message_sending", relay_nodes, community_owner, nodes_to_join,
+                                                     accept_community_requests, concurrency=join_concurrency)
+    if not community_setup_result.reused:
+        logger.info(f"Request to join concurrency timeline: {join_concurrency.timeline}")
+
+    await wait_for_quiet(relay_nodes, quiet_period=5, timeout=30)
 
-    logger.info("Waiting 30 seconds")
-    await asyncio.sleep(30)
+    before_injection = await traffic_counters(relay_nodes)
+    stats = await inject([InjectionJob(relay_nodes[node], InjectionTarget.CHAT, community_setup_result.chat_id, 36, 5)
+                          for node in nodes_to_join[:7]])
 
-    await asyncio.gather(
-        *[inject_messages(relay_nodes[node], 5, community_setup_result.chat_id, 36) for node in nodes_to_join[:7]])
+    await wait_for_messages(relay_nodes, stats.sent * (len(relay_nodes) - 1), timeout=30, since=before_injection)
 
-    logger.info("Waiting 30 seconds")
-    await asyncio.sleep(30)
+    DeliveryReport.build(relay_nodes, stats.sent_per_target, {community_setup_result.chat_id: list(relay_nodes)},
+                         "chat", seq_ranges=stats.seq_ranges).log()
 
+    report_signal_memory_usage(relay_nodes)
+    report_rpc_metrics(relay_nodes)
     logger.info("Shutting down node connections")
     await asyncio.gather(*[node.shutdown() for node in relay_nodes.values()])
     logger.info("Finished message_sending")
@@ -190,9 +221,9 @@ async def request_to_join_community_mix():
     community_reject_result = await create_community_util(relay_nodes, owner, nodes_reject,
                                                          reject_community_requests)
 
-    logger.info("Waiting 30 seconds")
-    await asyncio.sleep(30)
+    await wait_for_quiet(relay_nodes, quiet_period=5, timeout=30)
 
+    report_rpc_metrics(relay_nodes)
     logger.info("Shutting down node connections")
     await asyncio.gather(*[node.shutdown() for node in relay_nodes.values()])
     logger.info("Finished request_to_join_community_mix")
@@ -212,14 +243,17 @@ async def isolated_traffic_chat_messages_1():
 
     owner = "status-backend-relay-0"
     to_include = [key for key in relay_nodes_1.keys() if key != owner]
-    community_setup_result = await create_community_util(relay_nodes_1, owner, to_include, accept_community_requests)
-    await asyncio.sleep(10)
+    community_setup_result = await community_fixture("isolated_traffic_chat_messages_1", relay_nodes_1, owner, to_include, accept_community_requests)
+    await wait_for_quiet(relay_nodes_1, quiet_period=5, timeout=10)
 
     # We send just from one node to avoid huge load
+    before_injection = await traffic_counters(relay_nodes_1)
     _ = await asyncio.gather(*[inject_messages(relay_nodes_1[owner], 10, community_setup_result.chat_id, 18)])
 
-    await asyncio.sleep(10)
+    await wait_for_messages(relay_nodes_1, 18 * len(to_include), timeout=10, since=before_injection)
 
+    report_signal_memory_usage({**relay_nodes_1, **relay_nodes_2})
+    report_rpc_metrics({**relay_nodes_1, **relay_nodes_2})
     logger.info("Shutting down node connections")
     await asyncio.gather(*[node.shutdown() for node in relay_nodes_1.values()])
     await asyncio.gather(*[node.shutdown() for node in relay_nodes_2.values()])
@@ -240,13 +274,15 @@ async def isolated_traffic_chat_messages_2():
 
     owner = "status-backend-relay-0"
     to_include = [key for key in relay_nodes_1.keys() if key != owner]
-    community_setup_result = await create_community_util(relay_nodes_1, owner, to_include, accept_community_requests)
+    community_setup_result = await community_fixture("isolated_traffic_chat_messages_2", relay_nodes_1, owner, to_include, accept_community_requests)
 
-    await asyncio.sleep(10)
+    await wait_for_quiet(relay_nodes_1, quiet_period=5, timeout=10)
     logger.info("Logging out community nodes")
     await asyncio.gather(*[node.logout() for node in relay_nodes_1.values()])
 
     await asyncio.sleep(300)
+    report_signal_memory_usage({**relay_nodes_1, **relay_nodes_2})
+    report_rpc_metrics({**relay_nodes_1, **relay_nodes_2})
     logger.info("Shutting down node connections")
     await asyncio.gather(*[node.shutdown() for node in relay_nodes_1.values()])
     await asyncio.gather(*[node.shutdown() for node in relay_nodes_2.values()])
@@ -269,6 +305,8 @@ async def isolated_traffic_request_to_join():
     community_setup_result = await create_community_util(relay_nodes_1, owner, to_include, accept_community_requests)
 
     await asyncio.sleep(300)
+    report_signal_memory_usage({**relay_nodes_1, **relay_nodes_2})
+    report_rpc_metrics({**relay_nodes_1, **relay_nodes_2})
     logger.info("Shutting down node connections")
     await asyncio.gather(*[node.shutdown() for node in relay_nodes_1.values()])
     await asyncio.gather(*[node.shutdown() for node in relay_nodes_2.values()])
@@ -6,10 +6,12 @@ import random
 # Project Imports
 import src.logger
 from src import kube_utils, setup_status
-from src.benchmark_scenarios.scenario_utils import send_friend_requests_util
-from src.inject_messages import inject_messages_one_to_one, inject_messages_group_chat
+from src.benchmark_scenarios.scenario_utils import send_friend_requests_util, contacts_fixture, group_chats_fixture
+from src.inject_messages import inject, InjectionJob, InjectionTarget
+from src.message_tracking import DeliveryReport
+from src.readiness import wait_for_peers, wait_for_messages, wait_for_quiet, traffic_counters
 from src.setup_status import initialize_nodes_application, accept_friend_requests, \
-    decline_friend_requests, create_group_chat, add_contacts
+    decline_friend_requests, create_group_chat, add_contacts, report_rpc_metrics, log_friend_request_latencies
 
 logger = logging.getLogger(__name__)
 
@@ -31,8 +33,9 @@ async def idle_relay(consumers: int = 4):
     friends = [key for key in relay_nodes.keys() if key != alice]
 
     delays = await send_friend_requests_util(relay_nodes, [alice], friends, accept_friend_requests, consumers)
-    logger.info(f"Delays are: {delays}")
+    log_friend_request_latencies()
 
+    report_rpc_metrics(relay_nodes)
     logger.info("Shutting down node connections")
     await asyncio.gather(*[node.shutdown() for node in relay_nodes.values()])
     logger.info("Finished idle_relay")
@@ -47,15 +50,16 @@ async def idle_light(consumers: int = 4):
     backend_light_pods = kube_utils.get_pods("status-backend-light", "status-go-test")
     light_nodes = await initialize_nodes_application(backend_light_pods, wakuV2LightClient=True)
 
-    await asyncio.sleep(10)
+    await wait_for_peers(light_nodes, timeout=60)
 
     alice = "status-backend-light-0"
     friends = [key for key in light_nodes.keys() if key != alice]
 
     delays = await send_friend_requests_util(light_nodes, [alice], friends, accept_friend_requests, consumers)
 
-    logger.info(f"Delays are: {delays}")
+    log_friend_request_latencies()
 
+    report_rpc_metrics(light_nodes)
     logger.info("Shutting down node connections")
     await asyncio.gather(*[node.shutdown() for node in light_nodes.values()])
     logger.info("Finished idle_light")
@@ -79,7 +83,7 @@ async def contact_request(consumers: int = 4):
         setup_status.initialize_nodes_application(backend_light_pods, wakuV2LightClient=True)
     )
 
-    await asyncio.sleep(20)
+    await wait_for_peers({**relay_nodes, **light_nodes}, timeout=60)
 
     backend_relay_pods = [pod_name.split(".")[0] for pod_name in backend_relay_pods]
     backend_light_pods = [pod_name.split(".")[0] for pod_name in backend_light_pods]
@@ -98,11 +102,13 @@ async def contact_request(consumers: int = 4):
     delays_reject = await send_friend_requests_util(light_nodes, requesters, receiver_reject, decline_friend_requests, 3, consumers)
     _ = await send_friend_requests_util(light_nodes, requesters, receiver_reject, None)
 
-    logger.info(f"Accept delays ({len(delays_accept)}) are: {delays_accept}")
+    logger.info(f"Accepted {len(delays_accept)} requests")
+    log_friend_request_latencies()
     logger.info(f"Reject delays ({len(delays_reject)})  are: {delays_reject}")
 
-    await asyncio.sleep(10)
+    await wait_for_quiet({**relay_nodes, **light_nodes}, quiet_period=5, timeout=10)
 
+    report_rpc_metrics({**relay_nodes, **light_nodes})
     logger.info("Shutting down node connections")
     await asyncio.gather(*[node.shutdown() for node in relay_nodes.values()],
                          *[node.shutdown() for node in light_nodes.values()])
@@ -119,32 +125,30 @@ async def send_one_to_one_message(consumers: int = 4):
     backend_relay_pods = kube_utils.get_pods("status-backend-relay", "status-go-test")
     relay_nodes = await initialize_nodes_application(backend_relay_pods)
 
-    logger.info("Waiting 60 seconds after nodes initialization")
-    await asyncio.sleep(60)
+    await wait_for_peers(relay_nodes, timeout=60)
 
     backend_relay_pods = [pod_name.split(".")[0] for pod_name in backend_relay_pods]
 
     senders = backend_relay_pods[:50]
     receivers = backend_relay_pods[50:100]
 
-    delays = await send_friend_requests_util(relay_nodes, senders, receivers, accept_friend_requests, consumers)
+    contacts = await contacts_fixture("send_one_to_one_message", relay_nodes, senders, receivers,
+                                      consumers=consumers)
 
-    logger.info("Waiting 20 seconds after accepting requests")
-    await asyncio.sleep(10)
+    if not contacts.reused:
+        await wait_for_quiet(relay_nodes, quiet_period=5, timeout=10)
 
-    await asyncio.gather(*[inject_messages_one_to_one(relay_nodes[senders[i]], 10, relay_nodes[receivers[i]].public_key, 18) for i in range(50)])
+    before_injection = await traffic_counters(relay_nodes)
+    stats = await inject([InjectionJob(relay_nodes[senders[i]], InjectionTarget.ONE_TO_ONE,
+                                       relay_nodes[receivers[i]].public_key, num_messages=18, interval=10)
+                          for i in range(50)])
 
-    logger.info("Waiting 20 seconds")
-    await asyncio.sleep(20)
+    await wait_for_messages(relay_nodes, stats.sent, timeout=20, since=before_injection)
 
-    expected_messages = {f"Message {i}" for i in range(7)}
-    for receiver in receivers:
-        received_messages = {tup[1] for tup in relay_nodes[receiver].signal.signal_queues["messages.new"].messages if tup[1].startswith("Message ")}
-        missing_messages = expected_messages - received_messages
-        if missing_messages:
-            logger.error(f"{receiver} is missing messages, got {len(received_messages)}/{len(expected_messages)} messages")
+    audience = {relay_nodes[receiver].public_key: [receiver] for receiver in receivers}
+    DeliveryReport.build(relay_nodes, stats.sent_per_target, audience, "one_to_one", seq_ranges=stats.seq_ranges).log()
 
-    # TODO: Retrieve latencies
+    report_rpc_metrics(relay_nodes)
     logger.info("Shutting down node connections")
     await asyncio.gather(*[node.shutdown() for node in relay_nodes.values()])
     logger.info("Finished send_one_to_one_message")
@@ -159,8 +163,7 @@ async def create_private_group(consumers: int = 4):
     backend_relay_pods = kube_utils.get_pods("status-backend-relay", "status-go-test")
     relay_nodes = await initialize_nodes_application(backend_relay_pods)
 
-    logger.info("Waiting 60 seconds after nodes initialization")
-    await asyncio.sleep(60)
+    await wait_for_peers(relay_nodes, timeout=60)
 
     backend_relay_pods = [pod_name.split(".")[0] for pod_name in backend_relay_pods]
 
@@ -168,15 +171,17 @@ async def create_private_group(consumers: int = 4):
     members = backend_relay_pods[10:]
     members_pub_keys = [relay_nodes[node].public_key for node in members]
 
-    delays = await send_friend_requests_util(relay_nodes, admin_nodes, members, accept_friend_requests, consumers)
-    _ = await add_contacts(relay_nodes, admin_nodes, members)
-
-    await asyncio.sleep(30)
+    # Only the contacts are reused, creating the groups is what this scenario measures
+    contacts = await contacts_fixture("create_private_group", relay_nodes, admin_nodes, members, consumers=consumers)
+    if not contacts.reused:
+        _ = await add_contacts(relay_nodes, admin_nodes, members)
+        await wait_for_quiet(relay_nodes, quiet_period=5, timeout=30)
 
     # 1 admin to 10 users, no overlap
     await asyncio.gather(*[create_group_chat(relay_nodes[admin], members_pub_keys[10*i: (10*i)+10]) for i, admin in enumerate(admin_nodes)])
     # TODO check they really are in the group chat?
-    await asyncio.sleep(30)
+    await wait_for_quiet(relay_nodes, quiet_period=5, timeout=30)
+    report_rpc_metrics(relay_nodes)
     logger.info("Shutting down node connections")
     await asyncio.gather(*[node.shutdown() for node in relay_nodes.values()])
     logger.info("Finished create_private_group")
@@ -191,43 +196,40 @@ async def send_group_message(consumers: int = 4):
     backend_relay_pods = kube_utils.get_pods("status-backend-relay", "status-go-test")
     relay_nodes = await initialize_nodes_application(backend_relay_pods)
 
-    logger.info("Waiting 30 seconds after nodes initialization")
-    await asyncio.sleep(30)
+    await wait_for_peers(relay_nodes, timeout=60)
 
     backend_relay_pods = [pod_name.split(".")[0] for pod_name in backend_relay_pods]
 
     admin_nodes = backend_relay_pods[:2]
     members = backend_relay_pods[2:]
-    members_pub_keys = [relay_nodes[node].public_key for node in members]
-
-    delays = await send_friend_requests_util(relay_nodes, admin_nodes, members, accept_friend_requests, consumers)
-    _ = await add_contacts(relay_nodes, admin_nodes, members)
 
-    await asyncio.sleep(30)
+    contacts = await contacts_fixture("send_group_message", relay_nodes, admin_nodes, members, consumers=consumers)
+    if not contacts.reused:
+        _ = await add_contacts(relay_nodes, admin_nodes, members)
+        await wait_for_quiet(relay_nodes, quiet_period=5, timeout=30)
 
     # 1 admin to 10 users, no overlap
-    group_ids = await asyncio.gather(
-        *[create_group_chat(relay_nodes[admin], members_pub_keys[10 * i: (10 * i) + 10]) for i, admin in
-          enumerate(admin_nodes)])
+    groups = await group_chats_fixture("send_group_message", relay_nodes,
+                                       {admin: members[10 * i: (10 * i) + 10] for i, admin in enumerate(admin_nodes)})
+    group_ids = groups.group_ids
     # TODO check they really are in the group chat
-    await asyncio.sleep(30)
-
-    await asyncio.gather(*[
-        inject_messages_group_chat(relay_nodes[member],
-                                   delay_between_message=10,
-                                   group_id=group_ids[i // 10], # 10 first nodes to group 0, 10 to group 1, ...
-                                   num_messages=10) for i, member in enumerate(members)
+    if not groups.reused:
+        await wait_for_quiet(relay_nodes, quiet_period=5, timeout=30)
+
+    before_injection = await traffic_counters(relay_nodes)
+    stats = await inject([
+        InjectionJob(relay_nodes[member], InjectionTarget.GROUP,
+                     target_id=group_ids[i // 10], # 10 first nodes to group 0, 10 to group 1, ...
+                     num_messages=10, interval=10) for i, member in enumerate(members)
     ])
 
-    logger.info("Waiting 30 seconds")
-    await asyncio.sleep(30)
-    expected_messages = 100
-    for name, node in relay_nodes.items():
-        received_messages = [tup[1] for tup in node.signal.signal_queues["messages.new"].messages if
-                             tup[1].startswith("Message ")]
-        if len(received_messages) != expected_messages:
-            logger.error(f"{name} is missing messages, got {len(received_messages)}/{expected_messages} messages")
+    # Every message reaches the other 10 nodes of its group
+    await wait_for_messages(relay_nodes, stats.sent * 10, timeout=30, since=before_injection)
+
+    audience = {group_id: [admin_nodes[i]] + members[10 * i: (10 * i) + 10] for i, group_id in enumerate(group_ids)}
+    DeliveryReport.build(relay_nodes, stats.sent_per_target, audience, "group", seq_ranges=stats.seq_ranges).log()
 
+    report_rpc_metrics(relay_nodes)
     logger.info("Shutting down node connections")
     await asyncio.gather(*[node.shutdown() for node in relay_nodes.values()])
     logger.info("Finished send_group_message")
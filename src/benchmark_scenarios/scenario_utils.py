@@ -8,9 +8,13 @@ from typing import List, Callable, Optional, Awaitable
 
 # Project Imports
 import src.logger
-from src.async_utils import CollectedItem, cleanup_queue_on_event
+from src.async_utils import CollectedItem, cleanup_queue_on_event, AdaptiveConcurrency
+from src.histogram import get_latency_histograms
+from src.readiness import wait_for_quiet
 from src.setup_status import request_join_nodes_to_community, NodesInformation, \
-    send_friend_requests
+    send_friend_requests, friend_request_pairs, accept_community_requests, accept_friend_requests, create_group_chat
+from src.social_graph import COMMUNITY, CONTACTS, GROUP_CHATS, build_fixture, find_fixture, fixture_key, \
+    save_fixture
 
 logger = logging.getLogger(__name__)
 
@@ -23,11 +27,27 @@ class CommunitySetupResult:
     community_id: str
     chat_id: str
     join_delays: list[float]
+    # True when the community of a previous run was reused
+    reused: bool = False
+
+
+@dataclass(frozen=True)
+class ContactsSetupResult:
+    pairs: list[tuple[str, str]]
+    delays: list[float]
+    reused: bool = False
+
+
+@dataclass(frozen=True)
+class GroupChatsSetupResult:
+    group_ids: list[str]
+    reused: bool = False
 
 
 async def create_community_util(status_nodes: NodesInformation, owner: str, to_include: List[str],
                                 action: Action, intermediate_delay: int = 1,
-                                consumers: int = 4) -> Optional[CommunitySetupResult]:
+                                consumers: int = 4,
+                                concurrency: Optional[AdaptiveConcurrency] = None) -> Optional[CommunitySetupResult]:
     """
     Utility function to create a community specifying and owner, and a list of nodes to send requests. Action will
     be performed by the invited nodes, which will answer to the requests with the action. At the moment,
@@ -41,6 +61,7 @@ async def create_community_util(status_nodes: NodesInformation, owner: str, to_i
     :param action: Optional action to perform during community setup
     :param intermediate_delay: Delay between community node requests in seconds
     :param consumers: Number of asyncio tasks that will answer to the requests with the action
+    :param concurrency: Adaptive limit of in-flight community requests, replaces intermediate_delay when given
     :return: Community setup result or None if setup fails
     """
     name = f"test_community_{''.join(random.choices(string.ascii_letters, k=10))}"
@@ -57,7 +78,7 @@ async def create_community_util(status_nodes: NodesInformation, owner: str, to_i
     send_to_accept_task = asyncio.create_task(
         request_join_nodes_to_community(status_nodes, results_accept_queue, to_include,
                                         community_id, finished_accept_evt,
-                                        intermediate_delay))
+                                        intermediate_delay, concurrency=concurrency))
 
     if action is None:
         return None
@@ -71,20 +92,22 @@ async def create_community_util(status_nodes: NodesInformation, owner: str, to_i
     while not delays_queue.empty():
         join_delays.append(delays_queue.get_nowait())
 
-    logger.info(f"All nodes successfully joined community {community_id}. Delays are: {join_delays}")
-    logger.info(f"Waiting 10 seconds")
-    await asyncio.sleep(10)
+    logger.info(f"All nodes successfully joined community {community_id}")
+    get_latency_histograms().log_summary("community_join_accept")
+    await wait_for_quiet(status_nodes, quiet_period=2, timeout=10)
 
     return CommunitySetupResult(community_id=community_id, chat_id=chat_id, join_delays=join_delays)
 
 
 async def send_friend_requests_util(relay_nodes: NodesInformation, from_nodes, to_nodes, action: Action,
-                                    cap_num_receivers: Optional[int] = None, consumers: int = 4) -> List[float]:
+                                    cap_num_receivers: Optional[int] = None, consumers: int = 4,
+                                    concurrency: Optional[AdaptiveConcurrency] = None) -> List[float]:
     results_queue: asyncio.Queue[CollectedItem | None] = asyncio.Queue()
     finished_evt = asyncio.Event()
 
     send_task = asyncio.create_task(
-        send_friend_requests(relay_nodes, results_queue, from_nodes, to_nodes, finished_evt, cap_num_receivers))
+        send_friend_requests(relay_nodes, results_queue, from_nodes, to_nodes, finished_evt, cap_num_receivers,
+                             concurrency=concurrency))
 
     if action is None:
         return []
@@ -98,3 +121,69 @@ async def send_friend_requests_util(relay_nodes: NodesInformation, from_nodes, t
         delays.append(delays_queue.get_nowait())
 
     return delays
+
+
+async def community_fixture(name: str, status_nodes: NodesInformation, owner: str, to_include: List[str],
+                            action: Action, **kwargs) -> Optional[CommunitySetupResult]:
+    """
+    Same as create_community_util, but the community of a previous run of the same fixture is reused if all of
+    to_include are still members of it. kwargs are passed to create_community_util.
+    """
+    pods = [owner, *to_include]
+    key = fixture_key(name, pods)
+    fixture = await find_fixture(status_nodes, key, COMMUNITY, pods, owner=owner)
+    if fixture is not None:
+        logger.info(f"Reusing community {fixture.data['community_id']} of fixture {key}")
+        return CommunitySetupResult(community_id=fixture.data["community_id"], chat_id=fixture.data["chat_id"],
+                                    join_delays=[], reused=True)
+
+    result = await create_community_util(status_nodes, owner, to_include, action, **kwargs)
+    if result is not None and action is accept_community_requests:
+        save_fixture(key, build_fixture(COMMUNITY, status_nodes, pods, owner=owner, community_id=result.community_id,
+                                        chat_id=result.chat_id, members=list(to_include)))
+    return result
+
+
+async def contacts_fixture(name: str, relay_nodes: NodesInformation, from_nodes: List[str], to_nodes: List[str],
+                           cap_num_receivers: Optional[int] = None, consumers: int = 4,
+                           concurrency: Optional[AdaptiveConcurrency] = None) -> ContactsSetupResult:
+    """
+    Friend requests from from_nodes to to_nodes, accepted by to_nodes, as send_friend_requests_util does. The contacts
+    of a previous run of the same fixture are reused if they are all still mutual contacts.
+    """
+    pairs = friend_request_pairs(from_nodes, to_nodes, cap_num_receivers)
+    pods = list(dict.fromkeys([pod for pair in pairs for pod in pair]))
+    key = fixture_key(name, pods)
+    fixture = await find_fixture(relay_nodes, key, CONTACTS, pods, pairs=[list(pair) for pair in pairs])
+    if fixture is not None:
+        logger.info(f"Reusing {len(pairs)} contacts of fixture {key}")
+        return ContactsSetupResult(pairs=pairs, delays=[], reused=True)
+
+    delays = await send_friend_requests_util(relay_nodes, from_nodes, to_nodes, accept_friend_requests,
+                                             cap_num_receivers, consumers, concurrency)
+    save_fixture(key, build_fixture(CONTACTS, relay_nodes, pods, pairs=[list(pair) for pair in pairs]))
+    return ContactsSetupResult(pairs=pairs, delays=delays)
+
+
+async def group_chats_fixture(name: str, relay_nodes: NodesInformation,
+                              members_per_admin: dict[str, List[str]]) -> GroupChatsSetupResult:
+    """
+    One group chat per admin with its members, created with create_group_chat. The groups of a previous run of the
+    same fixture are reused if every admin and member is still in them. Group ids follow the order of
+    members_per_admin.
+    """
+    admins = list(members_per_admin)
+    pods = list(dict.fromkeys([pod for admin in admins for pod in [admin, *members_per_admin[admin]]]))
+    key = fixture_key(name, pods)
+    members_per_admin = {admin: list(members) for admin, members in members_per_admin.items()}
+    fixture = await find_fixture(relay_nodes, key, GROUP_CHATS, pods, members_per_admin=members_per_admin)
+    if fixture is not None:
+        logger.info(f"Reusing {len(admins)} group chats of fixture {key}")
+        return GroupChatsSetupResult(group_ids=fixture.data["group_ids"], reused=True)
+
+    group_ids = await asyncio.gather(*[
+        create_group_chat(relay_nodes[admin], [relay_nodes[member].public_key for member in members])
+        for admin, members in members_per_admin.items()])
+    save_fixture(key, build_fixture(GROUP_CHATS, relay_nodes, pods, members_per_admin=members_per_admin,
+                                    group_ids=list(group_ids)))
+    return GroupChatsSetupResult(group_ids=list(group_ids))
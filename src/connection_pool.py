@@ -0,0 +1,191 @@
+# Python Imports
+import logging
+import time
+from dataclasses import dataclass, asdict
+from types import SimpleNamespace
+from typing import Optional, cast
+from aiohttp import ClientConnectionError, ClientSession, ClientTimeout, TCPConnector, TraceConfig, \
+    TraceRequestStartParams, TraceRequestEndParams, TraceRequestExceptionParams, TraceConnectionCreateEndParams, \
+    TraceConnectionReuseconnParams, TraceConnectionQueuedStartParams, TraceConnectionQueuedEndParams, \
+    TraceConnectionCreateStartParams
+
+# Project Imports
+from src.logger import TraceLogger
+from src.pod_resolver import PodResolver, POD_ADDRESSES
+
+logger = cast(TraceLogger, logging.getLogger(__name__))
+
+
+@dataclass
+class PoolLimits:
+    # Total number of simultaneous HTTP connections for the whole process (0 means unlimited)
+    limit: int = 1000
+    # Simultaneous HTTP connections to a single status-backend pod
+    limit_per_host: int = 8
+    # Seconds an idle connection is kept open to be reused
+    keepalive_timeout: float = 60
+    # Seconds a hostname resolved with DNS is cached, pod addresses read from the Kubernetes API do not expire
+    ttl_dns_cache: int = 300
+    request_timeout: float = 10
+
+
+@dataclass
+class PoolStats:
+    requests_started: int = 0
+    requests_finished: int = 0
+    requests_failed: int = 0
+    connections_created: int = 0
+    connections_reused: int = 0
+    connections_queued: int = 0
+    # Accumulated seconds spent waiting for a free slot and creating new connections
+    queued_time: float = 0
+    connect_time: float = 0
+    websockets_opened: int = 0
+    websockets_closed: int = 0
+
+    @property
+    def in_flight(self) -> int:
+        return self.requests_started - self.requests_finished - self.requests_failed
+
+    @property
+    def reuse_ratio(self) -> float:
+        total = self.connections_created + self.connections_reused
+        return self.connections_reused / total if total else 0.0
+
+
+class ConnectionManager:
+    """
+    Process-wide owner of the aiohttp sessions used to talk to status-backend pods.
+
+    HTTP requests (RPC calls and statusgo API calls) share a single bounded connector, so the amount of sockets does
+    not grow with the amount of nodes. Websockets are long-lived and would permanently hold slots of a bounded pool,
+    so they use a separate unbounded connector. Both connectors share the same resolver and its cache.
+    """
+    def __init__(self, limits: Optional[PoolLimits] = None):
+        self.limits = limits or PoolLimits()
+        self.stats = PoolStats()
+        self.resolver = PodResolver(ttl=self.limits.ttl_dns_cache, use_api=POD_ADDRESSES == "api")
+        self._http_session: Optional[ClientSession] = None
+        self._ws_session: Optional[ClientSession] = None
+
+    def _trace_config(self) -> TraceConfig:
+        trace_config = TraceConfig()
+
+        async def on_request_start(_session: ClientSession, _ctx: SimpleNamespace, _params: TraceRequestStartParams):
+            self.stats.requests_started += 1
+
+        async def on_request_end(_session: ClientSession, _ctx: SimpleNamespace, _params: TraceRequestEndParams):
+            self.stats.requests_finished += 1
+
+        async def on_request_exception(_session: ClientSession, _ctx: SimpleNamespace,
+                                       params: TraceRequestExceptionParams):
+            self.stats.requests_failed += 1
+            self._on_connection_error(params)
+
+        async def on_connection_queued_start(_session: ClientSession, ctx: SimpleNamespace,
+                                             _params: TraceConnectionQueuedStartParams):
+            ctx.queued_start = time.perf_counter()
+            self.stats.connections_queued += 1
+
+        async def on_connection_queued_end(_session: ClientSession, ctx: SimpleNamespace,
+                                           _params: TraceConnectionQueuedEndParams):
+            self.stats.queued_time += time.perf_counter() - ctx.queued_start
+
+        async def on_connection_create_start(_session: ClientSession, ctx: SimpleNamespace,
+                                             _params: TraceConnectionCreateStartParams):
+            ctx.connect_start = time.perf_counter()
+
+        async def on_connection_create_end(_session: ClientSession, ctx: SimpleNamespace,
+                                           _params: TraceConnectionCreateEndParams):
+            self.stats.connections_created += 1
+            self.stats.connect_time += time.perf_counter() - ctx.connect_start
+
+        async def on_connection_reuseconn(_session: ClientSession, _ctx: SimpleNamespace,
+                                          _params: TraceConnectionReuseconnParams):
+            self.stats.connections_reused += 1
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_request_end.append(on_request_end)
+        trace_config.on_request_exception.append(on_request_exception)
+        trace_config.on_connection_queued_start.append(on_connection_queued_start)
+        trace_config.on_connection_queued_end.append(on_connection_queued_end)
+        trace_config.on_connection_create_start.append(on_connection_create_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        return trace_config
+
+    def _on_connection_error(self, params: TraceRequestExceptionParams):
+        # The pod may have restarted with a new IP, it is resolved again on the next connection
+        if isinstance(params.exception, ClientConnectionError) and params.url.host is not None:
+            self.resolver.invalidate(params.url.host)
+
+    def _ws_trace_config(self) -> TraceConfig:
+        trace_config = TraceConfig()
+
+        async def on_request_exception(_session: ClientSession, _ctx: SimpleNamespace,
+                                       params: TraceRequestExceptionParams):
+            self._on_connection_error(params)
+
+        trace_config.on_request_exception.append(on_request_exception)
+        return trace_config
+
+    @property
+    def http_session(self) -> ClientSession:
+        # Sessions are created lazily because they must be bound to the running event loop
+        if self._http_session is None or self._http_session.closed:
+            # The resolver caches lookups itself, a connector cache would keep the old IP of restarted pods
+            connector = TCPConnector(limit=self.limits.limit, limit_per_host=self.limits.limit_per_host,
+                                     keepalive_timeout=self.limits.keepalive_timeout, resolver=self.resolver,
+                                     use_dns_cache=False)
+            self._http_session = ClientSession(connector=connector,
+                                               timeout=ClientTimeout(total=self.limits.request_timeout),
+                                               trace_configs=[self._trace_config()])
+        return self._http_session
+
+    @property
+    def ws_session(self) -> ClientSession:
+        if self._ws_session is None or self._ws_session.closed:
+            connector = TCPConnector(limit=0, resolver=self.resolver, use_dns_cache=False)
+            self._ws_session = ClientSession(connector=connector, trace_configs=[self._ws_trace_config()])
+        return self._ws_session
+
+    def websocket_opened(self):
+        self.stats.websockets_opened += 1
+
+    def websocket_closed(self):
+        self.stats.websockets_closed += 1
+
+    def snapshot(self) -> dict:
+        snapshot = asdict(self.stats)
+        snapshot["in_flight"] = self.stats.in_flight
+        snapshot["reuse_ratio"] = round(self.stats.reuse_ratio, 4)
+        snapshot["open_websockets"] = self.stats.websockets_opened - self.stats.websockets_closed
+        snapshot["resolver"] = dict(self.resolver.stats)
+        return snapshot
+
+    def log_stats(self):
+        logger.info(f"Connection pool stats: {self.snapshot()}")
+
+    async def close(self):
+        for session in (self._http_session, self._ws_session):
+            if session is not None and not session.closed:
+                await session.close()
+        self._http_session = None
+        self._ws_session = None
+        await self.resolver.close()
+
+
+_connection_manager: Optional[ConnectionManager] = None
+
+
+def get_connection_manager() -> ConnectionManager:
+    global _connection_manager
+    if _connection_manager is None:
+        _connection_manager = ConnectionManager()
+    return _connection_manager
+
+
+def configure_connection_manager(limits: PoolLimits) -> ConnectionManager:
+    global _connection_manager
+    _connection_manager = ConnectionManager(limits)
+    return _connection_manager
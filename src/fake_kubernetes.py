@@ -0,0 +1,99 @@
+# Python Imports
+import threading
+import time
+from collections.abc import Iterator
+from dataclasses import replace
+from typing import Optional
+
+# Project Imports
+from src.pod_discovery import PodEvent, StatefulSetInfo, WatchExpired
+
+
+class FakePodApi:
+    """
+    In-process stand-in of the Kubernetes API for pod_discovery.PodDiscovery, to run the discovery without a cluster.
+    StatefulSets are added with their replicas not ready, and pods change with set_ready, delete_pod, or in the
+    background with ramp_up. Every change gets a resource version, watches resume from the one they are given and
+    raise WatchExpired if it is older than the last expire_watches call.
+    """
+    def __init__(self, namespace: str = "status-go-test"):
+        self.namespace = namespace
+        self.stateful_sets: dict[str, StatefulSetInfo] = {}
+        self.pods: dict[str, PodEvent] = {}
+        self._labels: dict[str, str] = {}
+        self._events: list[tuple[int, str, PodEvent]] = []
+        self._expired_before = 0
+        self._changed = threading.Condition()
+
+    def add_stateful_set(self, name: str, replicas: int, service_name: Optional[str] = None):
+        with self._changed:
+            self.stateful_sets[name] = StatefulSetInfo(name, replicas, service_name or name, f"app={name}")
+        for ordinal in range(replicas):
+            self._change(f"{name}-{ordinal}", f"app={name}", PodEvent(f"{name}-{ordinal}", ready=False))
+
+    def set_ready(self, pod: str, ready: bool = True, ip: Optional[str] = None):
+        ip = ip or f"10.0.{len(self._events) // 250 % 250}.{len(self._events) % 250 + 1}"
+        self._change(pod, self._labels[pod], PodEvent(pod, ready=ready, ip=ip if ready else None))
+
+    def delete_pod(self, pod: str):
+        self._change(pod, self._labels[pod], PodEvent(pod, ready=False, deleted=True))
+
+    def expire_watches(self):
+        with self._changed:
+            self._expired_before = len(self._events)
+            self._changed.notify_all()
+
+    def ramp_up(self, name: str, interval: float, ip: Optional[str] = None) -> threading.Thread:
+        """
+        Makes the pods of a StatefulSet ready one by one, every interval seconds, like a rolling start. ip is the
+        address of every pod, 127.0.0.1 to reach a local mock status-backend.
+        """
+        def _run():
+            for ordinal in range(self.stateful_sets[name].replicas):
+                time.sleep(interval)
+                self.set_ready(f"{name}-{ordinal}", ip=ip)
+
+        thread = threading.Thread(target=_run, name=f"ramp-up-{name}", daemon=True)
+        thread.start()
+        return thread
+
+    def _change(self, pod: str, labels: str, event: PodEvent):
+        with self._changed:
+            self._labels[pod] = labels
+            version = len(self._events) + 1
+            event = replace(event, resource_version=str(version))
+            if event.deleted:
+                self.pods.pop(pod, None)
+            else:
+                self.pods[pod] = event
+            self._events.append((version, labels, event))
+            self._changed.notify_all()
+
+    def read_stateful_set(self, name: str, namespace: str) -> StatefulSetInfo:
+        if namespace != self.namespace or name not in self.stateful_sets:
+            raise LookupError(f"StatefulSet {name} not found in {namespace}")
+        return self.stateful_sets[name]
+
+    def list_pods(self, namespace: str, label_selector: str) -> tuple[list[PodEvent], str]:
+        with self._changed:
+            pods = [event for pod, event in self.pods.items() if self._labels[pod] == label_selector]
+            return pods, str(len(self._events))
+
+    def watch_pods(self, namespace: str, label_selector: str, resource_version: str,
+                   timeout_seconds: int) -> Iterator[PodEvent]:
+        deadline = time.monotonic() + timeout_seconds
+        version = int(resource_version)
+        while True:
+            with self._changed:
+                if version < self._expired_before:
+                    raise WatchExpired(f"Resource version {version} is too old")
+                if version == len(self._events):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return
+                    self._changed.wait(remaining)
+                    continue
+                events = self._events[version:]
+            for version, labels, event in events:
+                if labels == label_selector:
+                    yield event
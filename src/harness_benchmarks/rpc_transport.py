@@ -0,0 +1,82 @@
+# Python Imports
+import argparse
+import json
+import random
+import time
+
+# Project Imports
+from src import json_codec
+from src.rpc_client import decode_json_response
+
+
+def _chat(index: int) -> dict:
+    return {
+        "id": f"0x{random.getrandbits(256):064x}-{index}", "name": f"chat-{index}", "description": "x" * 100,
+        "color": "#ffffff", "emoji": "", "permissions": {"access": 1, "ensOnly": False},
+        "members": {f"0x04{random.getrandbits(512):0128x}": {"roles": [1]} for _ in range(5)},
+        "canPost": True, "viewersCanPostReactions": True, "position": index, "categoryID": "",
+    }
+
+
+def _community(index: int, chats: int) -> dict:
+    return {
+        "id": f"0x{random.getrandbits(264):066x}", "name": f"community-{index}", "description": "x" * 500,
+        "admin": False, "joined": True, "spectated": False, "verified": False, "encrypted": False,
+        "chats": {f"chat-{chat}": _chat(chat) for chat in range(chats)},
+        "members": {f"0x04{random.getrandbits(512):0128x}": {"roles": [1]} for _ in range(50)},
+        "tokenPermissions": {}, "communityTokensMetadata": [], "images": {},
+    }
+
+
+def build_response(communities: int, chats: int) -> bytes:
+    # Same shape as acceptRequestToJoinCommunity, which returns every community of the node with all its chats
+    result = {"communities": [_community(index, chats) for index in range(communities)],
+              "chats": [], "messages": [], "activityCenterNotifications": []}
+    return json.dumps({"jsonrpc": "2.0", "id": 1, "result": result}).encode()
+
+
+def bench_baseline(body: bytes, calls: int) -> float:
+    # Replicates the previous path: body read as text, parsed again as JSON and serialized twice for trace logs
+    payload = {"jsonrpc": "2.0", "method": "wakuext_acceptRequestToJoinCommunity", "id": 1, "params": [{"id": "x"}]}
+    start = time.process_time()
+    for _ in range(calls):
+        _ = json.dumps(payload)
+        _ = f"Sending async POST with data: {json.dumps(payload, sort_keys=True)}"
+        text = body.decode()
+        resp_json = json.loads(text)
+        _ = f"Received response: {json.dumps(resp_json, sort_keys=True)}"
+    return (time.process_time() - start) / calls
+
+
+def bench_single_pass(body: bytes, calls: int) -> float:
+    payload = {"jsonrpc": "2.0", "method": "wakuext_acceptRequestToJoinCommunity", "id": 1, "params": [{"id": "x"}]}
+    start = time.process_time()
+    for _ in range(calls):
+        _ = json_codec.dumps_bytes(payload)
+        _ = decode_json_response(200, body)
+    return (time.process_time() - start) / calls
+
+
+def run(calls: int = 200, sizes: tuple[tuple[int, int], ...] = ((1, 5), (10, 20), (50, 40))) -> dict:
+    random.seed(0)
+    results = []
+    for communities, chats in sizes:
+        body = build_response(communities, chats)
+        baseline = bench_baseline(body, calls)
+        single_pass = bench_single_pass(body, calls)
+        results.append({
+            "communities": communities,
+            "chats_per_community": chats,
+            "response_bytes": len(body),
+            "baseline_cpu_ms_per_call": round(baseline * 1000, 4),
+            "single_pass_cpu_ms_per_call": round(single_pass * 1000, 4),
+            "speedup": round(baseline / single_pass, 2) if single_pass else None,
+        })
+    return {"benchmark": "rpc_transport", "json_backend": json_codec.BACKEND, "calls": calls, "results": results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CPU cost per call of handling JSON-RPC responses")
+    parser.add_argument("--calls", type=int, default=200)
+    args = parser.parse_args()
+    print(json.dumps(run(args.calls)))
@@ -0,0 +1,91 @@
+# Python Imports
+import argparse
+import asyncio
+import json
+import random
+import time
+
+# Project Imports
+from src import json_codec
+from src.signal_client import AsyncSignalClient
+from src.signal_decoding import decode_signal
+
+AWAITED_SIGNALS = ["messages.new", "message.delivered", "node.ready", "node.started", "node.login", "node.stopped"]
+
+
+def _message(index: int) -> dict:
+    return {
+        "id": f"0x{index:064x}", "chatId": f"0x{random.getrandbits(256):064x}", "text": f"Message {index}",
+        "timestamp": 1_700_000_000_000 + index, "from": f"0x04{random.getrandbits(512):0128x}", "contentType": 1,
+        "parsedText": [{"type": "paragraph", "children": [{"literal": f"Message {index}"}]}],
+        "identicon": "", "seen": False, "quotedMessage": None, "rtl": False, "lineCount": 0, "replace": "",
+        "responseTo": "", "ensName": "", "sticker": None, "commandParameters": None, "links": [],
+        "mentioned": False, "gapParameters": {}, "compressedKey": "zQ3sh" + "x" * 44,
+    }
+
+
+def build_frames(count: int, awaited_ratio: float = 0.2) -> list[str]:
+    # Most signals of a chatty node are wallet and history updates that the benchmarks discard
+    frames = []
+    for index in range(count):
+        if random.random() < awaited_ratio:
+            signal = {"type": "messages.new", "event": {"messages": [_message(index)], "chats": [{"id": "x" * 66}]}}
+        else:
+            signal = random.choice([
+                {"type": "wallet", "event": {"type": "wallet-tick-reload", "blockNumber": index,
+                                             "accounts": [f"0x{random.getrandbits(160):040x}" for _ in range(20)],
+                                             "message": "x" * 2000}},
+                {"type": "history.request.completed", "event": {"requestId": f"{index}", "peers": ["x" * 200] * 5}},
+                {"type": "mediaserver.started", "event": {"port": 12345}},
+            ])
+        signal["timestamp"] = 1_700_000_000 + index
+        frames.append(json.dumps(signal))
+    return frames
+
+
+def bench_baseline(frames: list[str], awaited: set[str]) -> float:
+    # Replicates the previous pipeline: full json.loads and an eagerly formatted trace f-string for every frame
+    start = time.perf_counter()
+    for frame in frames:
+        signal_data = json.loads(frame)
+        _ = f"Received WebSocket message: {signal_data}"
+        _ = signal_data.get("type") in awaited
+    return len(frames) / (time.perf_counter() - start)
+
+
+def bench_fast_path(frames: list[str], awaited: set[str]) -> float:
+    start = time.perf_counter()
+    for frame in frames:
+        decode_signal(frame, awaited)
+    return len(frames) / (time.perf_counter() - start)
+
+
+async def bench_on_message(frames: list[str]) -> float:
+    client = AsyncSignalClient("ws://localhost:3333", AWAITED_SIGNALS)
+    start = time.perf_counter()
+    for frame in frames:
+        await client.on_message(frame)
+    return len(frames) / (time.perf_counter() - start)
+
+
+def run(count: int = 50_000, awaited_ratio: float = 0.2) -> dict:
+    random.seed(0)
+    frames = build_frames(count, awaited_ratio)
+    awaited = set(AWAITED_SIGNALS)
+    return {
+        "benchmark": "signal_decoding",
+        "json_backend": json_codec.BACKEND,
+        "frames": count,
+        "awaited_ratio": awaited_ratio,
+        "baseline_signals_per_second": round(bench_baseline(frames, awaited)),
+        "fast_path_signals_per_second": round(bench_fast_path(frames, awaited)),
+        "on_message_signals_per_second": round(asyncio.run(bench_on_message(frames))),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Signals per second of the signal decoding pipeline")
+    parser.add_argument("--frames", type=int, default=50_000)
+    parser.add_argument("--awaited-ratio", type=float, default=0.2)
+    args = parser.parse_args()
+    print(json.dumps(run(args.frames, args.awaited_ratio)))
@@ -0,0 +1,257 @@
+# Python Imports
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import random
+import socket
+import subprocess
+import sys
+import time
+import tracemalloc
+from functools import partial
+from pathlib import Path
+from typing import Optional
+
+# Project Imports
+from src import json_codec
+from src.async_utils import launch_workers, AdaptiveConcurrency, TaskResult
+from src.connection_pool import ConnectionManager
+from src.enums import MessageContentType
+from src.harness_benchmarks.signal_decoding import AWAITED_SIGNALS, build_frames
+from src.setup_status import get_messages_by_content_type
+from src.signal_client import AsyncSignalClient
+from src.status_backend import StatusBackend
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+
+# Metrics are compared by their suffix, the ones with other suffixes are only informative
+HIGHER_IS_BETTER = ("_per_second",)
+LOWER_IS_BETTER = ("_us", "_ms", "_bytes")
+
+
+def commit_hash() -> str:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_ROOT,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{commit}-dirty" if dirty else commit
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class MockBackendProcess:
+    """
+    Runs the mock status-backend in its own process, so its CPU time is not counted as harness time.
+    """
+    def __init__(self, *args: str):
+        self.port = _free_port()
+        self.args = args
+        self.process: Optional[subprocess.Popen] = None
+
+    def node_url(self, node: str) -> str:
+        return f"http://127.0.0.1:{self.port}/{node}"
+
+    async def __aenter__(self) -> "MockBackendProcess":
+        self.process = subprocess.Popen([sys.executable, "-m", "src.mock_status_backend", "--port", str(self.port),
+                                         "--signal-latency", "0", *self.args], cwd=REPO_ROOT,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                _, writer = await asyncio.open_connection("127.0.0.1", self.port)
+                writer.close()
+                return self
+            except OSError:
+                await asyncio.sleep(0.1)
+        self.process.kill()
+        raise TimeoutError(f"Mock status-backend did not start on port {self.port}")
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.process.terminate()
+        self.process.wait()
+
+
+async def _start_nodes(mock: MockBackendProcess, manager: ConnectionManager, count: int,
+                       prefix: str = "bench") -> list[StatusBackend]:
+    async def _start(index: int) -> StatusBackend:
+        node = StatusBackend(mock.node_url(f"{prefix}-{index}"), AWAITED_SIGNALS, connection_manager=manager)
+        await node.start_status_backend()
+        await node.create_account_and_login()
+        return node
+
+    return list(await asyncio.gather(*[_start(index) for index in range(count)]))
+
+
+async def bench_rpc(mock: MockBackendProcess, calls: int, concurrency: int, batch_size: int) -> dict:
+    manager = ConnectionManager()
+    node, = await _start_nodes(mock, manager, 1, "rpc")
+    slots = asyncio.Semaphore(concurrency)
+
+    async def _call():
+        async with slots:
+            await node.rpc.rpc_valid_request("wakuext_startMessenger")
+
+    async def _batch():
+        async with slots:
+            await node.rpc.rpc_valid_batch_request([("wakuext_startMessenger", [])] * batch_size)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[_call() for _ in range(calls)])
+    single = time.perf_counter() - start
+
+    start = time.perf_counter()
+    await asyncio.gather(*[_batch() for _ in range(calls // batch_size)])
+    batched = time.perf_counter() - start
+
+    await node.close()
+    await manager.close()
+    return {"calls": calls, "concurrency": concurrency, "batch_size": batch_size,
+            "rpc_per_second": round(calls / single), "batched_rpc_per_second": round(calls / batched)}
+
+
+async def bench_signals(frames: int) -> dict:
+    results: dict = {"frames": frames}
+    for name, awaited_ratio in (("messages_new", 1.0), ("mixed", 0.2)):
+        random.seed(0)
+        signal_frames = build_frames(frames, awaited_ratio)
+        client = AsyncSignalClient("ws://localhost:3333", AWAITED_SIGNALS, node_name="bench")
+        start = time.perf_counter()
+        for frame in signal_frames:
+            await client.on_message(frame)
+        results[f"{name}_signals_per_second"] = round(frames / (time.perf_counter() - start))
+    return results
+
+
+async def _noop(_nodes: None, _sender: int, _receiver: int):
+    return None
+
+
+async def bench_launch_workers(tasks: int) -> dict:
+    results: dict = {"tasks": tasks}
+    for name, max_in_flight, concurrency in (("unbounded", 0, None), ("bounded", 64, None),
+                                             ("adaptive", 0, AdaptiveConcurrency("bench", initial=64))):
+        workers = [partial(_noop, None, index, index) for index in range(tasks)]
+        done_queue: asyncio.Queue[TaskResult | None] = asyncio.Queue()
+        start = time.perf_counter()
+        await launch_workers(workers, done_queue, 0, max_in_flight, concurrency)
+        while done_queue.qsize() < tasks:
+            await asyncio.sleep(0)
+        results[f"{name}_overhead_us"] = round((time.perf_counter() - start) / tasks * 1e6, 2)
+    return results
+
+
+def _messages_response(messages: int) -> dict:
+    content_types = [MessageContentType.TEXT_PLAIN.value] * 9 + [MessageContentType.CONTACT_REQUEST.value]
+    return {"jsonrpc": "2.0", "id": 1, "result": {"messages": [
+        {"id": f"0x{index:064x}", "text": f"Message {index}", "chatId": "x" * 66,
+         "contentType": content_types[index % 10], "timestamp": 1_700_000_000_000 + index,
+         "from": f"0x04{index:0128x}", "parsedText": [{"literal": "x" * 50}]}
+        for index in range(messages)]}}
+
+
+async def bench_content_type_filter(sizes: tuple[int, ...], calls: int) -> dict:
+    results: dict = {"calls": calls}
+    for messages in sizes:
+        response = _messages_response(messages)
+        start = time.perf_counter()
+        for _ in range(calls):
+            await get_messages_by_content_type(response, MessageContentType.CONTACT_REQUEST.value)
+        results[f"messages_{messages}_ms"] = round((time.perf_counter() - start) / calls * 1000, 4)
+        start = time.perf_counter()
+        for _ in range(calls):
+            await get_messages_by_content_type(response, MessageContentType.CONTACT_REQUEST.value, "Message 9")
+        results[f"messages_{messages}_pattern_ms"] = round((time.perf_counter() - start) / calls * 1000, 4)
+    return results
+
+
+async def bench_memory(mock: MockBackendProcess, nodes: int) -> dict:
+    # Python allocations of logged in nodes with their websocket connected, sockets and buffers of the OS excluded
+    manager = ConnectionManager()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    started = await _start_nodes(mock, manager, nodes, "memory")
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    await asyncio.gather(*[node.close() for node in started])
+    await manager.close()
+    return {"nodes": nodes, "memory_per_node_bytes": round((after - before) / nodes)}
+
+
+async def run_suite(args: argparse.Namespace) -> dict:
+    results = {
+        "signals": await bench_signals(args.frames),
+        "launch_workers": await bench_launch_workers(args.tasks),
+        "get_messages_by_content_type": await bench_content_type_filter((100, 1_000, 10_000), args.filter_calls),
+    }
+    async with MockBackendProcess("--latency", str(args.latency)) as mock:
+        results["rpc"] = await bench_rpc(mock, args.calls, args.concurrency, args.batch_size)
+        results["memory"] = await bench_memory(mock, args.nodes)
+    return results
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Returns the metrics of current that are worse than in baseline by more than tolerance (fraction).
+    """
+    regressions = []
+    for benchmark, metrics in current["results"].items():
+        for metric, value in metrics.items():
+            previous = baseline.get("results", {}).get(benchmark, {}).get(metric)
+            if not previous or not isinstance(value, (int, float)):
+                continue
+            if metric.endswith(HIGHER_IS_BETTER) and value < previous * (1 - tolerance) or \
+                    metric.endswith(LOWER_IS_BETTER) and value > previous * (1 + tolerance):
+                regressions.append(f"{benchmark}.{metric}: {previous} -> {value} "
+                                   f"({(value - previous) / previous:+.1%}) against {baseline.get('commit')}")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Throughput and overhead of the harness itself, measured against "
+                                                 "the mock status-backend")
+    parser.add_argument("--calls", type=int, default=5_000, help="RPC calls")
+    parser.add_argument("--concurrency", type=int, default=64, help="RPC calls in flight")
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0, help="Latency of the mock backend, in seconds")
+    parser.add_argument("--frames", type=int, default=50_000, help="Signals decoded")
+    parser.add_argument("--tasks", type=int, default=20_000, help="Tasks launched by launch_workers")
+    parser.add_argument("--filter-calls", type=int, default=200, help="Calls per response size")
+    parser.add_argument("--nodes", type=int, default=200, help="Nodes connected to measure memory")
+    parser.add_argument("--output", help="Also write the results to this file")
+    parser.add_argument("--baseline", help="Results of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Fraction a metric can be worse than the baseline before it is a regression")
+    args = parser.parse_args()
+    # The harness logs to stdout too, only warnings are kept so the output stays valid JSON
+    logging.getLogger("src").setLevel(logging.WARNING)
+
+    report = {
+        "suite": "harness",
+        "commit": commit_hash(),
+        "timestamp": int(time.time()),
+        "python": platform.python_version(),
+        "json_backend": json_codec.BACKEND,
+        "results": asyncio.run(run_suite(args)),
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["regressions"] = compare(report, json.load(f), args.tolerance)
+
+    output = json.dumps(report, indent=1)
+    print(output)
+    if args.output:
+        Path(args.output).write_text(output)
+    return 1 if report.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
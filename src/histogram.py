@@ -0,0 +1,191 @@
+# Python Imports
+import json
+import logging
+import math
+from pathlib import Path
+from typing import Optional
+
+# Project Imports
+
+logger = logging.getLogger(__name__)
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class LatencyHistogram:
+    """
+    HDR-style histogram with log-linear buckets. Values are kept with significant_digits of precision at any
+    magnitude, so memory depends on the range of the values and not on how many of them are recorded.
+
+    Values are recorded in seconds and quantized to resolution seconds.
+    """
+    def __init__(self, significant_digits: int = 2, resolution: float = 0.001):
+        self.significant_digits = significant_digits
+        self.resolution = resolution
+        self._sub_bucket_bits = math.ceil(math.log2(2 * 10 ** significant_digits))
+        self._sub_bucket_count = 1 << self._sub_bucket_bits
+        self._half_count = self._sub_bucket_count // 2
+        self.counts: dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+        # Negative values, due to clock differences between nodes, are recorded as 0 and counted here
+        self.negative = 0
+
+    def _index(self, units: int) -> int:
+        if units < self._sub_bucket_count:
+            return units
+        shift = units.bit_length() - self._sub_bucket_bits
+        sub_bucket = units >> shift
+        return self._sub_bucket_count + (shift - 1) * self._half_count + (sub_bucket - self._half_count)
+
+    def _bucket_value(self, index: int) -> float:
+        # Middle of the range of values that fall in the bucket
+        if index < self._sub_bucket_count:
+            return index * self.resolution
+        shift = (index - self._sub_bucket_count) // self._half_count + 1
+        sub_bucket = (index - self._sub_bucket_count) % self._half_count + self._half_count
+        lowest = sub_bucket << shift
+        return (lowest + ((1 << shift) - 1) / 2) * self.resolution
+
+    def record(self, value: float, count: int = 1):
+        if value < 0:
+            self.negative += count
+            value = 0.0
+        index = self._index(int(value / self.resolution))
+        self.counts[index] = self.counts.get(index, 0) + count
+        self.count += count
+        self.total += value * count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        if not self.count:
+            return None
+        target = max(1, math.ceil(self.count * percentile / 100))
+        accumulated = 0
+        for index in sorted(self.counts):
+            accumulated += self.counts[index]
+            if accumulated >= target:
+                return min(self._bucket_value(index), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.total / self.count if self.count else None
+
+    def merge(self, other: "LatencyHistogram"):
+        if (other.significant_digits, other.resolution) != (self.significant_digits, self.resolution):
+            raise ValueError("Histograms with different precision cannot be merged")
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.negative += other.negative
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def buckets(self) -> list[tuple[float, int]]:
+        # (value, count) of the non-empty buckets, from the lowest value
+        return [(self._bucket_value(index), count) for index, count in sorted(self.counts.items())]
+
+    def summary(self) -> dict:
+        summary = {"count": self.count, "mean": self.mean, "max": self.max}
+        for percentile in PERCENTILES:
+            summary[f"p{percentile}"] = self.percentile(percentile)
+        if self.negative:
+            summary["negative"] = self.negative
+        return summary
+
+    def to_dict(self) -> dict:
+        return {"significant_digits": self.significant_digits, "resolution": self.resolution,
+                "counts": {str(index): count for index, count in self.counts.items()}, "count": self.count,
+                "total": self.total, "min": self.min, "max": self.max, "negative": self.negative}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "LatencyHistogram":
+        histogram = cls(data["significant_digits"], data["resolution"])
+        histogram.counts = {int(index): count for index, count in data["counts"].items()}
+        histogram.count = data["count"]
+        histogram.total = data["total"]
+        histogram.min = data["min"]
+        histogram.max = data["max"]
+        histogram.negative = data.get("negative", 0)
+        return histogram
+
+
+def node_class(node_name: str) -> str:
+    if "light" in node_name:
+        return "light"
+    if "relay" in node_name:
+        return "relay"
+    return "other"
+
+
+class HistogramRegistry:
+    """
+    Latency histograms per (phase, node class). Registries can be saved and merged, to aggregate several runs.
+    """
+    def __init__(self, significant_digits: int = 2, resolution: float = 0.001):
+        self.significant_digits = significant_digits
+        self.resolution = resolution
+        self.histograms: dict[tuple[str, str], LatencyHistogram] = {}
+
+    def histogram(self, phase: str, klass: str) -> LatencyHistogram:
+        key = (phase, klass)
+        if key not in self.histograms:
+            self.histograms[key] = LatencyHistogram(self.significant_digits, self.resolution)
+        return self.histograms[key]
+
+    def record(self, phase: str, node_name: str, value: float):
+        self.histogram(phase, node_class(node_name)).record(value)
+
+    def summary(self, phase: Optional[str] = None) -> dict[str, dict[str, dict]]:
+        summary: dict[str, dict[str, dict]] = {}
+        for (histogram_phase, klass), histogram in sorted(self.histograms.items()):
+            if phase is None or phase == histogram_phase:
+                summary.setdefault(histogram_phase, {})[klass] = histogram.summary()
+        return summary
+
+    def log_summary(self, phase: Optional[str] = None):
+        for histogram_phase, classes in self.summary(phase).items():
+            for klass, summary in classes.items():
+                logger.info(f"Latencies of {histogram_phase} ({klass}): {summary}")
+
+    def merge(self, other: "HistogramRegistry"):
+        for (phase, klass), histogram in other.histograms.items():
+            self.histogram(phase, klass).merge(histogram)
+
+    def to_dict(self) -> dict:
+        return {f"{phase}/{klass}": histogram.to_dict() for (phase, klass), histogram in self.histograms.items()}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "HistogramRegistry":
+        registry = cls()
+        for key, histogram_data in data.items():
+            phase, klass = key.rsplit("/", 1)
+            histogram = LatencyHistogram.from_dict(histogram_data)
+            registry.significant_digits, registry.resolution = histogram.significant_digits, histogram.resolution
+            registry.histograms[(phase, klass)] = histogram
+        return registry
+
+    def save(self, path: str | Path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path: str | Path) -> "HistogramRegistry":
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+
+_latency_histograms: Optional[HistogramRegistry] = None
+
+
+def get_latency_histograms() -> HistogramRegistry:
+    global _latency_histograms
+    if _latency_histograms is None:
+        _latency_histograms = HistogramRegistry()
+    return _latency_histograms
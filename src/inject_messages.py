@@ -1,66 +1,183 @@
 # Python Imports
 import asyncio
+import heapq
 import logging
+import time
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Optional
 
 # Project Imports
+from src.histogram import get_latency_histograms
+from src.message_tracking import sender_registry, encode_payload
+from src.metrics_server import get_metrics_registry
+from src.result_sink import record_result
+from src.sharding import measured_phase
 from src.status_backend import StatusBackend
 
 logger = logging.getLogger(__name__)
 
-async def inject_messages(pod: StatusBackend, delay_between_message: float, chat_id: str, num_messages: int):
-    for message_count in range(num_messages):
-        try:
-            logger.debug(f"Sending message {message_count}")
-            await pod.wakuext_service.send_chat_message(chat_id, f"Message {message_count}")
-
-            if message_count == 0:
-                logger.info(f"Successfully began sending {num_messages} messages")
-            elif message_count % 10 == 0:
-                logger.debug(f"Sent {message_count} messages")
-
-            await asyncio.sleep(delay_between_message)
-
-        except AssertionError as e:
-            logger.error(f"Error sending message: {e}")
-            await asyncio.sleep(1)
-
-    logger.info(f"Finished sending {num_messages} messages")
 
-# TODO merge in same function
-async def inject_messages_one_to_one(pod: StatusBackend, delay_between_message: float, contact_id: str, num_messages: int):
-    for message_count in range(num_messages):
+class InjectionTarget(Enum):
+    CHAT = "chat"
+    ONE_TO_ONE = "one_to_one"
+    GROUP = "group"
+
+
+@dataclass
+class InjectionJob:
+    pod: StatusBackend
+    target: InjectionTarget
+    # Chat id, contact public key or group id, depending on the target
+    target_id: str
+    num_messages: int
+    interval: float
+    # Seconds after the start of the injection for the first message of this job
+    start_offset: float = 0
+
+
+@dataclass
+class SendRecord:
+    sender: str
+    target_id: str
+    message: str
+    # Unix timestamps in seconds
+    intended: float
+    actual: float
+    completed: Optional[float] = None
+    error: Optional[str] = None
+
+    @property
+    def lag(self) -> float:
+        return self.actual - self.intended
+
+
+@dataclass
+class InjectionStats:
+    sent: int = 0
+    failed: int = 0
+    max_lag: float = 0
+    # Successfully sent messages per (sender, target id)
+    sent_per_target: dict[tuple[str, str], int] = field(default_factory=dict)
+    # First and last + 1 sequence numbers of the messages sent per (sender, target id), for DeliveryReport.build
+    seq_ranges: dict[tuple[str, str], tuple[int, int]] = field(default_factory=dict)
+    records: list[SendRecord] = field(default_factory=list)
+
+
+class InjectionScheduler:
+    """
+    Open-loop message injector. Every message has an absolute intended send time, kept in a heap, and a single
+    dispatcher coroutine launches each send when it is due without waiting for the previous one to complete. This way
+    slow responses do not lower the injection rate (no coordinated omission), and the schedule does not drift.
+    """
+    def __init__(self, jobs: list[InjectionJob], keep_records: bool = True):
+        self.jobs = jobs
+        self.keep_records = keep_records
+        self.stats = InjectionStats()
+        self._in_flight: set[asyncio.Task] = set()
+
+    def message_text(self, job: InjectionJob, message_count: int) -> str:
+        # The payload carries the sender, target, sequence number and send time, so receivers can compute latencies
+        sender_id = sender_registry.sender_id(job.pod.name)
+        target_id = sender_registry.target_id(job.target_id)
+        seq = sender_registry.next_seq(sender_id, target_id)
+        key = (job.pod.name, job.target_id)
+        first, _ = self.stats.seq_ranges.get(key, (seq, seq))
+        self.stats.seq_ranges[key] = (first, seq + 1)
+        return encode_payload(f"Message {message_count}", job.target.value, sender_id, target_id, seq)
+
+    async def _send(self, job: InjectionJob, message_count: int, intended: float):
+        text = self.message_text(job, message_count)
+        record = SendRecord(sender=job.pod.name, target_id=job.target_id, message=text,
+                            intended=intended, actual=time.time())
+        self.stats.max_lag = max(self.stats.max_lag, record.lag)
         try:
-            logger.debug(f"Sending message {message_count}")
-            await pod.wakuext_service.send_one_to_one_message(contact_id, f"Message {message_count}")
+            if job.target == InjectionTarget.CHAT:
+                await job.pod.wakuext_service.send_chat_message(job.target_id, text)
+            elif job.target == InjectionTarget.ONE_TO_ONE:
+                await job.pod.wakuext_service.send_one_to_one_message(job.target_id, text)
+            else:
+                await job.pod.wakuext_service.send_group_chat_message(job.target_id, text)
+            record.completed = time.time()
+            self.stats.sent += 1
+            key = (job.pod.name, job.target_id)
+            self.stats.sent_per_target[key] = self.stats.sent_per_target.get(key, 0) + 1
+            histograms = get_latency_histograms()
+            histograms.record("injection_send_lag", job.pod.name, record.lag)
+            histograms.record("injection_response_time", job.pod.name, record.completed - record.actual)
+            get_metrics_registry().inc("messages_injected_total", "Messages sent by the injector, per target kind",
+                                       target=job.target.value)
+        except Exception as e:
+            record.error = str(e)
+            self.stats.failed += 1
+            get_metrics_registry().inc("messages_injection_failed_total",
+                                       "Messages the injector failed to send, per target kind",
+                                       target=job.target.value)
+            logger.error(f"Error sending message from pod {job.pod.base_url}: {e}")
+
+        record_result(f"inject_{job.target.value}_message", job.pod.name, job.target_id, int(intended * 1e9), text,
+                      record.lag)
+        if self.keep_records:
+            self.stats.records.append(record)
+
+    async def run(self) -> InjectionStats:
+        # Sends must not wait behind blocking reads of sharded nodes, which raise while the messages are injected
+        with measured_phase():
+            return await self._run()
+
+    async def _run(self) -> InjectionStats:
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        # Loop time is monotonic, wall time is only used to report the intended send times
+        wall_offset = time.time() - start
+
+        # The heap holds only the next message of each job, so it does not grow with the amount of messages
+        schedule = [(start + job.start_offset, job_index, 0)
+                    for job_index, job in enumerate(self.jobs) if job.num_messages > 0]
+        heapq.heapify(schedule)
+        total = sum(job.num_messages for job in self.jobs)
+        dispatched = 0
+        logger.info(f"Injecting {total} messages from {len(self.jobs)} senders")
+
+        while schedule:
+            due, job_index, message_count = heapq.heappop(schedule)
+            job = self.jobs[job_index]
+            if message_count + 1 < job.num_messages:
+                heapq.heappush(schedule, (due + job.interval, job_index, message_count + 1))
+
+            delay = due - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            task = asyncio.create_task(self._send(job, message_count, due + wall_offset))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+            dispatched += 1
+            if dispatched == 1:
+                logger.info(f"Successfully began sending {total} messages")
+            elif dispatched % 100 == 0:
+                logger.debug(f"Dispatched {dispatched} messages")
+
+        await asyncio.gather(*self._in_flight)
+        logger.info(f"Finished sending {total} messages: {self.stats.sent} sent, {self.stats.failed} failed, "
+                    f"max send lag {self.stats.max_lag:.3f} seconds")
+        return self.stats
+
+
+async def inject(jobs: list[InjectionJob]) -> InjectionStats:
+    return await InjectionScheduler(jobs).run()
 
-            if message_count == 0:
-                logger.info(f"Successfully began sending {num_messages} messages")
-            elif message_count % 10 == 0:
-                logger.debug(f"Sent {message_count} messages")
 
-            await asyncio.sleep(delay_between_message)
-
-        except AssertionError as e:
-            logger.error(f"Error sending message: {e}")
-            await asyncio.sleep(1)
-
-    logger.info(f"Finished sending {num_messages} messages")
-
-async def inject_messages_group_chat(pod: StatusBackend, delay_between_message: float, group_id: str, num_messages: int):
-    for message_count in range(num_messages):
-        try:
-            logger.debug(f"Sending message {message_count}")
-            await pod.wakuext_service.send_group_chat_message(group_id, f"Message {message_count}")
+async def inject_messages(pod: StatusBackend, delay_between_message: float, chat_id: str, num_messages: int):
+    await inject([InjectionJob(pod, InjectionTarget.CHAT, chat_id, num_messages, delay_between_message)])
 
-            if message_count == 0:
-                logger.info(f"Successfully began sending {num_messages} messages")
-            elif message_count % 10 == 0:
-                logger.debug(f"Sent {message_count} messages")
 
-            await asyncio.sleep(delay_between_message)
+async def inject_messages_one_to_one(pod: StatusBackend, delay_between_message: float, contact_id: str,
+                                     num_messages: int):
+    await inject([InjectionJob(pod, InjectionTarget.ONE_TO_ONE, contact_id, num_messages, delay_between_message)])
 
-        except AssertionError as e:
-            logger.error(f"Error sending message from pod {pod.base_url}: {e}")
-            await asyncio.sleep(1)
 
-    logger.info(f"Finished sending {num_messages} messages")
\ No newline at end of file
+async def inject_messages_group_chat(pod: StatusBackend, delay_between_message: float, group_id: str,
+                                     num_messages: int):
+    await inject([InjectionJob(pod, InjectionTarget.GROUP, group_id, num_messages, delay_between_message)])
@@ -0,0 +1,36 @@
+# Python Imports
+import json
+from typing import Any
+
+# Project Imports
+
+# orjson is an optional dependency: it decodes straight from bytes and is several times faster than the standard
+# library, which matters when a single controller decodes the signals and responses of hundreds of nodes.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+JSONDecodeError = json.JSONDecodeError
+
+
+def loads(data: str | bytes | bytearray | memoryview) -> Any:
+    # orjson.JSONDecodeError is a subclass of json.JSONDecodeError, so callers only need to handle the latter
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj: Any, sort_keys: bool = False) -> str:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sort_keys else 0).decode()
+    return json.dumps(obj, sort_keys=sort_keys)
+
+
+def dumps_bytes(obj: Any) -> bytes:
+    # Request bodies are sent as bytes, orjson produces them without an intermediate str
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode()
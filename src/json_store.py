@@ -0,0 +1,42 @@
+# Python Imports
+import fcntl
+import json
+import logging
+import os
+from typing import Optional
+
+# Project Imports
+
+logger = logging.getLogger(__name__)
+
+
+def read_json_store(path: str) -> dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning(f"Ignoring unreadable file {path}: {e}")
+        return {}
+
+
+def update_json_store(path: str, updates: dict[str, Optional[dict]]) -> dict:
+    """
+    Merges updates into the JSON object stored in path under a lock, so several processes (see sharding) can save to
+    the same file. Keys updated to None are removed. Returns the merged content.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(f"{path}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        data = read_json_store(path)
+        for key, value in updates.items():
+            if value is None:
+                data.pop(key, None)
+            else:
+                data[key] = value
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(dict(sorted(data.items())), f, indent=1)
+        os.replace(tmp_path, path)
+    return data
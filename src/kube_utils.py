@@ -2,9 +2,10 @@
 import kubernetes
 import logging
 from kubernetes.client import ApiException
-from typing import List
+from typing import Dict, Iterator, List
 
 # Project Imports
+from src.pod_discovery import PodEvent, StatefulSetInfo, WatchExpired
 
 logger = logging.getLogger(__name__)
 
@@ -41,3 +42,95 @@ def get_pods(name: str, namespace: str) -> List[str]:
         raise
 
     return pods
+
+
+def get_pod_addresses(name: str, namespace: str) -> Dict[str, str]:
+    """
+    Returns the IP of every ready pod behind the headless service name, keyed by the same hostnames get_pods returns,
+    from its EndpointSlices. Falls back to the Endpoints of the service on clusters without EndpointSlices.
+    """
+    addresses = {}
+
+    def _add(pod: str, ip: str):
+        addresses[f"{pod}.{name}.{namespace}"] = ip
+
+    try:
+        slices = kubernetes.client.DiscoveryV1Api().list_namespaced_endpoint_slice(
+            namespace=namespace,
+            label_selector=f"kubernetes.io/service-name={name}"
+        )
+        for endpoint_slice in slices.items:
+            for endpoint in endpoint_slice.endpoints or []:
+                if endpoint.conditions is not None and endpoint.conditions.ready is False:
+                    continue
+                pod = endpoint.hostname or (endpoint.target_ref.name if endpoint.target_ref else None)
+                if pod and endpoint.addresses:
+                    _add(pod, endpoint.addresses[0])
+    except ApiException as e:
+        if e.status not in (403, 404):
+            logger.error(f"Failed to get endpoint slices: {e}")
+            raise
+        logger.debug(f"Endpoint slices of {name} not available ({e.status}), reading its endpoints")
+        try:
+            endpoints = kubernetes.client.CoreV1Api().read_namespaced_endpoints(name=name, namespace=namespace)
+        except ApiException as e:
+            logger.error(f"Failed to get endpoints: {e}")
+            raise
+        for subset in endpoints.subsets or []:
+            for address in subset.addresses or []:
+                pod = address.hostname or (address.target_ref.name if address.target_ref else None)
+                if pod:
+                    _add(pod, address.ip)
+
+    logger.info(f"Found {len(addresses)} ready pod addresses for service {name} in namespace {namespace}")
+    return addresses
+
+
+def _pod_event(pod, deleted: bool = False) -> PodEvent:
+    conditions = (pod.status.conditions or []) if pod.status else []
+    ready = any(condition.type == "Ready" and condition.status == "True" for condition in conditions)
+    return PodEvent(pod=pod.metadata.name, ready=ready and pod.metadata.deletion_timestamp is None,
+                    ip=pod.status.pod_ip if pod.status else None, deleted=deleted,
+                    resource_version=pod.metadata.resource_version)
+
+
+class KubernetesPodApi:
+    """
+    Kubernetes calls of pod_discovery.PodDiscovery, see PodApi.
+    """
+    def __init__(self):
+        self.apps = kubernetes.client.AppsV1Api()
+        self.core = kubernetes.client.CoreV1Api()
+
+    def read_stateful_set(self, name: str, namespace: str) -> StatefulSetInfo:
+        try:
+            statefulset = self.apps.read_namespaced_stateful_set(name=name, namespace=namespace)
+        except ApiException as e:
+            logger.error(f"Failed to get statefulset {name}: {e}")
+            raise
+        labels = statefulset.spec.selector.match_labels or {}
+        return StatefulSetInfo(name=name, replicas=statefulset.spec.replicas or 0,
+                               service_name=statefulset.spec.service_name or name,
+                               label_selector=",".join(f"{key}={value}" for key, value in labels.items()))
+
+    def list_pods(self, namespace: str, label_selector: str) -> tuple[List[PodEvent], str]:
+        pods = self.core.list_namespaced_pod(namespace=namespace, label_selector=label_selector)
+        return [_pod_event(pod) for pod in pods.items], pods.metadata.resource_version
+
+    def watch_pods(self, namespace: str, label_selector: str, resource_version: str,
+                   timeout_seconds: int) -> Iterator[PodEvent]:
+        watch = kubernetes.watch.Watch()
+        try:
+            for event in watch.stream(self.core.list_namespaced_pod, namespace=namespace,
+                                      label_selector=label_selector, resource_version=resource_version,
+                                      timeout_seconds=timeout_seconds):
+                if event["type"] == "ERROR":
+                    # Mostly 410 Gone, any error is handled by listing the pods again
+                    raise WatchExpired(str(event.get("raw_object")))
+                yield _pod_event(event["object"], deleted=event["type"] == "DELETED")
+        except ApiException as e:
+            if e.status == 410:
+                raise WatchExpired(str(e)) from e
+            raise
+        finally:
+            watch.stop()
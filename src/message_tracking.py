@@ -0,0 +1,193 @@
+# Python Imports
+import logging
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+# Project Imports
+from src.histogram import LatencyHistogram, HistogramRegistry, get_latency_histograms, node_class
+
+logger = logging.getLogger(__name__)
+
+# Injected messages end with [<chat type><sender id>:<target id>:<sequence number>:<send time in unix ms>], numbers
+# in hex
+_PAYLOAD_PATTERN = re.compile(r"\[([cog])([0-9a-f]+):([0-9a-f]+):([0-9a-f]+):([0-9a-f]+)\]$")
+CHAT_TYPES = {"c": "chat", "o": "one_to_one", "g": "group"}
+_CHAT_TYPE_CODES = {chat_type: code for code, chat_type in CHAT_TYPES.items()}
+
+
+@dataclass(frozen=True)
+class TrackedMessage:
+    chat_type: str
+    sender_id: int
+    target_id: int
+    seq: int
+    # Unix milliseconds
+    sent_at: int
+
+
+class SenderRegistry:
+    """
+    Compact numeric ids of the senders and targets, so they can be embedded in the payload of the messages. Sequence
+    numbers are given per (sender, target) for the whole process, so messages of different jobs and injections never
+    share one.
+    """
+    def __init__(self):
+        self.ids: dict[str, int] = {}
+        self.names: list[str] = []
+        self.target_ids: dict[str, int] = {}
+        self._next_seq: dict[tuple[int, int], int] = {}
+
+    def sender_id(self, name: str) -> int:
+        if name not in self.ids:
+            self.ids[name] = len(self.names)
+            self.names.append(name)
+        return self.ids[name]
+
+    def name(self, sender_id: int) -> str:
+        return self.names[sender_id] if sender_id < len(self.names) else f"unknown-{sender_id}"
+
+    def target_id(self, target: str) -> int:
+        return self.target_ids.setdefault(target, len(self.target_ids))
+
+    def next_seq(self, sender_id: int, target_id: int) -> int:
+        seq = self._next_seq.get((sender_id, target_id), 0)
+        self._next_seq[(sender_id, target_id)] = seq + 1
+        return seq
+
+
+sender_registry = SenderRegistry()
+
+
+def encode_payload(text: str, chat_type: str, sender_id: int, target_id: int, seq: int,
+                   sent_at: Optional[float] = None) -> str:
+    sent_at_ms = int((time.time() if sent_at is None else sent_at) * 1000)
+    return f"{text} [{_CHAT_TYPE_CODES[chat_type]}{sender_id:x}:{target_id:x}:{seq:x}:{sent_at_ms:x}]"
+
+
+def decode_payload(text: str) -> Optional[TrackedMessage]:
+    if not text.endswith("]"):
+        return None
+    match = _PAYLOAD_PATTERN.search(text)
+    if match is None:
+        return None
+    code, sender_id, target_id, seq, sent_at = match.groups()
+    return TrackedMessage(CHAT_TYPES[code], int(sender_id, 16), int(target_id, 16), int(seq, 16), int(sent_at, 16))
+
+
+@dataclass
+class PairStats:
+    received: int = 0
+    duplicates: int = 0
+    reordered: int = 0
+    max_seq: int = -1
+    # One bit per sequence number
+    seen: bytearray = field(default_factory=bytearray)
+
+    def add(self, seq: int) -> bool:
+        byte, bit = divmod(seq, 8)
+        if byte >= len(self.seen):
+            self.seen.extend(bytes(byte - len(self.seen) + 1))
+        if self.seen[byte] & (1 << bit):
+            self.duplicates += 1
+            return False
+        self.seen[byte] |= 1 << bit
+        self.received += 1
+        if seq < self.max_seq:
+            self.reordered += 1
+        self.max_seq = max(self.max_seq, seq)
+        return True
+
+    def count(self, start: int, stop: int) -> int:
+        # Distinct sequence numbers received in [start, stop)
+        return sum(1 for seq in range(start, min(stop, len(self.seen) * 8)) if self.seen[seq // 8] & (1 << seq % 8))
+
+
+class DeliveryTracker:
+    """
+    Receiver side tracking of injected messages. Keeps one-way latency histograms per chat type, and loss,
+    duplicates and reordering per sender and target.
+    """
+    def __init__(self):
+        # (chat type, sender id, target id) -> stats
+        self.pairs: dict[tuple[str, int, int], PairStats] = {}
+        self.latencies: dict[str, LatencyHistogram] = {}
+
+    def on_message(self, text: str, received_at: float):
+        tracked = decode_payload(text)
+        if tracked is None:
+            return
+        key = (tracked.chat_type, tracked.sender_id, tracked.target_id)
+        pair = self.pairs.get(key)
+        if pair is None:
+            pair = self.pairs[key] = PairStats()
+        if not pair.add(tracked.seq):
+            return
+        histogram = self.latencies.get(tracked.chat_type)
+        if histogram is None:
+            histogram = self.latencies[tracked.chat_type] = LatencyHistogram()
+        histogram.record(received_at - tracked.sent_at / 1000)
+
+
+@dataclass
+class DeliveryReport:
+    # (chat type, sender, receiver) -> expected, received, lost, duplicates and reordered messages
+    loss_matrix: dict[tuple[str, str, str], dict[str, int]]
+    histograms: HistogramRegistry
+
+    @classmethod
+    def build(cls, nodes: dict, sent: dict[tuple[str, str], int], audience: dict[str, list[str]],
+              chat_type: str, registry: SenderRegistry = sender_registry,
+              seq_ranges: Optional[dict[tuple[str, str], tuple[int, int]]] = None) -> "DeliveryReport":
+        """
+        :param nodes: Nodes that received the messages
+        :param sent: Messages successfully sent per (sender, target id), as in InjectionStats.sent_per_target
+        :param audience: Nodes expected to receive the messages sent to each target id
+        :param chat_type: Chat type of the messages to report, one of CHAT_TYPES values
+        :param seq_ranges: Sequence numbers sent per (sender, target id), as in InjectionStats.seq_ranges, so only
+            the messages of that injection are counted. All the messages received so far are counted otherwise.
+        """
+        trackers = {name: node.signal.delivery_tracker for name, node in nodes.items()}
+        loss_matrix: dict[tuple[str, str, str], dict[str, int]] = {}
+        for (sender, target_id), expected in sent.items():
+            sender_id = registry.ids.get(sender)
+            target = registry.target_ids.get(target_id)
+            for receiver in audience.get(target_id, []):
+                if receiver == sender or receiver not in trackers:
+                    continue
+                pair = trackers[receiver].pairs.get((chat_type, sender_id, target), PairStats())
+                received = pair.received if seq_ranges is None else pair.count(*seq_ranges[(sender, target_id)])
+                # Several targets of a sender can reach the same receiver, their messages add up
+                counts = loss_matrix.setdefault((chat_type, sender, receiver), {
+                    "expected": 0, "received": 0, "lost": 0, "duplicates": 0, "reordered": 0,
+                })
+                counts["expected"] += expected
+                counts["received"] += received
+                counts["lost"] += max(expected - received, 0)
+                counts["duplicates"] += pair.duplicates
+                counts["reordered"] += pair.reordered
+
+        histograms = HistogramRegistry()
+        for receiver, tracker in trackers.items():
+            if chat_type in tracker.latencies:
+                histograms.histogram(f"delivery_{chat_type}", node_class(receiver)).merge(
+                    tracker.latencies[chat_type])
+        get_latency_histograms().merge(histograms)
+        return cls(loss_matrix, histograms)
+
+    def totals(self) -> dict[str, int]:
+        totals = {"expected": 0, "received": 0, "lost": 0, "duplicates": 0, "reordered": 0}
+        for pair in self.loss_matrix.values():
+            for key in totals:
+                totals[key] += pair[key]
+        return totals
+
+    def log(self):
+        totals = self.totals()
+        loss_rate = totals["lost"] / totals["expected"] if totals["expected"] else 0
+        logger.info(f"Delivery totals: {totals}, loss rate {loss_rate:.4f}")
+        for (chat_type, sender, receiver), pair in sorted(self.loss_matrix.items()):
+            if pair["lost"] or pair["duplicates"] or pair["reordered"]:
+                logger.info(f"{chat_type} {sender} -> {receiver}: {pair}")
+        self.histograms.log_summary()
@@ -0,0 +1,236 @@
+# Python Imports
+import logging
+import os
+import time
+import weakref
+from collections import defaultdict
+from collections.abc import Iterable
+from typing import Optional
+from aiohttp import web
+
+# Project Imports
+from src.histogram import LatencyHistogram
+from src.rpc_metrics import RpcMetrics
+
+logger = logging.getLogger(__name__)
+
+# Port of the Prometheus endpoint (/metrics) of the controller, 0 disables it
+METRICS_PORT = int(os.getenv("BENCHMARK_METRICS_PORT", "9400"))
+PREFIX = "status_benchmarks"
+# Upper bounds, in seconds, of the buckets of the latency histograms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+Labels = tuple[tuple[str, str], ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(str(value))}"' for key, value in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class MetricFamily:
+    """
+    Samples of a metric with its HELP and TYPE lines, rendered in the Prometheus text format.
+    """
+    def __init__(self, name: str, kind: str, help_text: str):
+        self.name = f"{PREFIX}_{name}"
+        self.kind = kind
+        self.help_text = help_text
+        self.samples: list[tuple[str, Labels, float]] = []
+
+    def add(self, value: float, suffix: str = "", **labels):
+        self.samples.append((suffix, tuple(labels.items()), value))
+
+    def add_histogram(self, histogram: LatencyHistogram, **labels):
+        """
+        Adds the buckets, sum and count of a LatencyHistogram, its buckets are regrouped into LATENCY_BUCKETS.
+        """
+        cumulative = 0
+        values = histogram.buckets()
+        position = 0
+        for bound in LATENCY_BUCKETS:
+            while position < len(values) and values[position][0] <= bound:
+                cumulative += values[position][1]
+                position += 1
+            self.add(cumulative, "_bucket", **labels, le=str(bound))
+        self.add(histogram.count, "_bucket", **labels, le="+Inf")
+        self.add(histogram.total, "_sum", **labels)
+        self.add(histogram.count, "_count", **labels)
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for suffix, labels, value in self.samples:
+            yield f"{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}"
+
+
+class MetricsRegistry:
+    """
+    Live metrics of the harness. Counters and gauges updated by the harness itself are kept here, everything else is
+    read at scrape time from the tracked nodes and queues, so nothing is added to the path of signals and RPC calls.
+    Nodes and queues are tracked with weak references and disappear with them.
+
+    With shards, the nodes live in the worker processes and only the metrics of the coordinator are exposed.
+    """
+    def __init__(self):
+        self.counters: dict[str, dict[Labels, float]] = defaultdict(lambda: defaultdict(float))
+        self.gauges: dict[str, dict[Labels, float]] = defaultdict(lambda: defaultdict(float))
+        self.help: dict[str, str] = {}
+        self._nodes: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+        self._queues: list[tuple[str, weakref.ref]] = []
+        self.started = time.time()
+
+    def inc(self, name: str, help_text: str, value: float = 1, **labels):
+        self.help[name] = help_text
+        self.counters[name][tuple(labels.items())] += value
+
+    def add_gauge(self, name: str, help_text: str, value: float, **labels):
+        self.help[name] = help_text
+        self.gauges[name][tuple(labels.items())] += value
+
+    def track_node(self, name: str, node):
+        self._nodes[name] = node
+
+    def track_queue(self, name: str, queue):
+        self._queues = [(queue_name, ref) for queue_name, ref in self._queues if ref() is not None]
+        self._queues.append((name, weakref.ref(queue)))
+
+    def _node_families(self) -> list[MetricFamily]:
+        signals = MetricFamily("signals_received_total", "counter", "Signals received per node and signal type")
+        messages = MetricFamily("messages_received_total", "counter",
+                                "Messages received in messages.new signals, per node")
+        rpc_metrics = RpcMetrics()
+        for name, node in sorted(self._nodes.items()):
+            signal = node.signal
+            for signal_type, queue in signal.signal_queues.items():
+                signals.add(queue.received_signals, node=name, type=signal_type)
+                if queue.received_messages:
+                    messages.add(queue.received_messages, node=name)
+            if signal.ignored_signals:
+                signals.add(signal.ignored_signals, node=name, type="ignored")
+            rpc_metrics.merge(node.rpc.metrics)
+
+        latency = MetricFamily("rpc_latency_seconds", "histogram", "Latency of the RPC calls per method, retries "
+                                                                   "included, all nodes")
+        failures = MetricFamily("rpc_failures_total", "counter", "RPC calls that failed after every retry, per method")
+        for method, metrics in sorted(rpc_metrics.methods.items()):
+            latency.add_histogram(metrics.latency, method=method)
+            failures.add(metrics.failures, method=method)
+        nodes = MetricFamily("nodes", "gauge", "Initialized nodes")
+        nodes.add(len(self._nodes))
+        return [nodes, signals, messages, latency, failures]
+
+    def _queue_family(self) -> MetricFamily:
+        depths: dict[str, int] = defaultdict(int)
+        for name, ref in self._queues:
+            queue = ref()
+            if queue is not None:
+                depths[name] += queue.qsize()
+        family = MetricFamily("queue_depth", "gauge", "Items waiting in the result queues of the running tasks")
+        for name, depth in sorted(depths.items()):
+            family.add(depth, queue=name)
+        return family
+
+    def _own_families(self) -> list[MetricFamily]:
+        families = []
+        for kind, metrics in (("counter", self.counters), ("gauge", self.gauges)):
+            for name, values in sorted(metrics.items()):
+                family = MetricFamily(name, kind, self.help[name])
+                for labels, value in sorted(values.items()):
+                    family.add(value, **dict(labels))
+                families.append(family)
+        return families
+
+    def render(self) -> str:
+        from src.connection_pool import get_connection_manager
+
+        pool = get_connection_manager().stats
+        http = MetricFamily("http_requests_in_flight", "gauge", "HTTP requests to the status-backends in flight")
+        http.add(pool.in_flight)
+        uptime = MetricFamily("uptime_seconds", "gauge", "Seconds since the metrics were started")
+        uptime.add(round(time.time() - self.started, 3))
+
+        families = [uptime, http, *self._node_families(), self._queue_family(), *self._own_families()]
+        return "\n".join(line for family in families for line in family.render()) + "\n"
+
+
+class MetricsServer:
+    """
+    Serves the metrics of a MetricsRegistry in the Prometheus text format on /metrics.
+    """
+    def __init__(self, registry: MetricsRegistry, host: str = "0.0.0.0", port: int = METRICS_PORT):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._runner: Optional[web.AppRunner] = None
+
+    async def _handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.registry.render(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Prometheus-Format": "0.0.4"})
+
+    async def start(self) -> "MetricsServer":
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle_metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        if self.port == 0:
+            self.port = self._runner.addresses[0][1]
+        logger.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+        return self
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+_metrics_registry: Optional[MetricsRegistry] = None
+_metrics_server: Optional[MetricsServer] = None
+_server_enabled = True
+
+
+def get_metrics_registry() -> MetricsRegistry:
+    global _metrics_registry
+    if _metrics_registry is None:
+        _metrics_registry = MetricsRegistry()
+    return _metrics_registry
+
+
+async def start_metrics_server(port: int = METRICS_PORT) -> Optional[MetricsServer]:
+    """
+    Starts the metrics endpoint of the process once, later calls return the same server. Failing to bind the port
+    only logs a warning, metrics are not worth failing a scenario for.
+    """
+    global _metrics_server
+    if _metrics_server is not None or not port or not _server_enabled:
+        return _metrics_server
+    server = MetricsServer(get_metrics_registry(), port=port)
+    try:
+        _metrics_server = await server.start()
+    except OSError as e:
+        logger.warning(f"Can not serve metrics on port {port}: {e}")
+    return _metrics_server
+
+
+def disable_metrics_server():
+    # Shard workers do not serve metrics, the port belongs to the coordinator
+    global _server_enabled
+    _server_enabled = False
+
+
+async def stop_metrics_server():
+    global _metrics_server
+    if _metrics_server is not None:
+        await _metrics_server.stop()
+        _metrics_server = None
@@ -0,0 +1,445 @@
+# Python Imports
+import argparse
+import asyncio
+import hashlib
+import logging
+import random
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+from aiohttp import web, WSMsgType
+
+# Project Imports
+from src import json_codec
+from src.enums import MessageContentType, SignalType
+
+logger = logging.getLogger(__name__)
+
+# Error code status-go uses for failed RPC calls
+RPC_ERROR_CODE = -32000
+
+
+class MockRpcError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class MockConfig:
+    """
+    Behaviour of the mock backend. Latencies are in seconds, a random value up to the jitter is added to each one.
+    Error rates are the probability of a request failing, either with a JSON-RPC error (CallRPC only) or with an HTTP
+    500, optionally only for the given methods.
+    """
+    latency: float = 0
+    latency_jitter: float = 0
+    # Time for messages and contact requests to reach the other nodes
+    signal_latency: float = 0.05
+    error_rate: float = 0
+    http_error_rate: float = 0
+    error_methods: frozenset[str] = frozenset()
+    seed: Optional[int] = None
+
+
+@dataclass
+class MockNode:
+    name: str
+    public_key: str
+    key_uid: str
+    account_created: bool = False
+    logged_in: bool = False
+    websockets: list[web.WebSocketResponse] = field(default_factory=list)
+    # Public keys of the contacts: added by this node, and mutual once a contact request is accepted
+    contacts: set[str] = field(default_factory=set)
+    mutual_contacts: set[str] = field(default_factory=set)
+    communities: set[str] = field(default_factory=set)
+    group_chats: set[str] = field(default_factory=set)
+
+
+@dataclass
+class MockCommunity:
+    community_id: str
+    owner: str
+    chat_id: str
+    members: set[str] = field(default_factory=set)
+
+
+@dataclass
+class MockGroupChat:
+    group_id: str
+    name: str
+    members: set[str] = field(default_factory=set)
+
+
+class MockStatusBackend:
+    """
+    Emulates the status-backend of many nodes in a single process. Every node has its own path prefix:
+    /{node}/statusgo/{method} for the API, and /{node}/signals for the signals websocket. Nodes are created on their
+    first request, and their state is only kept in memory.
+    """
+    def __init__(self, config: MockConfig = MockConfig()):
+        self.config = config
+        self.random = random.Random(config.seed)
+        self.nodes: dict[str, MockNode] = {}
+        self.nodes_by_key: dict[str, MockNode] = {}
+        self.communities: dict[str, MockCommunity] = {}
+        # Chat id of every community -> community id
+        self.community_chats: dict[str, str] = {}
+        self.join_requests: dict[str, tuple[str, str]] = {}
+        self.contact_requests: dict[str, tuple[str, str]] = {}
+        self.group_chats: dict[str, MockGroupChat] = {}
+        self.requests = 0
+        self.signals_sent = 0
+        self.rpc_handlers: dict[str, Callable[[MockNode, list], Any]] = {
+            "wakuext_startMessenger": lambda node, params: None,
+            "wallet_startWallet": lambda node, params: None,
+            "wakuext_peers": self._peers,
+            "wakuext_createCommunity": self._create_community,
+            "wakuext_fetchCommunity": self._fetch_community,
+            "wakuext_joinedCommunities": self._joined_communities,
+            "wakuext_requestToJoinCommunity": self._request_to_join_community,
+            "wakuext_acceptRequestToJoinCommunity": self._accept_request_to_join_community,
+            "wakuext_declineRequestToJoinCommunity": self._decline_request_to_join_community,
+            "wakuext_sendChatMessage": self._send_chat_message,
+            "wakuext_sendContactRequest": self._send_contact_request,
+            "wakuext_acceptContactRequest": self._accept_contact_request,
+            "wakuext_declineContactRequest": self._decline_contact_request,
+            "wakuext_addContact": self._add_contact,
+            "wakuext_contacts": self._contacts,
+            "wakuext_chats": self._chats,
+            "wakuext_sendOneToOneMessage": self._send_one_to_one_message,
+            "wakuext_createGroupChatWithMembers": self._create_group_chat_with_members,
+            "wakuext_sendGroupChatMessage": self._send_group_chat_message,
+            "accounts_getAccounts": self._get_accounts,
+            "accounts_getKeypairs": self._get_accounts,
+        }
+
+    def node(self, name: str) -> MockNode:
+        node = self.nodes.get(name)
+        if node is None:
+            digest = hashlib.sha256(name.encode()).hexdigest()
+            node = self.nodes[name] = MockNode(name, public_key=f"0x04{digest}{digest}",
+                                               key_uid=f"0x{hashlib.sha256(digest.encode()).hexdigest()}")
+            self.nodes_by_key[node.public_key] = node
+        return node
+
+    def _delay(self, base: float) -> float:
+        return base + (self.random.uniform(0, self.config.latency_jitter) if self.config.latency_jitter else 0)
+
+    def _fails(self, method: str, rate: float) -> bool:
+        if not rate or (self.config.error_methods and method not in self.config.error_methods):
+            return False
+        return self.random.random() < rate
+
+    # Signals
+
+    def emit(self, node: MockNode, signal_type: str, event: dict, delay: Optional[float] = None):
+        delay = self._delay(self.config.signal_latency) if delay is None else delay
+        asyncio.get_running_loop().call_later(delay, self._send_signal, node, signal_type, event)
+
+    def _send_signal(self, node: MockNode, signal_type: str, event: dict):
+        if not node.websockets:
+            return
+        # Same envelope as status-go, with "type" first and the timestamp in unix seconds
+        frame = json_codec.dumps({"type": signal_type, "event": event, "timestamp": int(time.time())})
+        for ws in node.websockets:
+            if not ws.closed:
+                asyncio.ensure_future(ws.send_str(frame))
+                self.signals_sent += 1
+
+    def _deliver(self, sender: MockNode, receivers: list[MockNode], message: dict):
+        for receiver in receivers:
+            if receiver is not sender and receiver.logged_in:
+                self.emit(receiver, SignalType.MESSAGES_NEW.value, {"messages": [message]})
+
+    def _message(self, sender: MockNode, chat_id: str, text: str,
+                 content_type: int = MessageContentType.TEXT_PLAIN.value) -> dict:
+        return {"id": f"0x{uuid.uuid4().hex}{uuid.uuid4().hex}", "chatId": chat_id, "text": text,
+                "timestamp": int(time.time() * 1000), "from": sender.public_key, "contentType": content_type}
+
+    # RPC methods
+
+    def _peers(self, node: MockNode, params: list) -> dict:
+        return {other.public_key[:20]: ["/ip4/127.0.0.1/tcp/60000"] for other in self.nodes.values()
+                if other.logged_in and other is not node}
+
+    def _community_json(self, community: MockCommunity) -> dict:
+        return {"id": community.community_id, "name": community.community_id[:10],
+                "chats": {community.chat_id[len(community.community_id):]: {"id": community.chat_id}},
+                "members": {member: {} for member in community.members}}
+
+    def _create_community(self, node: MockNode, params: list) -> dict:
+        community_id = f"0x03{uuid.uuid4().hex}{uuid.uuid4().hex}"
+        chat_id = f"{community_id}{uuid.uuid4()}"
+        community = self.communities[community_id] = MockCommunity(community_id, node.name, chat_id, {node.name})
+        self.community_chats[chat_id] = community_id
+        node.communities.add(community_id)
+        return {"communities": [self._community_json(community)], "chats": [{"id": chat_id}]}
+
+    def _get_community(self, community_id: str) -> MockCommunity:
+        community = self.communities.get(community_id)
+        if community is None:
+            raise MockRpcError(f"community {community_id} not found")
+        return community
+
+    def _fetch_community(self, node: MockNode, params: list) -> dict:
+        return self._community_json(self._get_community(params[0]["communityKey"]))
+
+    def _joined_communities(self, node: MockNode, params: list) -> list[dict]:
+        return [self._community_json(self.communities[community_id]) for community_id in node.communities]
+
+    def _request_to_join_community(self, node: MockNode, params: list) -> dict:
+        community = self._get_community(params[0]["communityId"])
+        join_id = f"0x{uuid.uuid4().hex}"
+        self.join_requests[join_id] = (node.name, community.community_id)
+        return {"requestsToJoinCommunity": [{"id": join_id, "communityId": community.community_id}]}
+
+    def _accept_request_to_join_community(self, node: MockNode, params: list) -> dict:
+        join_id = params[0]["id"]
+        if join_id not in self.join_requests:
+            raise MockRpcError(f"request to join {join_id} not found")
+        requester, community_id = self.join_requests.pop(join_id)
+        community = self.communities[community_id]
+        community.members.add(requester)
+        self.node(requester).communities.add(community_id)
+        return {"communities": [self._community_json(community)],
+                "requestsToJoinCommunity": [{"id": join_id, "communityId": community_id}]}
+
+    def _decline_request_to_join_community(self, node: MockNode, params: list) -> dict:
+        requester, community_id = self.join_requests.pop(params[0]["id"], ("", ""))
+        return {"requestsToJoinCommunity": [{"id": params[0]["id"], "communityId": community_id}]}
+
+    def _chat_members(self, chat_id: str) -> list[MockNode]:
+        if chat_id in self.community_chats:
+            return [self.nodes[member] for member in self.communities[self.community_chats[chat_id]].members]
+        if chat_id in self.group_chats:
+            return [self.nodes[member] for member in self.group_chats[chat_id].members]
+        raise MockRpcError(f"chat {chat_id} not found")
+
+    def _send_chat_message(self, node: MockNode, params: list) -> dict:
+        chat_id = params[0]["chatId"]
+        message = self._message(node, chat_id, params[0]["text"], params[0].get("contentType", 1))
+        self._deliver(node, self._chat_members(chat_id), message)
+        return {"messages": [message]}
+
+    def _node_by_key(self, public_key: str) -> MockNode:
+        node = self.nodes_by_key.get(public_key)
+        if node is None:
+            raise MockRpcError(f"contact {public_key} not found")
+        return node
+
+    def _send_contact_request(self, node: MockNode, params: list) -> dict:
+        receiver = self._node_by_key(params[0]["id"])
+        message = self._message(node, node.public_key, params[0]["message"],
+                                MessageContentType.CONTACT_REQUEST.value)
+        self.contact_requests[message["id"]] = (node.name, receiver.name)
+        node.contacts.add(receiver.public_key)
+        self._deliver(node, [receiver], message)
+        return {"messages": [message]}
+
+    def _accept_contact_request(self, node: MockNode, params: list) -> dict:
+        request_id = params[0]["id"]
+        if request_id not in self.contact_requests:
+            raise MockRpcError(f"contact request {request_id} not found")
+        sender = self.nodes[self.contact_requests.pop(request_id)[0]]
+        node.contacts.add(sender.public_key)
+        node.mutual_contacts.add(sender.public_key)
+        sender.mutual_contacts.add(node.public_key)
+        message = self._message(node, node.public_key, f"@{node.public_key} accepted your contact request",
+                                MessageContentType.SYSTEM_MESSAGE_MUTUAL_EVENT_ACCEPTED.value)
+        self._deliver(node, [sender], message)
+        return {"messages": [message]}
+
+    def _decline_contact_request(self, node: MockNode, params: list) -> dict:
+        self.contact_requests.pop(params[0]["id"], None)
+        return {}
+
+    def _add_contact(self, node: MockNode, params: list) -> dict:
+        node.contacts.add(self._node_by_key(params[0]["id"]).public_key)
+        return {"contacts": [{"id": params[0]["id"]}]}
+
+    def _contacts(self, node: MockNode, params: list) -> list[dict]:
+        return [{"id": public_key, "added": True, "mutual": public_key in node.mutual_contacts}
+                for public_key in node.contacts | node.mutual_contacts]
+
+    def _chats(self, node: MockNode, params: list) -> list[dict]:
+        chats = [{"id": self.communities[community_id].chat_id, "active": True} for community_id in node.communities]
+        return chats + [{"id": group_id, "active": True} for group_id in node.group_chats]
+
+    def _send_one_to_one_message(self, node: MockNode, params: list) -> dict:
+        receiver = self._node_by_key(params[0]["id"])
+        message = self._message(node, node.public_key, params[0]["message"])
+        self._deliver(node, [receiver], message)
+        return {"messages": [message]}
+
+    def _create_group_chat_with_members(self, node: MockNode, params: list) -> dict:
+        name, public_keys = params
+        group_id = f"{uuid.uuid4()}-{node.public_key}"
+        members = {node.name} | {self._node_by_key(public_key).name for public_key in public_keys}
+        self.group_chats[group_id] = MockGroupChat(group_id, name, members)
+        for member in members:
+            self.nodes[member].group_chats.add(group_id)
+        return {"chats": [{"id": group_id, "name": name, "active": True}]}
+
+    def _send_group_chat_message(self, node: MockNode, params: list) -> dict:
+        group_id = params[0]["id"]
+        message = self._message(node, group_id, params[0]["message"])
+        self._deliver(node, self._chat_members(group_id), message)
+        return {"messages": [message]}
+
+    def _get_accounts(self, node: MockNode, params: list) -> list[dict]:
+        return [{"key-uid": node.key_uid, "public-key": node.public_key}]
+
+    def _call_rpc(self, node: MockNode, call: dict) -> dict:
+        response: dict[str, Any] = {"jsonrpc": "2.0", "id": call.get("id")}
+        method = call.get("method", "")
+        handler = self.rpc_handlers.get(method)
+        if self._fails(method, self.config.error_rate):
+            response["error"] = {"code": RPC_ERROR_CODE, "message": "mock error"}
+        elif handler is None:
+            response["error"] = {"code": -32601, "message": f"the method {method} does not exist/is not available"}
+        elif not node.logged_in:
+            response["error"] = {"code": RPC_ERROR_CODE, "message": "messenger is not started"}
+        else:
+            try:
+                response["result"] = handler(node, call.get("params") or [])
+            except MockRpcError as e:
+                response["error"] = {"code": RPC_ERROR_CODE, "message": str(e)}
+        return response
+
+    # API methods
+
+    def _login(self, node: MockNode):
+        node.logged_in = True
+        self.emit(node, SignalType.NODE_LOGIN.value, {
+            "settings": {"public-key": node.public_key}, "account": {"key-uid": node.key_uid, "name": node.name}})
+
+    def _api(self, node: MockNode, method: str, data: Any) -> Any:
+        if method == "InitializeApplication":
+            return {"accounts": [{"key-uid": node.key_uid, "name": node.name}] if node.account_created else []}
+        if method == "CreateAccountAndLogin":
+            node.account_created = True
+            self._login(node)
+            return {}
+        if method == "LoginAccount":
+            if not node.account_created or data.get("keyUid") != node.key_uid:
+                return {"error": f"account {data.get('keyUid')} not found"}
+            self._login(node)
+            return {}
+        if method == "Logout":
+            if not node.logged_in:
+                return {"error": "not logged in"}
+            node.logged_in = False
+            self.emit(node, SignalType.NODE_LOGOUT.value, {})
+            return {}
+        if method == "CallRPC":
+            if isinstance(data, list):
+                return [self._call_rpc(node, call) for call in data]
+            return self._call_rpc(node, data)
+        return {"error": f"unknown method {method}"}
+
+    async def _handle_api(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        node = self.node(request.match_info["node"])
+        method = request.match_info["method"]
+        data = json_codec.loads(await request.read())
+        if self.config.latency or self.config.latency_jitter:
+            await asyncio.sleep(self._delay(self.config.latency))
+        if self._fails(method, self.config.http_error_rate):
+            return web.Response(status=500, text="mock error")
+        return web.Response(body=json_codec.dumps_bytes(self._api(node, method, data)),
+                            content_type="application/json")
+
+    async def _handle_signals(self, request: web.Request) -> web.WebSocketResponse:
+        node = self.node(request.match_info["node"])
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        node.websockets.append(ws)
+        try:
+            async for message in ws:
+                if message.type == WSMsgType.ERROR:
+                    break
+        finally:
+            node.websockets.remove(ws)
+        return ws
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/{node}/statusgo/{method}", self._handle_api)
+        app.router.add_get("/{node}/signals", self._handle_signals)
+        return app
+
+    def stats(self) -> dict:
+        return {"nodes": len(self.nodes), "logged_in": sum(node.logged_in for node in self.nodes.values()),
+                "websockets": sum(len(node.websockets) for node in self.nodes.values()),
+                "requests": self.requests, "signals_sent": self.signals_sent}
+
+
+class MockStatusBackendServer:
+    """
+    Runs a MockStatusBackend on host:port. node_url is the template to use as BENCHMARK_NODE_URL, or as the node_url
+    of StagedInitializer.
+    """
+    def __init__(self, backend: Optional[MockStatusBackend] = None, host: str = "127.0.0.1", port: int = 3333):
+        self.backend = backend or MockStatusBackend()
+        self.host = host
+        self.port = port
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def node_url(self) -> str:
+        return f"http://{self.host}:{self.port}/{{pod_name}}"
+
+    async def start(self) -> "MockStatusBackendServer":
+        self._runner = web.AppRunner(self.backend.app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port, backlog=4096)
+        await site.start()
+        if self.port == 0:
+            self.port = self._runner.addresses[0][1]
+        logger.info(f"Mock status-backend listening on {self.host}:{self.port}")
+        return self
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def __aenter__(self) -> "MockStatusBackendServer":
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.stop()
+
+
+async def _serve(args: argparse.Namespace):
+    config = MockConfig(latency=args.latency, latency_jitter=args.latency_jitter, signal_latency=args.signal_latency,
+                        error_rate=args.error_rate, http_error_rate=args.http_error_rate,
+                        error_methods=frozenset(args.error_methods), seed=args.seed)
+    async with MockStatusBackendServer(MockStatusBackend(config), args.host, args.port) as server:
+        logger.info(f"Use BENCHMARK_NODE_URL={server.node_url}")
+        while True:
+            await asyncio.sleep(60)
+            logger.info(f"Mock status-backend stats: {server.backend.stats()}")
+
+
+def main():
+    import src.logger
+    parser = argparse.ArgumentParser(description="Mock status-backend for running the harness without a cluster")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=3333)
+    parser.add_argument("--latency", type=float, default=0, help="Seconds before answering every request")
+    parser.add_argument("--latency-jitter", type=float, default=0)
+    parser.add_argument("--signal-latency", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0, help="Probability of a JSON-RPC error")
+    parser.add_argument("--http-error-rate", type=float, default=0, help="Probability of an HTTP 500")
+    parser.add_argument("--error-methods", nargs="*", default=[], help="Only fail these methods")
+    parser.add_argument("--seed", type=int, default=None)
+    try:
+        asyncio.run(_serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
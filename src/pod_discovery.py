@@ -0,0 +1,190 @@
+# Python Imports
+import asyncio
+import logging
+import threading
+import time
+from collections.abc import AsyncIterator, Iterator
+from dataclasses import dataclass
+from typing import Optional, Protocol
+
+# Project Imports
+from src.pod_resolver import PodResolver
+
+logger = logging.getLogger(__name__)
+
+# Seconds a single watch request stays open in the API server, the watch thread checks if it has to stop in between
+WATCH_TIMEOUT = 30
+# Seconds the whole fleet has to get ready, the pods that are not ready by then are left out
+READY_TIMEOUT = 600
+
+
+@dataclass(frozen=True)
+class StatefulSetInfo:
+    name: str
+    # Desired replicas, the pods discovery waits for
+    replicas: int
+    service_name: str
+    label_selector: str
+
+
+@dataclass(frozen=True)
+class PodEvent:
+    pod: str
+    ready: bool
+    ip: Optional[str] = None
+    deleted: bool = False
+    # Resource version of the pod after the change, watches resume from the one of the last event they got
+    resource_version: Optional[str] = None
+
+
+class WatchExpired(Exception):
+    """
+    The resource version of a watch is too old (410 Gone), the pods have to be listed again.
+    """
+
+
+class PodApi(Protocol):
+    """
+    Kubernetes calls used by PodDiscovery, implemented by kube_utils.KubernetesPodApi and fake_kubernetes.FakePodApi.
+    All of them block, they run in the watch threads.
+    """
+    def read_stateful_set(self, name: str, namespace: str) -> StatefulSetInfo: ...
+
+    def list_pods(self, namespace: str, label_selector: str) -> tuple[list[PodEvent], str]: ...
+
+    def watch_pods(self, namespace: str, label_selector: str, resource_version: str,
+                   timeout_seconds: int) -> Iterator[PodEvent]: ...
+
+
+class PodDiscovery:
+    """
+    Yields the pods of one or more StatefulSets as they become Ready, as hostnames (pod.service.namespace) like
+    kube_utils.get_pods, so nodes can be initialized while the rest of the fleet is still scheduling. Iteration ends
+    once every replica has been yielded, or after timeout seconds.
+
+    Each StatefulSet is watched in its own thread. The IPs of ready pods are registered in resolver, and updated when a
+    pod comes back with a new one.
+    """
+    def __init__(self, statefulsets: list[str], namespace: str, timeout: Optional[float] = READY_TIMEOUT,
+                 api: Optional[PodApi] = None, resolver: Optional[PodResolver] = None,
+                 watch_timeout: int = WATCH_TIMEOUT):
+        self.statefulsets = statefulsets
+        self.namespace = namespace
+        self.timeout = timeout
+        self.api = api
+        self.resolver = resolver
+        self.watch_timeout = watch_timeout
+        self.expected: Optional[int] = None
+        # Hostname -> seconds from start until it was ready, for the pods yielded so far
+        self.ready: dict[str, float] = {}
+        self._sets: list[StatefulSetInfo] = []
+        self._stop = threading.Event()
+        self._start = 0.0
+
+    async def start(self):
+        """
+        Reads the StatefulSets, after it expected is the amount of pods that will be yielded if they all get ready.
+        """
+        if self.expected is not None:
+            return
+        if self.api is None:
+            from src import kube_utils
+            self.api = kube_utils.KubernetesPodApi()
+        if self.resolver is None:
+            from src.connection_pool import get_connection_manager
+            self.resolver = get_connection_manager().resolver
+        self._sets = list(await asyncio.gather(*[asyncio.to_thread(self.api.read_stateful_set, name, self.namespace)
+                                                 for name in self.statefulsets]))
+        self.expected = sum(info.replicas for info in self._sets)
+        self._start = time.monotonic()
+        logger.info(f"Waiting for {self.expected} pods of {self.statefulsets} in {self.namespace} to be ready")
+
+    def _host(self, info: StatefulSetInfo, pod: str) -> str:
+        return f"{pod}.{info.service_name}.{self.namespace}"
+
+    def _watch(self, info: StatefulSetInfo, loop: asyncio.AbstractEventLoop,
+               queue: asyncio.Queue[tuple[str, Optional[PodEvent] | BaseException]]):
+        def _emit(event: Optional[PodEvent] | BaseException):
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, (info.name, event))
+            except RuntimeError:
+                # The stream ended and its loop is closed, while this watch was still waiting for events
+                pass
+
+        try:
+            resource_version = None
+            while not self._stop.is_set():
+                if resource_version is None:
+                    pods, resource_version = self.api.list_pods(self.namespace, info.label_selector)
+                    for event in pods:
+                        _emit(event)
+                try:
+                    for event in self.api.watch_pods(self.namespace, info.label_selector, resource_version,
+                                                     self.watch_timeout):
+                        _emit(event)
+                        # The next watch starts after this event, instead of replaying everything since the list
+                        resource_version = event.resource_version or resource_version
+                        if self._stop.is_set():
+                            break
+                except WatchExpired:
+                    logger.debug(f"Watch of {info.name} expired, listing its pods again")
+                    resource_version = None
+        except Exception as e:
+            _emit(e)
+        finally:
+            _emit(None)
+
+    async def stream(self) -> AsyncIterator[str]:
+        await self.start()
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue[tuple[str, Optional[PodEvent] | BaseException]] = asyncio.Queue()
+        sets = {info.name: info for info in self._sets}
+        pods_per_set = {info.name: {f"{info.name}-{ordinal}" for ordinal in range(info.replicas)}
+                        for info in self._sets}
+        # Daemon threads, so a watch blocked in the API server does not keep the process alive
+        threads = [threading.Thread(target=self._watch, args=(info, loop, queue), name=f"watch-{info.name}",
+                                    daemon=True) for info in self._sets if info.replicas]
+        for thread in threads:
+            thread.start()
+
+        running = len(threads)
+        deadline = None if self.timeout is None else self._start + self.timeout
+        try:
+            while len(self.ready) < self.expected and running:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                try:
+                    name, event = await asyncio.wait_for(queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                if event is None:
+                    running -= 1
+                elif isinstance(event, BaseException):
+                    raise event
+                elif event.pod in pods_per_set[name] and event.ready and not event.deleted:
+                    host = self._host(sets[name], event.pod)
+                    if event.ip:
+                        self.resolver.register({host: event.ip})
+                    if host not in self.ready:
+                        self.ready[host] = time.monotonic() - self._start
+                        yield host
+        finally:
+            self._stop.set()
+
+        missing = [self._host(info, pod) for info in self._sets for pod in sorted(pods_per_set[info.name])
+                   if self._host(info, pod) not in self.ready]
+        if missing:
+            logger.warning(f"{len(missing)}/{self.expected} pods were not ready after {self.timeout} seconds: "
+                           f"{missing[:10]}")
+        else:
+            logger.info(f"All {self.expected} pods ready after {time.monotonic() - self._start:.2f} seconds")
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self.stream()
+
+    async def list(self) -> list[str]:
+        """
+        Waits for the discovery to end and returns the ready pods, sorted like kube_utils.get_pods.
+        """
+        async for _ in self.stream():
+            pass
+        return sorted(self.ready, key=lambda host: (host.split(".")[1], int(host.split(".")[0].rsplit("-", 1)[1])))
@@ -0,0 +1,107 @@
+# Python Imports
+import asyncio
+import logging
+import os
+import socket
+import time
+from typing import Optional
+from aiohttp.abc import AbstractResolver, ResolveResult
+from aiohttp.resolver import DefaultResolver
+
+# Project Imports
+
+logger = logging.getLogger(__name__)
+
+# "api" resolves pod hostnames with the IPs of their EndpointSlices, "dns" always uses the system resolver
+POD_ADDRESSES = os.getenv("BENCHMARK_POD_ADDRESSES", "api")
+
+
+class PodResolver(AbstractResolver):
+    """
+    Resolver shared by all the sessions of the process, for HTTP and websockets. Pod hostnames as returned by
+    kube_utils.get_pods (pod.service.namespace) are resolved with the IPs of the EndpointSlices of their service, read
+    once per service from the Kubernetes API. Other hostnames, or every hostname if the API can not be used, go through
+    the system resolver and are cached for ttl seconds.
+
+    A pod that restarts gets a new IP: hosts are invalidated on connection errors, and the next lookup of an invalid
+    host reads the addresses of its service again, at most once every refresh_interval seconds.
+    """
+    def __init__(self, ttl: float = 300, refresh_interval: float = 5, use_api: bool = True):
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self.use_api = use_api
+        self.addresses: dict[str, str] = {}
+        self._stale: set[str] = set()
+        self._dns_cache: dict[tuple[str, int, int], tuple[float, list[ResolveResult]]] = {}
+        self._last_refresh: dict[tuple[str, str], float] = {}
+        self._refresh_locks: dict[tuple[str, str], asyncio.Lock] = {}
+        # Services whose addresses can not be read from the API, they are resolved with DNS
+        self._unavailable: set[tuple[str, str]] = set()
+        self._fallback: Optional[DefaultResolver] = None
+        self.stats = {"api_lookups": 0, "dns_lookups": 0, "cache_hits": 0, "refreshes": 0}
+
+    @staticmethod
+    def pod_service(host: str) -> Optional[tuple[str, str]]:
+        parts = host.split(".")
+        return (parts[1], parts[2]) if len(parts) == 3 else None
+
+    def register(self, addresses: dict[str, str]):
+        for host, ip in addresses.items():
+            self.addresses[host] = ip
+            self._stale.discard(host)
+
+    def invalidate(self, host: str):
+        if host in self.addresses:
+            self._stale.add(host)
+        for key in [key for key in self._dns_cache if key[0] == host]:
+            del self._dns_cache[key]
+
+    async def _refresh(self, service: tuple[str, str]):
+        lock = self._refresh_locks.setdefault(service, asyncio.Lock())
+        async with lock:
+            if time.monotonic() - self._last_refresh.get(service, -self.refresh_interval) < self.refresh_interval:
+                return
+            self._last_refresh[service] = time.monotonic()
+            try:
+                from src import kube_utils
+                addresses = await asyncio.to_thread(kube_utils.get_pod_addresses, *service)
+            except Exception as e:
+                logger.warning(f"Can not read the addresses of service {service[0]} in {service[1]}, resolving its "
+                               f"pods with DNS: {type(e).__name__}: {e}")
+                self._unavailable.add(service)
+                return
+            self.stats["refreshes"] += 1
+            # Pods that are not ready anymore are resolved again on their next lookup
+            for host in [host for host in self.addresses if self.pod_service(host) == service]:
+                if host not in addresses:
+                    del self.addresses[host]
+            self.register(addresses)
+
+    async def resolve(self, host: str, port: int = 0,
+                      family: socket.AddressFamily = socket.AF_INET) -> list[ResolveResult]:
+        service = self.pod_service(host)
+        if self.use_api and service is not None and service not in self._unavailable:
+            if host in self._stale or host not in self.addresses:
+                await self._refresh(service)
+            ip = self.addresses.get(host)
+            if ip is not None:
+                self.stats["api_lookups"] += 1
+                return [ResolveResult(hostname=host, host=ip, port=port,
+                                      family=socket.AF_INET6 if ":" in ip else socket.AF_INET,
+                                      proto=0, flags=socket.AI_NUMERICHOST)]
+
+        cached = self._dns_cache.get((host, port, family))
+        if cached is not None and time.monotonic() - cached[0] < self.ttl:
+            self.stats["cache_hits"] += 1
+            return cached[1]
+        if self._fallback is None:
+            self._fallback = DefaultResolver()
+        self.stats["dns_lookups"] += 1
+        results = await self._fallback.resolve(host, port, family)
+        self._dns_cache[(host, port, family)] = (time.monotonic(), results)
+        return results
+
+    async def close(self):
+        if self._fallback is not None:
+            await self._fallback.close()
+            self._fallback = None
@@ -0,0 +1,111 @@
+# Python Imports
+import asyncio
+import logging
+import math
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+# Project Imports
+from src.result_sink import record_result
+from src.setup_status import NodesInformation
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class WaitResult:
+    name: str
+    ready: bool
+    # Seconds actually waited
+    waited: float
+    detail: str = ""
+
+
+def _finish(name: str, ready: bool, start: float, detail: str) -> WaitResult:
+    result = WaitResult(name, ready, time.monotonic() - start, detail)
+    record_result("wait", result=name, timestamp=time.time_ns(), value=result.waited)
+    if ready:
+        logger.info(f"Wait {name} ready after {result.waited:.2f} seconds: {detail}")
+    else:
+        logger.warning(f"Wait {name} timed out after {result.waited:.2f} seconds: {detail}")
+    return result
+
+
+def _peer_count(response: dict) -> int:
+    return len(response.get("result") or [])
+
+
+async def wait_for_peers(nodes: NodesInformation, min_peers: int = 1, timeout: float = 60,
+                         quorum: int | float = 1.0, poll_interval: float = 2, name: str = "peers") -> WaitResult:
+    """
+    Waits until quorum (amount or fraction) of the nodes have at least min_peers peers, polling wakuext_peers of the
+    nodes that are not there yet.
+    """
+    start = time.monotonic()
+    required = quorum if isinstance(quorum, int) else math.ceil(quorum * len(nodes))
+    pending = dict(nodes)
+    while True:
+        names = list(pending)
+        responses = await asyncio.gather(*[pending[node].wakuext_service.peers() for node in names],
+                                         return_exceptions=True)
+        for node, response in zip(names, responses):
+            if isinstance(response, Exception):
+                logger.debug(f"Failed to get peers of {node}: {response}")
+            elif _peer_count(response) >= min_peers:
+                del pending[node]
+
+        ready = len(nodes) - len(pending)
+        if ready >= required:
+            return _finish(name, True, start, f"{ready}/{len(nodes)} nodes have {min_peers} peers")
+        if time.monotonic() - start + poll_interval > timeout:
+            return _finish(name, False, start, f"{ready}/{len(nodes)} nodes have {min_peers} peers, {required} "
+                                               f"required. Missing: {list(pending)[:10]}")
+        await asyncio.sleep(poll_interval)
+
+
+async def traffic_counters(nodes: NodesInformation) -> dict[str, int]:
+    """
+    Signals and messages received by all the nodes, to use as since in the waits below.
+    """
+    counters = await asyncio.gather(*[node.signal.traffic_counters() for node in nodes.values()])
+    return {key: sum(counter[key] for counter in counters) for key in ("signals", "messages")}
+
+
+async def wait_for_messages(nodes: NodesInformation, count: int, timeout: float = 60,
+                            since: Optional[dict[str, int]] = None, poll_interval: float = 0.5,
+                            name: str = "messages") -> WaitResult:
+    """
+    Waits until count messages.new messages have been received, adding up all the nodes. Messages are counted from
+    since (see traffic_counters), or from the call.
+    """
+    start = time.monotonic()
+    baseline = (since or await traffic_counters(nodes))["messages"]
+    while True:
+        received = (await traffic_counters(nodes))["messages"] - baseline
+        if received >= count:
+            return _finish(name, True, start, f"{received}/{count} messages received")
+        if time.monotonic() - start + poll_interval > timeout:
+            return _finish(name, False, start, f"{received}/{count} messages received")
+        await asyncio.sleep(poll_interval)
+
+
+async def wait_for_quiet(nodes: NodesInformation, quiet_period: float = 5, timeout: float = 60,
+                         poll_interval: float = 0.5, name: str = "quiet") -> WaitResult:
+    """
+    Waits until the nodes receive no signals at all during quiet_period seconds.
+    """
+    start = time.monotonic()
+    last_signals = (await traffic_counters(nodes))["signals"]
+    last_change = start
+    while True:
+        await asyncio.sleep(poll_interval)
+        signals = (await traffic_counters(nodes))["signals"]
+        now = time.monotonic()
+        if signals != last_signals:
+            last_signals, last_change = signals, now
+        elif now - last_change >= quiet_period:
+            return _finish(name, True, start, f"no signals in {quiet_period} seconds")
+        if now - start + poll_interval > timeout:
+            return _finish(name, False, start, f"signals still arriving, last one "
+                                               f"{now - last_change:.2f} seconds ago")
@@ -0,0 +1,204 @@
+# Python Imports
+import asyncio
+import atexit
+import glob
+import gzip
+import logging
+import os
+import threading
+import time
+from typing import Any, Optional
+
+# Project Imports
+from src import json_codec
+from src.dataclasses import ResultEntry
+
+# pyarrow is optional, without it results are written as gzipped NDJSON chunks
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+# When set, results of every run are written to this path prefix
+RESULTS_PATH = os.getenv("BENCHMARK_RESULTS_PATH")
+
+COLUMNS = ("stage", "sender", "receiver", "timestamp", "result", "value", "recorded_at")
+
+
+class ResultWriter:
+    """
+    Streaming writer of result rows. Rows are batched in memory as columns and flushed in a thread, either to a
+    zstd compressed Parquet file (path.parquet) or to gzipped NDJSON chunks (path.00000.ndjson.gz, ...).
+    """
+    def __init__(self, path: str, batch_size: int = 10_000, use_parquet: Optional[bool] = None):
+        self.path = path
+        self.batch_size = batch_size
+        self.use_parquet = pyarrow is not None if use_parquet is None else use_parquet
+        if self.use_parquet and pyarrow is None:
+            raise RuntimeError("pyarrow is needed to write Parquet files")
+        self.rows_written = 0
+        self.closed = False
+        self._columns: dict[str, list] = {column: [] for column in COLUMNS}
+        self._chunk = 0
+        self._parquet_writer = None
+        # Flushes run in worker threads, and must not write concurrently to the same file
+        self._write_lock = threading.Lock()
+        self._pending_flushes: set[asyncio.Task] = set()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def __len__(self) -> int:
+        return len(self._columns["stage"])
+
+    def append(self, stage: str, sender: str = "", receiver: str = "", timestamp: int = 0, result: Any = "",
+               value: Optional[float] = None):
+        row = (stage, sender, receiver, int(timestamp), str(result), value, time.time_ns())
+        for column, item in zip(COLUMNS, row):
+            self._columns[column].append(item)
+        if len(self) >= self.batch_size:
+            self._flush_in_background()
+
+    def append_entry(self, stage: str, entry: ResultEntry, value: Optional[float] = None):
+        self.append(stage, entry.sender, entry.receiver, entry.timestamp, entry.result, value)
+
+    def append_batch(self, batch: dict[str, list]):
+        # Rows recorded by another writer, like the ones of the shard workers, keep their recorded_at
+        for column in COLUMNS:
+            self._columns[column].extend(batch[column])
+        if len(self) >= self.batch_size:
+            self._flush_in_background()
+
+    def _take_batch(self) -> dict[str, list]:
+        batch = self._columns
+        self._columns = {column: [] for column in COLUMNS}
+        return batch
+
+    def _flush_in_background(self):
+        batch = self._take_batch()
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._write(batch)
+            return
+        task = loop.create_task(asyncio.to_thread(self._write, batch))
+        self._pending_flushes.add(task)
+        task.add_done_callback(self._pending_flushes.discard)
+
+    def _write(self, batch: dict[str, list]):
+        rows = len(batch["stage"])
+        if not rows:
+            return
+        with self._write_lock:
+            if self.use_parquet:
+                table = pyarrow.table(batch, schema=self._schema())
+                if self._parquet_writer is None:
+                    self._parquet_writer = pyarrow.parquet.ParquetWriter(f"{self.path}.parquet", table.schema,
+                                                                         compression="zstd")
+                self._parquet_writer.write_table(table)
+            else:
+                with gzip.open(f"{self.path}.{self._chunk:05d}.ndjson.gz", "wb", compresslevel=5) as f:
+                    for row in zip(*(batch[column] for column in COLUMNS)):
+                        f.write(json_codec.dumps(dict(zip(COLUMNS, row))).encode() + b"\n")
+                self._chunk += 1
+            self.rows_written += rows
+        logger.debug(f"Flushed {rows} result rows to {self.path}")
+
+    @staticmethod
+    def _schema():
+        return pyarrow.schema([("stage", pyarrow.string()), ("sender", pyarrow.string()),
+                               ("receiver", pyarrow.string()), ("timestamp", pyarrow.int64()),
+                               ("result", pyarrow.string()), ("value", pyarrow.float64()),
+                               ("recorded_at", pyarrow.int64())])
+
+    async def flush(self):
+        batch = self._take_batch()
+        await asyncio.gather(*self._pending_flushes)
+        await asyncio.to_thread(self._write, batch)
+
+    def close_sync(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._write(self._take_batch())
+        with self._write_lock:
+            if self._parquet_writer is not None:
+                self._parquet_writer.close()
+                self._parquet_writer = None
+        logger.info(f"Wrote {self.rows_written} result rows to {self.path}")
+
+    async def close(self):
+        await self.flush()
+        await asyncio.to_thread(self.close_sync)
+
+
+def load_results(path: str):
+    """
+    Loads the results written under path. Returns a pandas DataFrame when pandas is available, and a dict of
+    columns otherwise.
+    """
+    try:
+        import pandas
+    except ImportError:
+        pandas = None
+
+    if os.path.exists(f"{path}.parquet"):
+        if pyarrow is None:
+            raise RuntimeError(f"pyarrow is needed to read {path}.parquet")
+        table = pyarrow.parquet.read_table(f"{path}.parquet")
+        return table.to_pandas() if pandas is not None else table.to_pydict()
+
+    columns: dict[str, list] = {column: [] for column in COLUMNS}
+    for chunk in sorted(glob.glob(f"{glob.escape(path)}.*.ndjson.gz")):
+        with gzip.open(chunk, "rb") as f:
+            for line in f:
+                row = json_codec.loads(line)
+                for column in COLUMNS:
+                    columns[column].append(row[column])
+    return pandas.DataFrame(columns) if pandas is not None else columns
+
+
+_result_writer: Optional[ResultWriter] = None
+
+
+def configure_result_writer(path: str, **kwargs) -> ResultWriter:
+    global _result_writer
+    if _result_writer is not None:
+        _result_writer.close_sync()
+    _result_writer = ResultWriter(path, **kwargs)
+    return _result_writer
+
+
+def set_result_writer(writer: Optional[ResultWriter]):
+    global _result_writer
+    if _result_writer is not None:
+        _result_writer.close_sync()
+    _result_writer = writer
+
+
+def get_result_writer() -> Optional[ResultWriter]:
+    global _result_writer
+    if _result_writer is None and RESULTS_PATH:
+        _result_writer = ResultWriter(f"{RESULTS_PATH}/results_{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}")
+    return _result_writer
+
+
+def record_result(stage: str, sender: str = "", receiver: str = "", timestamp: int = 0, result: Any = "",
+                  value: Optional[float] = None):
+    # No-op unless a result writer is configured
+    writer = get_result_writer()
+    if writer is not None:
+        writer.append(stage, sender, receiver, timestamp, result, value)
+
+
+def record_result_entry(stage: str, entry: ResultEntry, value: Optional[float] = None):
+    writer = get_result_writer()
+    if writer is not None:
+        writer.append_entry(stage, entry, value)
+
+
+@atexit.register
+def _close_result_writer():
+    if _result_writer is not None:
+        _result_writer.close_sync()
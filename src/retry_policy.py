@@ -0,0 +1,104 @@
+# Python Imports
+import asyncio
+import logging
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from typing import Optional, TypeVar
+from tenacity import AsyncRetrying, RetryCallState, retry_if_exception, stop_after_attempt, stop_after_delay, \
+    stop_never, wait_exponential_jitter
+from aiohttp import ClientError
+
+# Project Imports
+from src.rpc_metrics import RpcMetrics
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Errors of the connection to the backend, signals that did not arrive in time, and JSON-RPC errors, which the RPC
+# client raises as AssertionError
+TRANSIENT_ERRORS: tuple[type[BaseException], ...] = (ClientError, OSError, asyncio.TimeoutError, AssertionError)
+# Errors in the calls or in the handling of their responses, retrying will not fix them
+PERMANENT_ERRORS: tuple[type[BaseException], ...] = (TypeError, KeyError, ValueError)
+
+
+class RetryExhausted(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """
+    Async retry policy. Waits grow exponentially from initial_wait up to max_wait, plus a random jitter so the
+    retries of many nodes do not hit the backend at the same time. Retries stop after max_attempts or when deadline
+    seconds have passed since the first attempt, whichever comes first.
+    """
+    max_attempts: int = 40
+    deadline: Optional[float] = None
+    initial_wait: float = 0.5
+    max_wait: float = 2
+    jitter: float = 0.5
+    retryable: tuple[type[BaseException], ...] = TRANSIENT_ERRORS
+    # Checked before retryable, errors that retrying will not fix
+    non_retryable: tuple[type[BaseException], ...] = PERMANENT_ERRORS
+
+    def is_retryable(self, e: BaseException) -> bool:
+        return isinstance(e, self.retryable) and not isinstance(e, self.non_retryable)
+
+    def _stop(self):
+        stop = stop_after_attempt(self.max_attempts) if self.max_attempts else stop_never
+        if self.deadline is not None:
+            stop = stop | stop_after_delay(self.deadline)
+        return stop
+
+    async def run(self, action: str, func: Callable[..., Awaitable[T]], *args, description: str = "",
+                  **kwargs) -> T:
+        """
+        Awaits func(*args, **kwargs) until it succeeds. Attempts, errors and the total time of every call are kept in
+        the retry metrics of action.
+        """
+        metrics = get_retry_metrics().method(action)
+        target = f"{action} {description}".strip()
+        start = time.perf_counter()
+        attempts = 0
+
+        def _before_sleep(retry_state: RetryCallState):
+            logger.error(f"Attempt {retry_state.attempt_number}/{self.max_attempts} of {target}: "
+                         f"{retry_state.outcome.exception()}, retrying in {retry_state.upcoming_sleep:.2f} seconds")
+
+        retrying = AsyncRetrying(stop=self._stop(), reraise=True, before_sleep=_before_sleep,
+                                 retry=retry_if_exception(self.is_retryable),
+                                 wait=wait_exponential_jitter(self.initial_wait, self.max_wait, jitter=self.jitter))
+        try:
+            async for attempt in retrying:
+                with attempt:
+                    attempts += 1
+                    try:
+                        result = await func(*args, **kwargs)
+                    except Exception as e:
+                        metrics.record_error(e)
+                        raise
+        except Exception as e:
+            elapsed = time.perf_counter() - start
+            metrics.record_call(elapsed, attempts, failed=True)
+            if not self.is_retryable(e) or self.max_attempts == 1:
+                raise
+            raise RetryExhausted(f"Failed to {target} after {attempts} attempts in {elapsed:.1f} seconds: {e}") from e
+
+        metrics.record_call(time.perf_counter() - start, attempts)
+        return result
+
+
+_retry_metrics: Optional[RpcMetrics] = None
+
+
+def get_retry_metrics() -> RpcMetrics:
+    global _retry_metrics
+    if _retry_metrics is None:
+        _retry_metrics = RpcMetrics()
+    return _retry_metrics
+
+
+def log_retry_metrics():
+    get_retry_metrics().log_summary("all nodes", kind="Action")
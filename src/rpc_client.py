@@ -1,16 +1,30 @@
 # Python Imports
 import asyncio
-import json
 import logging
-from typing import List, Optional, Any, cast
-from aiohttp import ClientSession, ClientTimeout, ClientError
-from tenacity import retry, stop_after_delay, wait_fixed, retry_if_exception_type
+import time
+from typing import List, Optional, Any, Tuple, cast
+from aiohttp import ClientSession, ClientTimeout, ClientError, ClientConnectorError
+from tenacity import AsyncRetrying, stop_after_delay, wait_fixed, retry_if_exception_type
 
 # Project Imports
+from src import json_codec
 from src.logger import TraceLogger
+from src.rpc_metrics import RpcMetrics
 
 logger = cast(TraceLogger, logging.getLogger(__name__))
 
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+def decode_json_response(status: int, body: bytes) -> Any:
+    # The body is read once as bytes and decoded once, the text is only built to report errors
+    if status != 200:
+        raise AssertionError(f"Bad HTTP status: {status}, body: {body.decode(errors='replace')}")
+    try:
+        return json_codec.loads(body)
+    except json_codec.JSONDecodeError:
+        raise AssertionError(f"Invalid JSON in response: {body.decode(errors='replace')}")
+
 
 class AsyncRpcClient:
     def __init__(self, rpc_url: str, session: Optional[ClientSession] = None):
@@ -18,6 +32,9 @@ class AsyncRpcClient:
         self._owns_session = session is None
         self.session = session or ClientSession(timeout=ClientTimeout(total=10))
         self.request_counter = 0
+        self.metrics = RpcMetrics()
+        # Unknown until the first batch is sent, False once the backend rejected a batch
+        self.batch_supported: Optional[bool] = None
 
     async def __aenter__(self):
         return self
@@ -42,42 +59,164 @@ class AsyncRpcClient:
     def verify_is_json_rpc_error(self, data: dict):
         self._check_key_in_json(data, "error")
 
-    @retry(stop=stop_after_delay(10), wait=wait_fixed(0.5), reraise=True, retry=retry_if_exception_type((
-            ClientError, json.JSONDecodeError, AssertionError, asyncio.TimeoutError
-        )))
     async def rpc_request(self, method: str, params: Optional[List] = None, request_id: Optional[str] = None,
         url: Optional[str] = None, enable_logging: bool = True) -> dict:
+        metrics = self.metrics.method(method)
+        start = time.perf_counter()
+        attempts = 0
+        failed = True
+        try:
+            async for attempt in AsyncRetrying(stop=stop_after_delay(10), wait=wait_fixed(0.5), reraise=True,
+                                               retry=retry_if_exception_type((
+                                                   ClientError, json_codec.JSONDecodeError, AssertionError,
+                                                   asyncio.TimeoutError
+                                               ))):
+                with attempt:
+                    attempts += 1
+                    try:
+                        resp_json = await self._rpc_attempt(method, params, request_id, url, enable_logging)
+                    except Exception as e:
+                        metrics.record_error(e)
+                        raise
+            failed = False
+            return resp_json
+        finally:
+            metrics.record_call(time.perf_counter() - start, attempts, failed)
+
+    async def _rpc_attempt(self, method: str, params: Optional[List], request_id: Optional[str], url: Optional[str],
+                           enable_logging: bool) -> dict:
         if request_id is None:
             request_id = self.request_counter
             self.request_counter += 1
 
         url = url or self.rpc_url
         payload = {"jsonrpc": "2.0", "method": method, "id": request_id, "params": params or []}
+        data = json_codec.dumps_bytes(payload)
+        metrics = self.metrics.method(method)
+        metrics.record_request(len(data))
+        trace_enabled = enable_logging and logger.isEnabledFor(TraceLogger.TRACE)
 
-        if enable_logging:
-            logger.trace(f"Sending async POST to {url} with data: {json.dumps(payload, sort_keys=True)}")
-
-        async with self.session.post(url, json=payload) as response:
-            resp_text = await response.text()
+        if trace_enabled:
+            logger.trace(f"Sending async POST to {url} with data: {json_codec.dumps(payload, sort_keys=True)}")
 
-            if response.status != 200:
-                raise AssertionError(f"Bad HTTP status: {response.status}, body: {resp_text}")
+        async with self.session.post(url, data=data, headers=JSON_HEADERS) as response:
+            body = await response.read()
+        metrics.record_response(len(body))
+        resp_json = decode_json_response(response.status, body)
 
-            try:
-                resp_json = await response.json()
-            except json.JSONDecodeError:
-                raise AssertionError(f"Invalid JSON in response: {resp_text}")
+        if trace_enabled:
+            logger.trace(f"Received response: {json_codec.dumps(resp_json, sort_keys=True)}")
 
-            if enable_logging:
-                logger.trace(f"Received response: {json.dumps(resp_json, sort_keys=True)}")
+        if "error" in resp_json:
+            raise AssertionError(f"JSON-RPC Error: {resp_json['error']}")
 
-            if "error" in resp_json:
-                raise AssertionError(f"JSON-RPC Error: {resp_json['error']}")
-
-            return resp_json
+        return resp_json
 
     async def rpc_valid_request(self, method: str, params: Optional[List] = None, request_id: Optional[str] = None,
         url: Optional[str] = None, enable_logging: bool = True) -> dict:
         resp_json = await self.rpc_request(method, params, request_id, url, enable_logging=enable_logging)
         self.verify_is_valid_json_rpc_response(resp_json, request_id)
         return resp_json
+
+    async def rpc_batch_request(self, calls: List[Tuple[str, Optional[List]]], url: Optional[str] = None,
+                                enable_logging: bool = True, idempotent: bool = True,
+                                sequential: bool = False) -> List[dict]:
+        """
+        Sends the calls as a single JSON-RPC batch and returns their responses in the same order. Calls that fail
+        inside the batch are retried one by one. If the backend does not accept batches, every call is sent on its
+        own, concurrently unless sequential.
+
+        A batch that fails after it was sent may have been executed. Its calls are only sent again one by one if
+        they are idempotent, otherwise the error is raised, so messages and requests are never sent twice.
+        """
+        if not calls:
+            return []
+        if self.batch_supported is False or len(calls) == 1:
+            return await self._rpc_single_requests(calls, url, enable_logging, sequential)
+
+        request_ids = list(range(self.request_counter, self.request_counter + len(calls)))
+        self.request_counter += len(calls)
+        url = url or self.rpc_url
+        payload = [{"jsonrpc": "2.0", "method": method, "id": request_id, "params": params or []}
+                   for request_id, (method, params) in zip(request_ids, calls)]
+        data = json_codec.dumps_bytes(payload)
+        metrics = self.metrics.method("batch")
+        metrics.record_request(len(data))
+        trace_enabled = enable_logging and logger.isEnabledFor(TraceLogger.TRACE)
+
+        if trace_enabled:
+            logger.trace(f"Sending async batch POST to {url} with data: {json_codec.dumps(payload, sort_keys=True)}")
+
+        start = time.perf_counter()
+        try:
+            async with self.session.post(url, data=data, headers=JSON_HEADERS) as response:
+                body = await response.read()
+            metrics.record_response(len(body))
+            resp_json = json_codec.loads(body) if response.status == 200 else None
+        except (ClientError, json_codec.JSONDecodeError, asyncio.TimeoutError) as e:
+            metrics.record_error(e)
+            metrics.record_call(time.perf_counter() - start, 1, failed=True)
+            # Without a connection the batch was never sent
+            if not idempotent and not isinstance(e, ClientConnectorError):
+                raise
+            logger.debug(f"Batch request to {url} failed, sending calls one by one: {e}")
+            return await self._rpc_single_requests(calls, url, enable_logging, sequential)
+        metrics.record_call(time.perf_counter() - start, 1, failed=not isinstance(resp_json, list))
+
+        if response.status != 200:
+            # Transient errors of the backend or a proxy say nothing about batch support, only this batch is split
+            if not idempotent:
+                raise AssertionError(f"Bad HTTP status of batch request: {response.status}, "
+                                     f"body: {body.decode(errors='replace')}")
+            logger.debug(f"Batch request to {url} returned status {response.status}, sending calls one by one")
+            return await self._rpc_single_requests(calls, url, enable_logging, sequential)
+        if not isinstance(resp_json, list):
+            # Backends without batch support answer a batch with a single error object. Once a batch has worked, the
+            # backend is known to support them and the reply is only taken as a failure of this batch.
+            if self.batch_supported is None:
+                self.batch_supported = False
+                logger.info(f"Backend at {url} does not accept batch requests, falling back to single requests")
+            else:
+                logger.debug(f"Batch request to {url} got a non-batch response, sending calls one by one")
+            # A single error object answers the batch as a whole, none of its calls were executed
+            return await self._rpc_single_requests(calls, url, enable_logging, sequential)
+        self.batch_supported = True
+
+        if trace_enabled:
+            logger.trace(f"Received batch response: {json_codec.dumps(resp_json, sort_keys=True)}")
+
+        # Responses of a batch may come in any order
+        responses = {str(item.get("id")): item for item in resp_json if isinstance(item, dict)}
+        results: List[Optional[dict]] = [responses.get(str(request_id)) for request_id in request_ids]
+        # Calls that returned an error were not executed. A call without a response may have been, so it is only
+        # sent again if it is idempotent, and reported as failed otherwise.
+        failed = [index for index, result in enumerate(results)
+                  if (result is None and idempotent) or (result is not None and "error" in result)]
+        for index, request_id in enumerate(request_ids):
+            if results[index] is None and not idempotent:
+                results[index] = {"jsonrpc": "2.0", "id": request_id,
+                                  "error": {"message": "No response to the call in the batch response"}}
+        if failed:
+            logger.debug(f"{len(failed)}/{len(calls)} calls of a batch to {url} failed, retrying them one by one")
+            retried = await self._rpc_single_requests([calls[index] for index in failed], url, enable_logging,
+                                                      sequential)
+            for index, result in zip(failed, retried):
+                results[index] = result
+        return results
+
+    async def _rpc_single_requests(self, calls: List[Tuple[str, Optional[List]]], url: Optional[str],
+                                   enable_logging: bool, sequential: bool = False) -> List[dict]:
+        if sequential:
+            return [await self.rpc_request(method, params, url=url, enable_logging=enable_logging)
+                    for method, params in calls]
+        return list(await asyncio.gather(*[self.rpc_request(method, params, url=url, enable_logging=enable_logging)
+                                           for method, params in calls]))
+
+    async def rpc_valid_batch_request(self, calls: List[Tuple[str, Optional[List]]], url: Optional[str] = None,
+                                      enable_logging: bool = True, idempotent: bool = True,
+                                      sequential: bool = False) -> List[dict]:
+        results = await self.rpc_batch_request(calls, url, enable_logging=enable_logging, idempotent=idempotent,
+                                               sequential=sequential)
+        for resp_json in results:
+            self.verify_is_valid_json_rpc_response(resp_json)
+        return results
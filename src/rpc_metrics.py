@@ -0,0 +1,119 @@
+# Python Imports
+import asyncio
+import json
+import logging
+from typing import Optional
+
+# Project Imports
+from src.histogram import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+
+def classify_error(e: BaseException) -> str:
+    # Failed responses are raised as AssertionError, the message tells which check failed
+    if isinstance(e, AssertionError):
+        message = str(e)
+        if message.startswith("Bad HTTP status"):
+            return "http_status"
+        if message.startswith("Invalid JSON"):
+            return "invalid_json"
+        if message.startswith("JSON-RPC Error"):
+            return "json_rpc_error"
+        return "invalid_response"
+    if isinstance(e, asyncio.TimeoutError):
+        return "timeout"
+    if isinstance(e, json.JSONDecodeError):
+        return "invalid_json"
+    return type(e).__name__
+
+
+class MethodMetrics:
+    """
+    Metrics of the calls to a single JSON-RPC method. Latencies are measured per call, including every retry.
+    """
+    def __init__(self):
+        self.calls = 0
+        self.failures = 0
+        self.latency = LatencyHistogram()
+        # Amount of attempts -> amount of calls that needed them
+        self.attempts: dict[int, int] = {}
+        # Error class -> amount of failed attempts
+        self.errors: dict[str, int] = {}
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.max_request_bytes = 0
+        self.max_response_bytes = 0
+
+    def record_request(self, request_bytes: int):
+        self.request_bytes += request_bytes
+        self.max_request_bytes = max(self.max_request_bytes, request_bytes)
+
+    def record_response(self, response_bytes: int):
+        self.response_bytes += response_bytes
+        self.max_response_bytes = max(self.max_response_bytes, response_bytes)
+
+    def record_error(self, error: BaseException):
+        error_class = classify_error(error)
+        self.errors[error_class] = self.errors.get(error_class, 0) + 1
+
+    def record_call(self, latency: float, attempts: int, failed: bool = False):
+        self.calls += 1
+        if failed:
+            self.failures += 1
+        self.latency.record(latency)
+        self.attempts[attempts] = self.attempts.get(attempts, 0) + 1
+
+    def merge(self, other: "MethodMetrics"):
+        self.calls += other.calls
+        self.failures += other.failures
+        self.latency.merge(other.latency)
+        for attempts, count in other.attempts.items():
+            self.attempts[attempts] = self.attempts.get(attempts, 0) + count
+        for error_class, count in other.errors.items():
+            self.errors[error_class] = self.errors.get(error_class, 0) + count
+        self.request_bytes += other.request_bytes
+        self.response_bytes += other.response_bytes
+        self.max_request_bytes = max(self.max_request_bytes, other.max_request_bytes)
+        self.max_response_bytes = max(self.max_response_bytes, other.max_response_bytes)
+
+    def summary(self) -> dict:
+        total_attempts = sum(attempts * count for attempts, count in self.attempts.items())
+        return {
+            "calls": self.calls,
+            "failures": self.failures,
+            "latency": self.latency.summary(),
+            "attempts_per_call": total_attempts / self.calls if self.calls else None,
+            "retried_calls": sum(count for attempts, count in self.attempts.items() if attempts > 1),
+            "errors": dict(self.errors),
+            "request_bytes": self.request_bytes,
+            "response_bytes": self.response_bytes,
+            "max_request_bytes": self.max_request_bytes,
+            "max_response_bytes": self.max_response_bytes,
+        }
+
+
+class RpcMetrics:
+    """
+    Metrics per JSON-RPC method of one node. Metrics of several nodes are merged to get fleet-wide numbers.
+    """
+    def __init__(self):
+        self.methods: dict[str, MethodMetrics] = {}
+
+    def method(self, name: str) -> MethodMetrics:
+        metrics = self.methods.get(name)
+        if metrics is None:
+            metrics = self.methods[name] = MethodMetrics()
+        return metrics
+
+    def merge(self, other: "RpcMetrics"):
+        for name, metrics in other.methods.items():
+            self.method(name).merge(metrics)
+
+    def snapshot(self, method: Optional[str] = None) -> dict[str, dict]:
+        return {name: metrics.summary() for name, metrics in sorted(self.methods.items())
+                if method is None or method == name}
+
+    def log_summary(self, label: str = "all nodes", kind: str = "RPC"):
+        for name, summary in self.snapshot().items():
+            logger.info(f"{kind} {name} ({label}): {summary}")
@@ -1,5 +1,5 @@
 # Python Imports
-from typing import Optional
+from typing import Optional, List, Tuple
 
 # Project Imports
 from src.rpc_client import AsyncRpcClient
@@ -14,3 +14,8 @@ class AsyncService:
         # In order to be validated, the response is already awaited, so this already returns the dict data
         full_method_name = f"{self.name}_{method}"
         return await self.rpc.rpc_valid_request(full_method_name, params or [], enable_logging=enable_logging)
+
+    async def rpc_batch_request(self, calls: List[Tuple[str, Optional[list]]], enable_logging: bool = True,
+                                idempotent: bool = True) -> List[dict]:
+        full_calls = [(f"{self.name}_{method}", params or []) for method, params in calls]
+        return await self.rpc.rpc_valid_batch_request(full_calls, enable_logging=enable_logging, idempotent=idempotent)
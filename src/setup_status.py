@@ -4,44 +4,116 @@ import logging
 import random
 import string
 import time
+from collections.abc import AsyncIterator
 from functools import partial
 
 # Project Imports
+from src.account_registry import get_account_registry
 from src.async_utils import launch_workers, collect_results_from_tasks, TaskResult, CollectedItem, \
-    function_on_queue_item
+    function_on_queue_item, AdaptiveConcurrency
+from src.connection_pool import ConnectionManager, get_connection_manager
 from src.dataclasses import ResultEntry
+from src import sharding
 from src.enums import MessageContentType, SignalType
+from src.histogram import get_latency_histograms
+from src.metrics_server import start_metrics_server
+from src.pod_discovery import PodDiscovery
+from src.result_sink import record_result, record_result_entry
+from src.retry_policy import RetryPolicy, TRANSIENT_ERRORS, log_retry_metrics
+from src.rpc_metrics import RpcMetrics
+from src.signal_store import SignalRetention
+from src.staged_init import StagedInitializer, InitStage, DEFAULT_STAGES
 from src.status_backend import StatusBackend
 
 logger = logging.getLogger(__name__)
 
 NodesInformation = dict[str, StatusBackend]
 
+# Actions that change the state of a node are not retried, the RPC client already retries transport errors
+SINGLE_ATTEMPT = RetryPolicy(max_attempts=1)
+IDEMPOTENT_RETRY = RetryPolicy(max_attempts=5, deadline=60)
+# Until the join request reaches the owner, the owner's response does not contain it, and finding it raises
+# ValueError (or AttributeError without a result). Those are retried like transport errors.
+COMMUNITY_REQUEST_RETRY = RetryPolicy(max_attempts=40, deadline=120, initial_wait=0.5, max_wait=2,
+                                      retryable=(*TRANSIENT_ERRORS, ValueError, AttributeError), non_retryable=())
+
+# Seconds to wait for a contact request, or its acceptance, to reach the other node
+FRIEND_REQUEST_PROPAGATION_TIMEOUT = 60
+FRIEND_REQUEST_STAGES = ("friend_request_propagation", "friend_request_accept", "friend_request_total")
+
+
+async def initialize_nodes_application(pod_names: list[str] | PodDiscovery, wakuV2LightClient=False,
+                                       connection_manager: ConnectionManager | None = None,
+                                       signal_retention: dict[str, SignalRetention] | None = None,
+                                       shards: int | None = None, quorum: int | float = 1.0,
+                                       straggler_timeout: float | None = None,
+                                       stages: tuple[InitStage, ...] = DEFAULT_STAGES) -> NodesInformation:
+    """
+    Initializes the nodes stage by stage, see StagedInitializer. Pods that fail are left out of the result, as long
+    as at least quorum (amount or fraction of pods) nodes are initialized. With a PodDiscovery, every pod starts
+    initializing as soon as it is ready.
+    """
+    await start_metrics_server()
+    shards = sharding.SHARDS if shards is None else shards
+    if shards > 1:
+        if isinstance(pod_names, PodDiscovery):
+            # Pods are partitioned by ordinal, so the shards wait for the whole discovery
+            pod_names = await pod_names.list()
+        # Nodes are owned by worker processes, and the returned nodes forward every call to their worker
+        return await sharding.initialize_sharded_nodes(pod_names, shards, wakuV2LightClient=wakuV2LightClient,
+                                                       signal_retention=signal_retention, quorum=quorum,
+                                                       straggler_timeout=straggler_timeout, stages=stages)
+
+    # All backends share the same connection pool, instead of having one session per client and node.
+    connection_manager = connection_manager or get_connection_manager()
+    initializer = StagedInitializer(pod_names, stages, quorum, straggler_timeout, connection_manager,
+                                    signal_retention, wakuV2LightClient=wakuV2LightClient,
+                                    account_registry=get_account_registry())
+    nodes_status = await initializer.run()
+
+    logger.info(f"{len(nodes_status)} of {initializer.expected} nodes have been initialized successfully")
+    connection_manager.log_stats()
+    return nodes_status
 
-async def initialize_nodes_application(pod_names: list[str], wakuV2LightClient=False) -> NodesInformation:
-    # We don't need a lock here because we cannot have two pods with the same name, and no other operations are done.
-    nodes_status: NodesInformation = {}
 
-    async def _init_status(pod_name: str):
-        try:
-            status_backend = StatusBackend(
-                url=f"http://{pod_name}:3333",
-                await_signals=["messages.new", "message.delivered", "node.ready", "node.started", "node.login",
-                               "node.stopped"]
-            )
-            await status_backend.start_status_backend()
-            await status_backend.create_account_and_login(wakuV2LightClient=wakuV2LightClient)
-            await status_backend.wallet_service.start_wallet()
-            await status_backend.wakuext_service.start_messenger()
-            nodes_status[pod_name.split(".")[0]] = status_backend
-        except AssertionError as e:
-            logger.error(f"Error initializing StatusBackend for pod {pod_name}: {e}")
-            raise
+def stream_nodes_application(pod_names: list[str] | PodDiscovery, wakuV2LightClient=False, **kwargs) \
+        -> AsyncIterator[tuple[str, StatusBackend]]:
+    """
+    Same as initialize_nodes_application, but yields every (name, node) as soon as it is ready. Not available with
+    shards.
+    """
+    return StagedInitializer(pod_names, wakuV2LightClient=wakuV2LightClient, account_registry=get_account_registry(),
+                             **kwargs).stream()
 
-    await asyncio.gather(*[_init_status(pod) for pod in pod_names])
 
-    logger.info(f"All {len(pod_names)} nodes have been initialized successfully")
-    return nodes_status
+def report_signal_memory_usage(nodes: NodesInformation) -> dict[str, int]:
+    # Bytes used to keep received signals, per node, so the controlbox pod can be sized
+    usage = {}
+    for name, node in nodes.items():
+        per_signal = node.signal.memory_usage()
+        usage[name] = sum(signal_usage["bytes"] for signal_usage in per_signal.values())
+        logger.debug(f"Signal memory usage of {name}: {per_signal}")
+
+    if usage:
+        logger.info(f"Signal memory usage: total {sum(usage.values())} bytes for {len(usage)} nodes, "
+                    f"max {max(usage.values())} bytes in {max(usage, key=usage.get)}")
+    return usage
+
+
+def collect_rpc_metrics(nodes: NodesInformation) -> RpcMetrics:
+    # Can be called mid-run, metrics keep being recorded by the nodes
+    metrics = RpcMetrics()
+    for node in nodes.values():
+        metrics.merge(node.rpc.metrics)
+    return metrics
+
+
+def report_rpc_metrics(nodes: NodesInformation) -> dict[str, dict]:
+    metrics = collect_rpc_metrics(nodes)
+    metrics.log_summary(f"{len(nodes)} nodes")
+    # Attempts of the setup actions, on top of the retries of each RPC call
+    log_retry_metrics()
+    return metrics.snapshot()
 
 
 async def request_join_nodes_to_community(backend_nodes: NodesInformation,
@@ -49,12 +121,16 @@ async def request_join_nodes_to_community(backend_nodes: NodesInformation,
                                           nodes_to_join: list[str],
                                           community_id: str,
                                           finished_evt: asyncio.Event,
-                                          intermediate_delay: float = 1, max_in_flight: int = 0):
+                                          intermediate_delay: float = 1, max_in_flight: int = 0,
+                                          concurrency: AdaptiveConcurrency | None = None):
     async def _request_to_join_to_community(backend_nodes: NodesInformation, sender: str, community_id: str) -> ResultEntry:
         try:
             # We have "tryDatabase": True in fetch_community, if not we will need to wait for the response
-            _ = await backend_nodes[sender].wakuext_service.fetch_community(community_id)
-            response_to_join = await backend_nodes[sender].wakuext_service.request_to_join_community(community_id)
+            _ = await IDEMPOTENT_RETRY.run("fetch community", backend_nodes[sender].wakuext_service.fetch_community,
+                                           community_id, description=sender)
+            response_to_join = await SINGLE_ATTEMPT.run("request to join community",
+                                                        backend_nodes[sender].wakuext_service.request_to_join_community,
+                                                        community_id, description=sender)
             # TODO this response should come with timestamp
             join_id = response_to_join["result"]["requestsToJoinCommunity"][0]["id"]
             request_result = ResultEntry(sender=sender, receiver="",
@@ -78,7 +154,7 @@ async def request_join_nodes_to_community(backend_nodes: NodesInformation,
     collector_task = asyncio.create_task(
         collect_results_from_tasks(done_queue, results_queue, len(workers_to_launch), finished_evt))
     launcher_task = asyncio.create_task(
-        launch_workers(workers_to_launch, done_queue, intermediate_delay, max_in_flight))
+        launch_workers(workers_to_launch, done_queue, intermediate_delay, max_in_flight, concurrency))
 
     await asyncio.gather(launcher_task, collector_task)
 
@@ -88,9 +164,10 @@ async def request_join_nodes_to_community(backend_nodes: NodesInformation,
 async def login_nodes(backend_nodes: dict[str, StatusBackend], include: list[str]):
     async def _login_node(node: StatusBackend):
         try:
-            await node.login(node.find_key_uid())
-            await node.wakuext_service.start_messenger()
-            await node.wallet_service.start_wallet()
+            key_uid = await sharding.fetch(node, "find_key_uid")
+            await SINGLE_ATTEMPT.run("login node", node.login, key_uid, description=node.name)
+            await SINGLE_ATTEMPT.run("start wallet and messenger", node.start_wallet_and_messenger,
+                                     description=node.name)
         except AssertionError as e:
             logger.error(f"Error logging out node {node}: {e}")
             raise
@@ -101,30 +178,27 @@ async def login_nodes(backend_nodes: dict[str, StatusBackend], include: list[str
 async def accept_community_requests(node_owner: StatusBackend,  results_queue: asyncio.Queue[CollectedItem | None],
                                         consumers: int) -> asyncio.Queue[float]:
     async def _accept_community_request(queue_result: CollectedItem):
-        max_retries = 40
-        retry_interval = 0.5
         function_name, result_entry = queue_result
 
-        for attempt in range(max_retries):
-            try:
-                response = await node_owner.wakuext_service.accept_request_to_join_community(result_entry.result)
-                # We need to find the correspondant community of the join_id. We retrieve first chat because should be
-                # the only one. We do this because there can be several communities if we reuse the node.
-                # TODO why it returns the information of all communities? Getting the chat this way seems weird
-                msgs = await get_messages_by_message_type(response, "requestsToJoinCommunity", result_entry.result)
-                for community in response.get("result").get("communities"):
-                    # We always have one msg
-                    if community.get("id") == msgs[0].get("communityId"):
-                        # We always have one chat
-                        return list(community.get("chats").keys())[0]
-            except Exception as e:
-                logging.error(f"Attempt {attempt + 1}/{max_retries}: Unexpected error: {e}")
-                time.sleep(retry_interval)
-                await asyncio.sleep(2)
-
-        raise Exception(
-            f"Failed to accept request to join community in {max_retries * retry_interval} seconds."
-        )
+        async def _accept() -> str:
+            response = await node_owner.wakuext_service.accept_request_to_join_community(result_entry.result)
+            # We need to find the correspondant community of the join_id. We retrieve first chat because should be
+            # the only one. We do this because there can be several communities if we reuse the node.
+            # TODO why it returns the information of all communities? Getting the chat this way seems weird
+            msgs = await get_messages_by_message_type(response, "requestsToJoinCommunity", result_entry.result)
+            for community in response.get("result").get("communities"):
+                # We always have one msg
+                if community.get("id") == msgs[0].get("communityId"):
+                    # Time from the request to join until it was accepted, in seconds
+                    latency = (time.time_ns() - result_entry.timestamp) / 1e9
+                    get_latency_histograms().record("community_join_accept", result_entry.sender, latency)
+                    record_result_entry("accept_community_request", result_entry, latency)
+                    # We always have one chat
+                    return list(community.get("chats").keys())[0]
+            raise ValueError(f"Community of request {result_entry.result} not found in response")
+
+        return await COMMUNITY_REQUEST_RETRY.run("accept community request", _accept,
+                                                 description=f"from {result_entry.sender}")
 
     delays_queue: asyncio.Queue[float] = asyncio.Queue()
     logger.info(f"Accepting community requests from nodes")
@@ -140,40 +214,46 @@ async def accept_community_requests(node_owner: StatusBackend,  results_queue: a
 
 async def reject_community_requests(owner: StatusBackend, join_ids: list[str]):
     async def _reject_community_request(node: StatusBackend, join_id: str):
-        max_retries = 40
-        retry_interval = 0.5
+        async def _reject() -> dict:
+            response = await node.wakuext_service.decline_request_to_join_community(join_id)
+            record_result("reject_community_request", result=join_id, timestamp=time.time_ns())
+            return response # TODO do we want this
 
-        for attempt in range(max_retries):
-            try:
-                response = await node.wakuext_service.decline_request_to_join_community(join_id)
-                return response # TODO do we want this
-            except AssertionError as e:
-                logging.error(f"Attempt {attempt + 1}/{max_retries}: Unexpected error: {e}")
-                time.sleep(retry_interval)
-
-        raise Exception(
-            f"Failed to reject community request in {max_retries * retry_interval} seconds."
-        )
+        return await COMMUNITY_REQUEST_RETRY.run("reject community request", _reject, description=join_id)
 
     _ = await asyncio.gather(*[_reject_community_request(owner, join_id) for join_id in join_ids])
 
     logger.info(f"All {len(join_ids)} nodes have been rejected successfully")
 
 
+def friend_request_pairs(senders: list[str], receivers: list[str],
+                         cap_num_receivers: int | None = None) -> list[tuple[str, str]]:
+    return [
+        (sender, receiver)
+        for i, sender in enumerate(senders)
+        for receiver in
+        # We want to avoid slow scenarios if we can, so each sender will perform only cap_num_receivers requests,
+        # but also on different receivers.
+        (receivers if not cap_num_receivers else receivers[i * cap_num_receivers: (i + 1) * cap_num_receivers])
+    ]
+
+
 async def send_friend_requests(nodes: NodesInformation,
                                results_queue: asyncio.Queue[CollectedItem | None],
                                senders: list[str], receivers: list[str],
                                finished_evt: asyncio.Event,
                                cap_num_receivers: int | None = None,
-                               intermediate_delay: float = 1, max_in_flight: int = 0):
+                               intermediate_delay: float = 1, max_in_flight: int = 0,
+                               concurrency: AdaptiveConcurrency | None = None):
     """
     This function sends friend requests from a list of senders to a list of receivers. In order to avoid big scenarios
     like 100 senders to 100 receivers, that can take a lot of time, cap_num_receivers is used to limit the number of
     requests, so each sender performs only cap_num_receivers requests.
     """
     async def _send_friend_request(nodes: NodesInformation, sender: str, receiver: str):
-        response = await nodes[sender].wakuext_service.send_contact_request(nodes[receiver].public_key,
-                                                                            "Friend Request")
+        response = await SINGLE_ATTEMPT.run("send friend request", nodes[sender].wakuext_service.send_contact_request,
+                                            nodes[receiver].public_key, "Friend Request",
+                                            description=f"from {sender} to {receiver}")
         # Get responses and filter by contact requests to obtain request ids
         request_response = await get_messages_by_content_type(response, MessageContentType.CONTACT_REQUEST.value)
         # Create a ResultEntry using the first response (there is always only one friend request)
@@ -185,66 +265,96 @@ async def send_friend_requests(nodes: NodesInformation,
 
     done_queue: asyncio.Queue[TaskResult | None] = asyncio.Queue()
 
-    workers_to_launch = [
-        partial(_send_friend_request, nodes, sender, receiver)
-        for i, sender in enumerate(senders)
-        for receiver in
-        # We want to avoid slow scenarios if we can, so each sender will perform only cap_num_receivers requests,
-        # but also on different receivers.
-        (receivers if not cap_num_receivers else receivers[i * cap_num_receivers: (i + 1) * cap_num_receivers])
-    ]
+    workers_to_launch = [partial(_send_friend_request, nodes, sender, receiver)
+                         for sender, receiver in friend_request_pairs(senders, receivers, cap_num_receivers)]
 
     logger.info(f"Sending friend requests from {len(senders)} nodes to {len(receivers)} nodes")
     collector_task = asyncio.create_task(
         collect_results_from_tasks(done_queue, results_queue, len(workers_to_launch), finished_evt))
     launcher_task = asyncio.create_task(
-        launch_workers(workers_to_launch, done_queue, intermediate_delay, max_in_flight))
+        launch_workers(workers_to_launch, done_queue, intermediate_delay, max_in_flight, concurrency))
 
     await asyncio.gather(launcher_task, collector_task)
 
 
 async def accept_friend_requests(nodes: dict[str, StatusBackend], results_queue: asyncio.Queue[CollectedItem | None],
                                  consumers: int) -> asyncio.Queue[float]:
-    # TODO: This should be activated when the signal is received instead of getting looped
-    async def _accept_friend_request(queue_result: CollectedItem):
-        max_retries = 40
-        retry_interval = 2
+    """
+    Each request is accepted as soon as the receiver gets its messages.new signal, so there are no blind retries
+    while the request is still propagating. At most consumers accept calls run at the same time.
+    Latencies are recorded per stage: propagation (sent -> received), accept (received -> accepted signal in the
+    sender) and total. Signals are timed when the controller receives them, with sub-second precision.
+    """
+    accept_slots = asyncio.Semaphore(consumers)
+
+    async def _accept_friend_request(queue_result: CollectedItem) -> float:
         function_name, result_entry = queue_result
+        sender, receiver = nodes[result_entry.sender], nodes[result_entry.receiver]
+        sent_at = int(result_entry.timestamp) / 1000  # Convert unix milliseconds to seconds
+
+        received_at, _ = await receiver.signal.wait_for_message(SignalType.MESSAGES_NEW.value, key="message_id",
+                                                                value=result_entry.result,
+                                                                timeout=FRIEND_REQUEST_PROPAGATION_TIMEOUT)
+        propagation = received_at - sent_at
+        get_latency_histograms().record("friend_request_propagation", result_entry.receiver, propagation)
+        record_result_entry("friend_request_propagation", result_entry, propagation)
+
+        async with accept_slots:
+            _ = await IDEMPOTENT_RETRY.run("accept friend request",
+                                           receiver.wakuext_service.accept_contact_request, result_entry.result,
+                                           description=f"from {result_entry.sender} to {result_entry.receiver}")
+
+        accepted_signal = f"@{receiver.public_key} accepted your contact request"
+        accepted_at, _ = await sender.signal.find_signal_containing_string(SignalType.MESSAGES_NEW.value,
+                                                                           event_string=accepted_signal,
+                                                                           timeout=FRIEND_REQUEST_PROPAGATION_TIMEOUT)
+        histograms = get_latency_histograms()
+        histograms.record("friend_request_accept", result_entry.receiver, accepted_at - received_at)
+        histograms.record("friend_request_total", result_entry.receiver, accepted_at - sent_at)
+        record_result_entry("accept_friend_request", result_entry, accepted_at - received_at)
+        return accepted_at - sent_at
+
+    accept_tasks: list[tuple[ResultEntry, asyncio.Task]] = []
+
+    async def _dispatch():
+        # Every request gets its own task, waiting for a signal does not hold a consumer
+        while (queue_result := await results_queue.get()) is not None:
+            accept_tasks.append((queue_result[1], asyncio.create_task(_accept_friend_request(queue_result))))
+            results_queue.task_done()
+        results_queue.task_done()
 
-        for attempt in range(max_retries):
-            try:
-                _ = await nodes[result_entry.receiver].wakuext_service.accept_contact_request(result_entry.result)
-                accepted_signal = f"@{nodes[result_entry.receiver].public_key} accepted your contact request"
-                message = await nodes[result_entry.sender].signal.find_signal_containing_string(
-                    SignalType.MESSAGES_NEW.value,
-                    event_string=accepted_signal,
-                    timeout=10)
-                return message[0] - int(result_entry.timestamp) // 1000  # Convert unix milliseconds to seconds
-            except Exception as e:
-                logging.error(
-                    f"Attempt {attempt + 1}/{max_retries} from {result_entry.sender} to {result_entry.receiver}: "
-                    f"Unexpected error accepting friend request: {e}")
-                await asyncio.sleep(2)
-
-        raise Exception(
-            f"Failed to accept friend request in {max_retries * retry_interval} seconds."
-        )
+    logger.info(f"Accepting friend requests.")
+    await asyncio.gather(*[_dispatch() for _ in range(consumers)])
+    # A request that never arrives fails only its own pair, the others are still accepted and measured
+    delays = await asyncio.gather(*[task for _, task in accept_tasks], return_exceptions=True)
 
     delays_queue: asyncio.Queue[float] = asyncio.Queue()
+    failed = []
+    for (result_entry, _), delay in zip(accept_tasks, delays):
+        if isinstance(delay, BaseException):
+            failed.append((result_entry.sender, result_entry.receiver))
+            logger.error(f"Friend request from {result_entry.sender} to {result_entry.receiver} was not accepted: "
+                         f"{type(delay).__name__}: {delay}")
+            record_result_entry("accept_friend_request_failed", result_entry)
+        else:
+            delays_queue.put_nowait(delay)
+    if failed:
+        logger.warning(f"{len(failed)}/{len(accept_tasks)} friend requests were not accepted: {failed[:10]}")
 
-    logger.info(f"Accepting friend requests.")
-    workers = [asyncio.create_task(
-        function_on_queue_item(results_queue, _accept_friend_request, delays_queue))
-        for _ in range(consumers)]
+    return delays_queue
 
-    await asyncio.gather(*workers)
 
-    return delays_queue
+def log_friend_request_latencies():
+    for stage in FRIEND_REQUEST_STAGES:
+        get_latency_histograms().log_summary(stage)
 
 
 async def add_contacts(nodes: dict[str, StatusBackend], adders: list[str], contacts: list[str]):
     async def _add_contacts_to_node(nodes: dict[str, StatusBackend], adder: str, contacts: list[str]):
-        _ = await asyncio.gather(*[nodes[adder].wakuext_service.add_contact(nodes[contact].public_key, contact) for contact in contacts])
+        # One batch request per adder
+        _ = await IDEMPOTENT_RETRY.run("add contacts", nodes[adder].wakuext_service.add_contacts,
+                                       [(nodes[contact].public_key, contact) for contact in contacts],
+                                       description=adder)
 
         return _
 
@@ -256,24 +366,20 @@ async def add_contacts(nodes: dict[str, StatusBackend], adders: list[str], conta
 async def decline_friend_requests(nodes: dict[str, StatusBackend], results_queue: asyncio.Queue[CollectedItem | None],
                                  consumers: int) -> asyncio.Queue[float]:
     async def _decline_friend_request(queue_result: CollectedItem):
-        max_retries = 40
-        retry_interval = 2
         function_name, result_entry = queue_result
+        # Declined once it reached the receiver, like accept_friend_requests does
+        await nodes[result_entry.receiver].signal.wait_for_message(SignalType.MESSAGES_NEW.value, key="message_id",
+                                                                   value=result_entry.result,
+                                                                   timeout=FRIEND_REQUEST_PROPAGATION_TIMEOUT)
+
+        async def _decline() -> dict:
+            _ = await nodes[result_entry.receiver].wakuext_service.decline_contact_request(result_entry.result)
+            record_result_entry("decline_friend_request", result_entry)
+            # TODO: Is there a signal for this?
+            return _
 
-        for attempt in range(max_retries):
-            try:
-                _ = await nodes[result_entry.receiver].wakuext_service.decline_contact_request(result_entry.result)
-                # TODO: Is there a signal for this?
-                return _
-            except Exception as e:
-                logging.error(
-                    f"Attempt {attempt + 1}/{max_retries} from {result_entry.sender} to {result_entry.receiver}: "
-                    f"Unexpected error declining friend request: {e}")
-                await asyncio.sleep(2)
-
-        raise Exception(
-            f"Failed to reject friend request in {max_retries * retry_interval} seconds."
-        )
+        return await IDEMPOTENT_RETRY.run("decline friend request", _decline,
+                                          description=f"from {result_entry.sender} to {result_entry.receiver}")
 
     delays_queue: asyncio.Queue[float] = asyncio.Queue()
 
@@ -290,7 +396,8 @@ async def decline_friend_requests(nodes: dict[str, StatusBackend], results_queue
 async def create_group_chat(admin: StatusBackend, receivers: list[str]):
     name = f"private_group_{''.join(random.choices(string.ascii_letters, k=10))}"
     logger.info(f"Creating private group {name}")
-    response = await admin.wakuext_service.create_group_chat_with_members(receivers, name)
+    response = await SINGLE_ATTEMPT.run("create group chat", admin.wakuext_service.create_group_chat_with_members,
+                                        receivers, name, description=name)
     group_id = response.get("result", {}).get("chats")[0].get("id")
     logger.info(f"Group {name} created with ID {group_id}")
 
@@ -0,0 +1,490 @@
+# Python Imports
+import asyncio
+import concurrent.futures
+import contextlib
+import inspect
+import itertools
+import logging
+import math
+import multiprocessing
+import os
+import pickle
+import queue
+import re
+import threading
+from collections.abc import Callable
+from multiprocessing.connection import Connection
+from typing import Any, Optional
+
+# Project Imports
+from src.account_registry import get_account_registry
+from src.account_service import AccountAsyncService
+from src.connection_pool import get_connection_manager
+from src.histogram import HistogramRegistry, get_latency_histograms
+from src.pod_resolver import POD_ADDRESSES
+from src.rpc_client import AsyncRpcClient
+from src.result_sink import ResultWriter, get_result_writer, set_result_writer
+from src.signal_client import AsyncSignalClient, BufferedQueue
+from src.staged_init import StagedInitializer, DEFAULT_STAGES
+from src.status_backend import StatusBackend
+from src.wakuext_service import WakuextAsyncService
+from src.wallet_service import WalletAsyncService
+
+logger = logging.getLogger(__name__)
+
+# Amount of worker processes used by initialize_nodes_application. 1 keeps every node in the calling event loop.
+SHARDS = int(os.getenv("BENCHMARK_SHARDS", "1"))
+
+# Node attributes that are sent back with every call result, so they can be read without a round trip
+_STATE_ATTRIBUTES = ("name", "public_key", "base_url", "last_login")
+
+# Measured phases running in this process. Blocking calls to the shards raise during them.
+_measured_phases = 0
+
+# Attributes of the remote objects that are objects themselves, and their type. Dict values are (dict, value type).
+_CHILD_TYPES: dict[type, dict[str, Any]] = {
+    StatusBackend: {
+        "wakuext_service": WakuextAsyncService,
+        "wallet_service": WalletAsyncService,
+        "accounts_service": AccountAsyncService,
+        "signal": AsyncSignalClient,
+        "rpc": AsyncRpcClient,
+    },
+    AsyncSignalClient: {
+        "signal_queues": (dict, BufferedQueue),
+    },
+}
+
+Path = tuple[tuple[str, Any], ...]
+
+
+def pod_ordinal(pod_name: str) -> int:
+    match = re.search(r"-(\d+)$", pod_name.split(".")[0])
+    if match is None:
+        raise ValueError(f"Pod {pod_name} has no StatefulSet ordinal")
+    return int(match.group(1))
+
+
+def partition_pods(pod_names: list[str], shards: int) -> list[list[str]]:
+    partitions: list[list[str]] = [[] for _ in range(shards)]
+    for pod_name in pod_names:
+        partitions[pod_ordinal(pod_name) % shards].append(pod_name)
+    return [partition for partition in partitions if partition]
+
+
+def _resolve(node: StatusBackend, path: Path) -> Any:
+    target: Any = node
+    for kind, key in path:
+        target = getattr(target, key) if kind == "attr" else target[key]
+    return target
+
+
+def _picklable_exception(e: BaseException) -> BaseException:
+    try:
+        pickle.dumps(e)
+        return e
+    except Exception:
+        return RuntimeError(f"{type(e).__name__}: {e}")
+
+
+def _node_state(node: StatusBackend) -> dict:
+    return {attribute: getattr(node, attribute, None) for attribute in _STATE_ATTRIBUTES}
+
+
+def _take_histograms() -> dict:
+    # Histograms recorded by the worker since the last call, they are merged into the coordinator's
+    registry = get_latency_histograms()
+    histograms = registry.to_dict()
+    registry.histograms.clear()
+    return histograms
+
+
+class _ShardResultWriter(ResultWriter):
+    """
+    Result writer of the shard workers. Its batches are sent to the coordinator, and written by the coordinator's
+    writer with the rest of the results.
+    """
+    def __init__(self, send: Callable[[tuple], None], batch_size: int = 1_000):
+        super().__init__(f"shard-{os.getpid()}", batch_size=batch_size, use_parquet=False)
+        self._send = send
+
+    def _write(self, batch: dict[str, list]):
+        rows = len(batch["stage"])
+        if rows:
+            self._send(("results", batch))
+            self.rows_written += rows
+
+
+async def _serve_shard(conn: Connection, pod_names: list[str], init_kwargs: dict, addresses: dict[str, str],
+                       forward_results: bool):
+    loop = asyncio.get_running_loop()
+    send_lock = threading.Lock()
+
+    def send(message: tuple):
+        # Result batches are sent from the flush threads of the result writer
+        with send_lock:
+            conn.send(message)
+
+    result_writer = _ShardResultWriter(send) if forward_results else None
+    set_result_writer(result_writer)
+    # Addresses already known by the coordinator, like the ones found by a PodDiscovery, save a lookup per service
+    get_connection_manager().resolver.register(addresses)
+    # The quorum and the straggler timeout are applied by the coordinator over all the shards, so the shard keeps
+    # every node it can initialize, and reports each one as soon as it is ready
+    initializer = StagedInitializer(pod_names, quorum=0, account_registry=get_account_registry(), **init_kwargs)
+    nodes = initializer.ready
+
+    async def _initialize():
+        try:
+            async for node_name, node in initializer.stream():
+                send(("node", node_name, _node_state(node)))
+        except Exception as e:
+            send(("failed", _picklable_exception(e)))
+            return
+        get_connection_manager().log_stats()
+        send(("ready", {name: _node_state(node) for name, node in nodes.items()}, _take_histograms()))
+
+    async def _handle(call_id: int, node_name: str, path: Path, args: tuple, kwargs: dict):
+        node = nodes[node_name]
+        try:
+            target = _resolve(node, path)
+            if callable(target):
+                target = target(*args, **kwargs)
+                if inspect.isawaitable(target):
+                    target = await target
+            send(("result", call_id, True, target, node_name, _node_state(node)))
+        except Exception as e:
+            send(("result", call_id, False, _picklable_exception(e), node_name, _node_state(node)))
+
+    initialization = asyncio.create_task(_initialize())
+    tasks = set()
+    while True:
+        try:
+            command = await loop.run_in_executor(None, conn.recv)
+        except EOFError:
+            logger.error("Coordinator connection closed, stopping shard")
+            break
+        if command[0] == "stop":
+            break
+        if command[0] == "cancel":
+            cancelled = initializer.cancel_pending()
+            logger.info(f"Cancelled {cancelled} pods still initializing, as asked by the coordinator")
+            continue
+        task = asyncio.create_task(_handle(*command[1:]))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    initialization.cancel()
+    await asyncio.gather(initialization, *tasks, return_exceptions=True)
+    # Everything recorded after the initialization goes to the coordinator before the worker exits
+    if result_writer is not None:
+        await result_writer.flush()
+    send(("histograms", _take_histograms()))
+    await get_connection_manager().close()
+
+
+def _shard_main(conn: Connection, pod_names: list[str], init_kwargs: dict, addresses: dict[str, str],
+                forward_results: bool):
+    # Entry point of the worker processes. Importing the logger module configures logging in the new process.
+    import src.logger
+    from src.metrics_server import disable_metrics_server
+    disable_metrics_server()
+    if POD_ADDRESSES == "api":
+        # Spawned processes start with an unconfigured client, the resolver needs it to follow restarted pods
+        try:
+            from src import kube_utils
+            kube_utils.setup_kubernetes_client()
+        except Exception as e:
+            logger.warning(f"Can not configure the Kubernetes client in {multiprocessing.current_process().name}, "
+                           f"pods not sent by the coordinator are resolved with DNS: {type(e).__name__}: {e}")
+    asyncio.run(_serve_shard(conn, pod_names, init_kwargs, addresses, forward_results))
+    conn.close()
+
+
+class _Shard:
+    def __init__(self, index: int, pod_names: list[str], init_kwargs: dict, addresses: dict[str, str],
+                 loop: asyncio.AbstractEventLoop, on_node_ready: Optional[Callable[[], None]] = None):
+        self.index = index
+        self.pod_names = pod_names
+        self.loop = loop
+        # Called from the reader thread for every node reported ready
+        self.on_node_ready = on_node_ready
+        context = multiprocessing.get_context("spawn")
+        self.conn, child_conn = context.Pipe()
+        forward_results = get_result_writer() is not None
+        self.process = context.Process(target=_shard_main,
+                                       args=(child_conn, pod_names, init_kwargs, addresses, forward_results),
+                                       name=f"shard-{index}", daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.ready: concurrent.futures.Future = concurrent.futures.Future()
+        self.pending: dict[int, concurrent.futures.Future] = {}
+        self.states: dict[str, dict] = {}
+        # Histograms and result rows received from the worker, merged in the coordinator's event loop
+        self.recorded: queue.SimpleQueue = queue.SimpleQueue()
+        self._send_lock = threading.Lock()
+        self.reader = threading.Thread(target=self._read, name=f"shard-{index}-reader", daemon=True)
+        self.reader.start()
+
+    def _read(self):
+        # Results are set on concurrent futures, so they can be waited on both from coroutines and synchronously
+        while True:
+            try:
+                message = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            if message[0] == "node":
+                self.states[message[1]] = message[2]
+                if self.on_node_ready is not None:
+                    self.on_node_ready()
+            elif message[0] == "ready":
+                self.states.update(message[1])
+                # Scheduled before the ready future is resolved, so the histograms are merged when start returns
+                self._record(("histograms", message[2]))
+                self.ready.set_result(list(message[1]))
+            elif message[0] in ("histograms", "results"):
+                self._record(message)
+            elif message[0] == "failed":
+                self.ready.set_exception(message[1])
+            else:
+                _, call_id, ok, value, node_name, state = message
+                self.states[node_name] = state
+                future = self.pending.pop(call_id)
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+        error = RuntimeError(f"Shard {self.index} exited")
+        if not self.ready.done():
+            self.ready.set_exception(error)
+        for future in self.pending.values():
+            future.set_exception(error)
+        self.pending.clear()
+
+    def _record(self, message: tuple):
+        self.recorded.put(message)
+        try:
+            self.loop.call_soon_threadsafe(self.merge_recorded)
+        except RuntimeError:
+            # The loop is closed, the remaining messages are merged by stop
+            pass
+
+    def merge_recorded(self):
+        while True:
+            try:
+                kind, data = self.recorded.get_nowait()
+            except queue.Empty:
+                return
+            if kind == "histograms":
+                if data:
+                    get_latency_histograms().merge(HistogramRegistry.from_dict(data))
+            elif (writer := get_result_writer()) is not None:
+                writer.append_batch(data)
+
+    def send(self, command: tuple):
+        with self._send_lock:
+            self.conn.send(command)
+
+
+class ShardedController:
+    """
+    Coordinator of the worker processes that own the nodes. Every worker runs its own event loop with its nodes'
+    HTTP sessions and signal websockets, and the coordinator forwards calls on the nodes to the worker owning them.
+    """
+    def __init__(self):
+        self.shards: list[_Shard] = []
+        self.node_shard: dict[str, _Shard] = {}
+        self._call_ids = itertools.count()
+        self._open_nodes: set[str] = set()
+
+    async def start(self, pod_names: list[str], shards: int, quorum: int | float = 1.0,
+                    straggler_timeout: Optional[float] = None, **init_kwargs) -> dict[str, "RemoteStatusBackend"]:
+        """
+        Starts the shards and waits for their nodes. quorum and straggler_timeout work like in StagedInitializer, but
+        over all the shards: the shards keep every node they can initialize, and the ones still initializing are
+        cancelled straggler_timeout seconds after the whole fleet reached the quorum.
+        """
+        required = quorum if isinstance(quorum, int) else math.ceil(quorum * len(pod_names))
+        partitions = partition_pods(pod_names, shards)
+        logger.info(f"Starting {len(partitions)} shards for {len(pod_names)} nodes, {required} are required")
+
+        loop = asyncio.get_running_loop()
+        quorum_reached = asyncio.Event()
+        ready_count = 0
+
+        def _node_ready():
+            nonlocal ready_count
+            ready_count += 1
+            if ready_count >= required:
+                quorum_reached.set()
+
+        known = get_connection_manager().resolver.addresses
+        self.shards = [_Shard(index, partition, init_kwargs, {pod: known[pod] for pod in partition if pod in known},
+                              loop, lambda: loop.call_soon_threadsafe(_node_ready))
+                       for index, partition in enumerate(partitions)]
+        try:
+            ready_nodes = await self._wait_ready(quorum_reached, straggler_timeout)
+        except Exception:
+            self.stop()
+            raise
+
+        nodes = {}
+        for shard, node_names in zip(self.shards, ready_nodes):
+            for node_name in node_names:
+                self.node_shard[node_name] = shard
+                nodes[node_name] = RemoteStatusBackend(self, node_name)
+        logger.info(f"{len(nodes)} of {len(pod_names)} nodes have been initialized in {len(self.shards)} shards")
+        # Each worker logged its own pods, these are the stage latencies of the whole fleet
+        for stage in init_kwargs.get("stages", DEFAULT_STAGES):
+            get_latency_histograms().log_summary(f"init_{stage.name}")
+        if len(nodes) < required:
+            await asyncio.gather(*[node.close() for node in nodes.values()], return_exceptions=True)
+            self.stop()
+            raise RuntimeError(f"Only {len(nodes)}/{len(pod_names)} nodes were initialized, {required} are required")
+        self._open_nodes = set(nodes)
+        return nodes
+
+    async def _wait_ready(self, quorum_reached: asyncio.Event, straggler_timeout: Optional[float]) -> list[list[str]]:
+        everything = asyncio.gather(*[asyncio.wrap_future(shard.ready) for shard in self.shards])
+        if straggler_timeout is not None:
+            quorum = asyncio.create_task(quorum_reached.wait())
+            await asyncio.wait([everything, quorum], return_when=asyncio.FIRST_COMPLETED)
+            quorum.cancel()
+            if not everything.done():
+                await asyncio.wait([everything], timeout=straggler_timeout)
+                pending = [shard for shard in self.shards if not shard.ready.done()]
+                if pending:
+                    logger.warning(f"Cancelling the pods still initializing in {len(pending)} shards "
+                                   f"{straggler_timeout} seconds after reaching the quorum")
+                    for shard in pending:
+                        shard.send(("cancel",))
+        return await everything
+
+    def _submit(self, node_name: str, path: Path, args: tuple, kwargs: dict) -> concurrent.futures.Future:
+        shard = self.node_shard[node_name]
+        call_id = next(self._call_ids)
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        shard.pending[call_id] = future
+        shard.send(("call", call_id, node_name, path, args, kwargs))
+        return future
+
+    async def call(self, node_name: str, path: Path, *args, **kwargs) -> Any:
+        return await asyncio.wrap_future(self._submit(node_name, path, args, kwargs))
+
+    def call_sync(self, node_name: str, path: Path, *args, **kwargs) -> Any:
+        # Blocks the calling event loop, so it is only meant for reading results, not for the measured phases
+        if _measured_phases:
+            raise RuntimeError(f"Blocking access to {node_name}{_format_path(path)} during a measured phase, "
+                               f"use sharding.fetch instead")
+        return self._submit(node_name, path, args, kwargs).result()
+
+    def state(self, node_name: str) -> dict:
+        return self.node_shard[node_name].states[node_name]
+
+    def node_closed(self, node_name: str):
+        self._open_nodes.discard(node_name)
+        if not self._open_nodes:
+            self.stop()
+
+    def stop(self):
+        for shard in self.shards:
+            if shard.process.is_alive():
+                try:
+                    shard.send(("stop",))
+                except (BrokenPipeError, OSError):
+                    pass
+                shard.process.join(timeout=30)
+            if shard.process.is_alive():
+                shard.process.terminate()
+            # The last histograms and result rows of the worker are merged before returning
+            shard.reader.join(timeout=5)
+            shard.merge_recorded()
+        logger.info(f"Stopped {len(self.shards)} shards")
+
+
+class _RemoteObject:
+    def __init__(self, controller: ShardedController, node_name: str, path: Path, cls: Any):
+        self._controller = controller
+        self._node_name = node_name
+        self._path = path
+        self._cls = cls
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith("__"):
+            raise AttributeError(name)
+        path = self._path + (("attr", name),)
+        child_type = _CHILD_TYPES.get(self._cls, {}).get(name)
+        if child_type is not None:
+            return _RemoteObject(self._controller, self._node_name, path, child_type)
+
+        attribute = getattr(self._cls, name, None)
+        if inspect.iscoroutinefunction(attribute):
+            async def _remote_coroutine(*args, **kwargs):
+                return await self._controller.call(self._node_name, path, *args, **kwargs)
+            return _remote_coroutine
+        if callable(attribute):
+            return lambda *args, **kwargs: self._controller.call_sync(self._node_name, path, *args, **kwargs)
+        # Plain data attributes are fetched from the worker
+        return self._controller.call_sync(self._node_name, path)
+
+    def __getitem__(self, key: Any) -> Any:
+        if isinstance(self._cls, tuple):
+            return _RemoteObject(self._controller, self._node_name, self._path + (("item", key),), self._cls[1])
+        return self._controller.call_sync(self._node_name, self._path + (("item", key),))
+
+
+class RemoteStatusBackend(_RemoteObject):
+    """
+    Stand-in for a StatusBackend living in a shard worker, so scenario code can use it as any other node.
+    """
+    def __init__(self, controller: ShardedController, node_name: str):
+        super().__init__(controller, node_name, (), StatusBackend)
+
+    def __getattr__(self, name: str) -> Any:
+        if name in _STATE_ATTRIBUTES:
+            return self._controller.state(self._node_name)[name]
+        return super().__getattr__(name)
+
+    def __repr__(self) -> str:
+        return f"RemoteStatusBackend({self._node_name})"
+
+    async def shutdown(self):
+        await self._controller.call(self._node_name, (("attr", "shutdown"),))
+        self._controller.node_closed(self._node_name)
+
+
+def _format_path(path: Path) -> str:
+    return "".join(f".{key}" if kind == "attr" else f"[{key!r}]" for kind, key in path)
+
+
+@contextlib.contextmanager
+def measured_phase():
+    """
+    Marks a phase whose timings are measured. Sync methods and plain attributes of sharded nodes block the event
+    loop until the worker answers, so they raise inside it: fetch reads them without blocking.
+    """
+    global _measured_phases
+    _measured_phases += 1
+    try:
+        yield
+    finally:
+        _measured_phases -= 1
+
+
+async def fetch(target: Any, *attributes: str) -> Any:
+    """
+    Awaitable version of target.attribute...: the value is called when it is a sync method. Works on local nodes and
+    on sharded ones, whose worker is called without blocking the event loop.
+    """
+    if isinstance(target, _RemoteObject):
+        path = target._path + tuple(("attr", attribute) for attribute in attributes)
+        return await target._controller.call(target._node_name, path)
+    for attribute in attributes:
+        target = getattr(target, attribute)
+    return target() if callable(target) else target
+
+
+async def initialize_sharded_nodes(pod_names: list[str], shards: int, **init_kwargs) -> dict[str, RemoteStatusBackend]:
+    controller = ShardedController()
+    return await controller.start(pod_names, shards, **init_kwargs)
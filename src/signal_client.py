@@ -1,37 +1,112 @@
 # Python Imports
 import asyncio
 import contextlib
-import json
 import logging
 import os
-from typing import Optional, AsyncGenerator, cast
+import time
+from typing import Optional, AsyncGenerator, Callable, cast
 from aiohttp import ClientSession, ClientWebSocketResponse, WSMsgType
 from pathlib import Path
 from datetime import datetime
-from collections import deque
+from collections import deque, defaultdict
 
 # Project Imports
 from src.enums import SignalType
 from src.logger import TraceLogger
+from src.message_tracking import DeliveryTracker
+from src.result_sink import get_result_writer
+from src.signal_decoding import decode_signal
+from src.signal_store import MessageStore, MessageEntry, SignalRetention, DEFAULT_RETENTION, deep_sizeof
 
 logger = cast(TraceLogger, logging.getLogger(__name__))
 
 LOG_SIGNALS_TO_FILE = False
 SIGNALS_DIR = os.path.dirname(os.path.abspath(__file__))
 
+# Exact keys that received messages are indexed by, mapped to their field in the signal message
+MESSAGE_KEYS = {"message_id": "id", "chat_id": "chatId", "text": "text"}
+
+MessagePredicate = Callable[[dict], bool]
+
+
+class MessageWaiters:
+    """
+    Pending waiters for received messages. Waiters are registered either with an exact key (see MESSAGE_KEYS) or
+    with a predicate over the message, and are resolved directly when a matching message is received.
+    """
+    def __init__(self):
+        self._keyed: dict[tuple[str, str], list[asyncio.Future]] = defaultdict(list)
+        self._predicates: list[tuple[MessagePredicate, asyncio.Future]] = []
+
+    def __len__(self) -> int:
+        return sum(len(futures) for futures in self._keyed.values()) + len(self._predicates)
+
+    def add_key(self, key: str, value: str) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._keyed[(key, value)].append(future)
+        return future
+
+    def add_predicate(self, predicate: MessagePredicate) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._predicates.append((predicate, future))
+        return future
+
+    def discard(self, future: asyncio.Future):
+        for key, futures in list(self._keyed.items()):
+            if future in futures:
+                futures.remove(future)
+                if not futures:
+                    del self._keyed[key]
+        self._predicates = [(predicate, f) for predicate, f in self._predicates if f is not future]
+
+    def notify(self, message: dict, entry: MessageEntry):
+        if self._keyed:
+            for key, field in MESSAGE_KEYS.items():
+                for future in self._keyed.pop((key, message.get(field)), []):
+                    if not future.done():
+                        future.set_result(entry)
+
+        if self._predicates:
+            pending = []
+            for predicate, future in self._predicates:
+                if future.done():
+                    continue
+                if predicate(message):
+                    future.set_result(entry)
+                else:
+                    pending.append((predicate, future))
+            self._predicates = pending
+
 
 class BufferedQueue:
-    def __init__(self, max_size: int = 200):
-        self.queue = asyncio.Queue()
+    def __init__(self, max_size: int = 200, retention: SignalRetention = DEFAULT_RETENTION):
+        self.queue = asyncio.Queue(maxsize=retention.queue_size)
         self.buffer = deque(maxlen=max_size)
-        self.messages = []
+        # Local receive time of every buffered signal, in seconds. The timestamp of the signals is in whole seconds.
+        self.received_times = deque(maxlen=max_size)
+        # Received messages, indexed by their exact keys so already received messages are found without a rescan
+        self.messages = MessageStore(retention)
+        self.waiters = MessageWaiters()
+        self.dropped_signals = 0
+        # Totals since the queue was created, clear() does not reset them
+        self.received_signals = 0
+        self.received_messages = 0
 
     async def put(self, item):
+        received_at = time.time()
+        self.received_signals += 1
         if item.get("event") is not None and item.get("event").get("messages"):
+            self.received_messages += len(item["event"]["messages"])
             for message in item["event"]["messages"]:
-                self.messages.append((item["timestamp"], message["text"]))
+                self.messages.append(received_at, message)
+                self.waiters.notify(message, (received_at, message["text"]))
         self.buffer.append(item)
-        await self.queue.put(item)
+        self.received_times.append(received_at)
+        if self.queue.full():
+            # Most signal types are never consumed from the queue, so the oldest ones are dropped instead of growing
+            self.queue.get_nowait()
+            self.dropped_signals += 1
+        self.queue.put_nowait(item)
 
     async def get(self):
         return await self.queue.get()
@@ -39,18 +114,49 @@ class BufferedQueue:
     def recent(self) -> list:
         return list(self.buffer)
 
+    def recent_with_times(self) -> list[tuple[float, dict]]:
+        return list(zip(self.received_times, self.buffer))
+
+    def find(self, key: str, value: str) -> Optional[MessageEntry]:
+        if key not in MESSAGE_KEYS:
+            raise ValueError(f"Messages are not indexed by {key}, available keys are {list(MESSAGE_KEYS)}")
+        return self.messages.find(key, value)
+
+    def clear(self):
+        self.buffer.clear()
+        self.received_times.clear()
+        self.messages.clear()
+
+    def memory_usage(self) -> dict:
+        usage = self.messages.memory_usage()
+        usage["messages_bytes"] = usage.pop("bytes")
+        usage["buffer_bytes"] = deep_sizeof(self.buffer)
+        usage["queued"] = self.queue.qsize()
+        usage["dropped_signals"] = self.dropped_signals
+        usage["bytes"] = usage["messages_bytes"] + usage["buffer_bytes"]
+        return usage
+
 
 class AsyncSignalClient:
-    def __init__(self, ws_url: str, await_signals: list[str], buffer_size: int = 100):
+    def __init__(self, ws_url: str, await_signals: list[str], buffer_size: int = 100,
+                 session: Optional[ClientSession] = None, retention: Optional[dict[str, SignalRetention]] = None,
+                 node_name: str = ""):
         self.url = f"{ws_url}/signals"
+        self.node_name = node_name
+        self.delivery_tracker = DeliveryTracker()
         self.await_signals = await_signals
         self.ws: Optional[ClientWebSocketResponse] = None
-        self.session: Optional[ClientSession] = None
+        self._owns_session = session is None
+        self.session: Optional[ClientSession] = session
         self.signal_file_path = None
         self.listener_task = None
+        self.ignored_signals = 0
 
+        # Retention can be configured per signal type, the ones not given use the default
+        retention = retention or {}
         self.signal_queues: dict[str, BufferedQueue] = {
-            signal: BufferedQueue(max_size=buffer_size) for signal in self.await_signals
+            signal: BufferedQueue(max_size=buffer_size, retention=retention.get(signal, DEFAULT_RETENTION))
+            for signal in self.await_signals
         }
 
         if LOG_SIGNALS_TO_FILE: # Not being used currently
@@ -61,7 +167,8 @@ class AsyncSignalClient:
             )
 
     async def __aenter__(self):
-        self.session = ClientSession()
+        if self._owns_session:
+            self.session = ClientSession()
         self.ws = await self.session.ws_connect(self.url)
         self.listener_task = asyncio.create_task(self._listen())
         await asyncio.sleep(0)  # Yield control to ensure _listen starts
@@ -70,7 +177,7 @@ class AsyncSignalClient:
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         if self.ws:
             await self.ws.close()
-        if self.session:
+        if self.session and self._owns_session:
             await self.session.close()
         if self.listener_task:
             self.listener_task.cancel()
@@ -80,7 +187,7 @@ class AsyncSignalClient:
     async def _listen(self):
         logger.trace("WebSocket listener started")
         async for msg in self.ws:
-            if msg.type == WSMsgType.TEXT:
+            if msg.type in (WSMsgType.TEXT, WSMsgType.BINARY):
                 await self.on_message(msg.data)
             elif msg.type == WSMsgType.ERROR:
                 logger.error(f"WebSocket error: {self.ws.exception()}")
@@ -95,25 +202,52 @@ class AsyncSignalClient:
             for queue_name in queue_names:
                 queue = self.signal_queues.get(queue_name)
                 if queue and isinstance(queue, BufferedQueue):
-                    queue.buffer.clear()
-                    queue.messages.clear()
+                    queue.clear()
                     logger.debug(f"Cleaned queue: {queue_name}")
 
         logger.debug("Specified signal queues have been cleaned up.")
 
-    async def on_message(self, signal: str):
-        signal_data = json.loads(signal)
-        logger.trace(f"Received WebSocket message: {signal_data}")
+    def memory_usage(self) -> dict[str, dict]:
+        return {signal_type: queue.memory_usage() for signal_type, queue in self.signal_queues.items()}
+
+    async def traffic_counters(self) -> dict[str, int]:
+        # A coroutine, so sharded nodes answer it without blocking the coordinator loop
+        messages_new = self.signal_queues.get(SignalType.MESSAGES_NEW.value)
+        return {
+            "signals": sum(queue.received_signals for queue in self.signal_queues.values()) + self.ignored_signals,
+            "messages": messages_new.received_messages if messages_new is not None else 0,
+        }
+
+    async def on_message(self, signal: str | bytes):
+        # Frames of signal types that are not awaited are rejected before decoding the payload
+        signal_type, signal_data = decode_signal(signal, self.signal_queues)
+        trace_enabled = logger.isEnabledFor(TraceLogger.TRACE)
 
         if LOG_SIGNALS_TO_FILE:
             pass  # TODO: write to file if needed
 
-        signal_type = signal_data.get("type")
-        if signal_type in self.signal_queues:
-            await self.signal_queues[signal_type].put(signal_data)
+        if signal_data is None:
+            self.ignored_signals += 1
+            if trace_enabled:
+                logger.trace(f"Ignored signal not in await list: {signal_type}")
+            return
+
+        if trace_enabled:
+            logger.trace(f"Received WebSocket message: {signal_data}")
+        await self.signal_queues[signal_type].put(signal_data)
+        if signal_type == SignalType.MESSAGES_NEW.value:
+            self._on_new_messages(signal_data)
+        if trace_enabled:
             logger.trace(f"Queued signal: {signal_type}")
-        else:
-            logger.trace(f"Ignored signal not in await list: {signal_type}")
+
+    def _on_new_messages(self, signal_data: dict):
+        received_at = time.time()
+        writer = get_result_writer()
+        for message in signal_data.get("event", {}).get("messages") or []:
+            self.delivery_tracker.on_message(message.get("text", ""), received_at)
+            if writer is not None:
+                writer.append("received_message", message.get("from", ""), self.node_name,
+                              signal_data.get("timestamp", 0), message.get("id", ""))
 
     async def wait_for_signal(self, signal_type: str, timeout: int = 20) -> dict:
         if signal_type not in self.signal_queues:
@@ -149,25 +283,59 @@ class AsyncSignalClient:
     async def wait_for_logout(self) -> dict:
         return await self.wait_for_signal(SignalType.NODE_LOGOUT.value)
 
-    # TODO should be applied to other places
-    async def find_signal_containing_string(self, signal_type: str, event_string: str, timeout: int = 10) \
-            -> Optional[dict]:
+    def find_message(self, signal_type: str, key: str, value: str) -> Optional[MessageEntry]:
         if signal_type not in self.signal_queues:
             raise ValueError(f"Signal type {signal_type} is not in the list of awaited signals")
+        return self.signal_queues[signal_type].find(key, value)
+
+    async def wait_for_message(self, signal_type: str, key: Optional[str] = None, value: Optional[str] = None,
+                               predicate: Optional[MessagePredicate] = None, timeout: float = 10) -> MessageEntry:
+        """
+        Waits until a message matching either the exact key (message_id, chat_id or text) or the predicate is
+        received. Messages already received are checked first, through the index for keys, or with a single scan
+        of the buffered signals for predicates.
+        """
+        if signal_type not in self.signal_queues:
+            raise ValueError(f"Signal type {signal_type} is not in the list of awaited signals")
+        if (key is None) == (predicate is None):
+            raise ValueError("Either a key or a predicate must be given")
 
         queue = self.signal_queues[signal_type]
-        end_time = asyncio.get_event_loop().time() + timeout
+        if key is not None:
+            entry = queue.find(key, value)
+            if entry is not None:
+                return entry
+            future = queue.waiters.add_key(key, value)
+        else:
+            for received_at, signal in queue.recent_with_times():
+                for message in signal.get("event", {}).get("messages") or []:
+                    if predicate(message):
+                        return received_at, message["text"]
+            future = queue.waiters.add_predicate(predicate)
 
-        # TODO MAKE THIS TO BE TRIGGERED AUTOMATICALLY WHEN MESSAGE APPEARS
-        while True:
-            for message in queue.messages:
-                if event_string in message[1]:
-                    # Remove the found signal from the buffer
-                    # queue.buffer.remove(signal)
-                    logger.debug(f"Found {signal_type} containing '{event_string}' in messages")
-                    return message
-
-            if asyncio.get_event_loop().time() > end_time:
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            queue.waiters.discard(future)
+            description = f"{key}={value}" if key is not None else "predicate"
+            raise TimeoutError(f"{signal_type} message with {description} not found in {timeout} seconds")
+
+    async def find_signal_containing_string(self, signal_type: str, event_string: str, timeout: int = 10) \
+            -> Optional[MessageEntry]:
+        if signal_type not in self.signal_queues:
+            raise ValueError(f"Signal type {signal_type} is not in the list of awaited signals")
+
+        queue = self.signal_queues[signal_type]
+        # Exact matches are found through the index, substrings need a single scan of what was already received
+        message = queue.find("text", event_string)
+        if message is None:
+            message = next((message for message in queue.messages if event_string in message[1]), None)
+        if message is None:
+            try:
+                message = await self.wait_for_message(signal_type, predicate=lambda m: event_string in m["text"],
+                                                      timeout=timeout)
+            except TimeoutError:
                 raise TimeoutError(f"{signal_type} containing '{event_string}' not found in {timeout} seconds")
 
-            await asyncio.sleep(0.2)
+        logger.debug(f"Found {signal_type} containing '{event_string}' in messages")
+        return message
@@ -0,0 +1,90 @@
+# Python Imports
+import re
+from typing import Optional, Any
+
+# Project Imports
+from src import json_codec
+from src.enums import SignalType
+
+# status-go serializes the signal envelope with "type" as its first key, so it can be read from the beginning of the
+# frame without decoding the whole payload.
+_TYPE_PREFIX_STR = re.compile(r'\s*\{\s*"type"\s*:\s*"([^"\\]*)"')
+_TYPE_PREFIX_BYTES = re.compile(rb'\s*\{\s*"type"\s*:\s*"([^"\\]*)"')
+_PEEK_SIZE = 128
+
+# Fields of the message objects in messages.new signals that the benchmarks use
+MESSAGE_FIELDS = ("id", "text", "chatId", "timestamp", "from", "contentType")
+
+
+def peek_signal_type(frame: str | bytes) -> Optional[str]:
+    """
+    Returns the signal type of a raw websocket frame without decoding it, or None when the frame does not start
+    with the type key, in which case it has to be decoded to know its type.
+    """
+    if isinstance(frame, str):
+        match = _TYPE_PREFIX_STR.match(frame, 0, _PEEK_SIZE)
+        return match.group(1) if match else None
+    match = _TYPE_PREFIX_BYTES.match(frame, 0, _PEEK_SIZE)
+    return match.group(1).decode() if match else None
+
+
+def _extract_messages_new(event: dict) -> dict:
+    messages = event.get("messages")
+    if not messages:
+        return {}
+    return {"messages": [{field: message[field] for field in MESSAGE_FIELDS if field in message}
+                         for message in messages]}
+
+
+def _extract_node_login(event: dict) -> dict:
+    extracted: dict[str, Any] = {}
+    if "error" in event:
+        extracted["error"] = event["error"]
+    public_key = event.get("settings", {}).get("public-key")
+    if public_key is not None:
+        extracted["settings"] = {"public-key": public_key}
+    key_uid = event.get("account", {}).get("key-uid")
+    if key_uid is not None:
+        extracted["account"] = {"key-uid": key_uid}
+    return extracted
+
+
+def _extract_error(event: dict) -> dict:
+    return {"error": event["error"]} if "error" in event else {}
+
+
+# Signal types not listed here keep their whole event
+EVENT_EXTRACTORS = {
+    SignalType.MESSAGES_NEW.value: _extract_messages_new,
+    SignalType.NODE_LOGIN.value: _extract_node_login,
+    SignalType.NODE_LOGOUT.value: _extract_error,
+    SignalType.NODE_READY.value: _extract_error,
+    SignalType.NODE_STARTED.value: _extract_error,
+}
+
+
+def extract_signal_fields(signal: dict) -> dict:
+    # Keeps only the fields of the event that are used, so the stored signals do not retain the whole payload
+    extractor = EVENT_EXTRACTORS.get(signal.get("type"))
+    if extractor is None or not isinstance(signal.get("event"), dict):
+        return signal
+    compact = {"type": signal["type"], "event": extractor(signal["event"])}
+    if "timestamp" in signal:
+        compact["timestamp"] = signal["timestamp"]
+    return compact
+
+
+def decode_signal(frame: str | bytes, wanted_types: set[str] | dict) -> tuple[Optional[str], Optional[dict]]:
+    """
+    Decodes a websocket frame only if its type is one of wanted_types.
+    Returns the signal type, if it could be known, and the decoded signal, or None if the frame was rejected.
+    """
+    signal_type = peek_signal_type(frame)
+    if signal_type is not None and signal_type not in wanted_types:
+        return signal_type, None
+
+    signal = json_codec.loads(frame)
+    signal_type = signal.get("type")
+    if signal_type not in wanted_types:
+        return signal_type, None
+    return signal_type, extract_signal_fields(signal)
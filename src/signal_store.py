@@ -0,0 +1,206 @@
+# Python Imports
+import sys
+from array import array
+from collections import deque
+from dataclasses import dataclass
+from enum import Enum
+from typing import Iterator, Optional
+
+# Project Imports
+
+# (local receive time in seconds, text)
+MessageEntry = tuple[float, str]
+
+# Compaction of the columns is done only when the evicted head is at least this big, so it stays amortized O(1)
+_COMPACT_MIN_ENTRIES = 1024
+
+
+class RetentionPolicy(Enum):
+    # Keep the last max_messages messages
+    RING = "ring"
+    # Keep as many messages as fit in max_bytes, dropping the oldest ones first
+    DROP_OLDEST = "drop_oldest"
+    # Do not keep messages, only counters and first/last timestamps
+    COUNT_ONLY = "count_only"
+
+
+@dataclass(frozen=True)
+class SignalRetention:
+    policy: RetentionPolicy = RetentionPolicy.DROP_OLDEST
+    max_messages: int = 10_000
+    max_bytes: int = 8 * 1024 * 1024
+    # Maximum amount of undelivered signals kept for wait_for_signal/signal_stream consumers
+    queue_size: int = 1_000
+
+
+DEFAULT_RETENTION = SignalRetention()
+
+
+class MessageStore:
+    """
+    Columnar storage of received message metadata. Timestamps live in an array, and message ids and texts are kept
+    UTF-8 encoded in a single bytearray referenced by offsets, instead of one Python tuple per message.
+
+    Entries are read back as (timestamp, text) tuples, timestamps being the time the controller received the message. received, first_timestamp and last_timestamp account for every
+    message, including those evicted by the retention policy.
+    """
+    def __init__(self, retention: SignalRetention = DEFAULT_RETENTION):
+        self.retention = retention
+        self.received = 0
+        self.dropped = 0
+        self.first_timestamp: Optional[float] = None
+        self.last_timestamp: Optional[float] = None
+        self._timestamps = array("d")
+        self._offsets = array("Q")
+        self._id_lengths = array("I")
+        self._blob = bytearray()
+        self._head = 0
+        # Sequence number of the entry at position 0 of the columns
+        self._base_seq = 0
+        # Keys are hashed and verified against the stored entry on lookup. Chat ids are few, so they are kept as is.
+        # Message ids and texts point to their first message, chat ids to their latest one.
+        self._index: dict[tuple[str, int | str], int] = {}
+
+    def __len__(self) -> int:
+        return len(self._timestamps) - self._head
+
+    def __iter__(self) -> Iterator[MessageEntry]:
+        for position in range(self._head, len(self._timestamps)):
+            yield self._entry(position)
+
+    def __getitem__(self, item: int) -> MessageEntry:
+        length = len(self)
+        if item < 0:
+            item += length
+        if not 0 <= item < length:
+            raise IndexError("MessageStore index out of range")
+        return self._entry(self._head + item)
+
+    @property
+    def nbytes(self) -> int:
+        # Allocated size, including evicted entries that are still waiting for a compaction
+        return (self._timestamps.buffer_info()[1] * self._timestamps.itemsize
+                + self._offsets.buffer_info()[1] * self._offsets.itemsize
+                + self._id_lengths.buffer_info()[1] * self._id_lengths.itemsize
+                + len(self._blob)
+                + sys.getsizeof(self._index))
+
+    def _live_bytes(self) -> int:
+        entry_size = self._timestamps.itemsize + self._offsets.itemsize + self._id_lengths.itemsize
+        blob_start = self._offsets[self._head] if len(self) else len(self._blob)
+        return len(self._blob) - blob_start + len(self) * entry_size + sys.getsizeof(self._index)
+
+    def _record(self, position: int) -> tuple[str, str]:
+        start = self._offsets[position]
+        end = self._offsets[position + 1] if position + 1 < len(self._offsets) else len(self._blob)
+        id_end = start + self._id_lengths[position]
+        return self._blob[start:id_end].decode(), self._blob[id_end:end].decode()
+
+    def _entry(self, position: int) -> MessageEntry:
+        return self._timestamps[position], self._record(position)[1]
+
+    def append(self, timestamp: float, message: dict):
+        self.received += 1
+        if self.first_timestamp is None:
+            self.first_timestamp = timestamp
+        self.last_timestamp = timestamp
+
+        if self.retention.policy == RetentionPolicy.COUNT_ONLY:
+            self.dropped += 1
+            return
+
+        message_id = (message.get("id") or "").encode()
+        text = message.get("text", "")
+        self._timestamps.append(timestamp)
+        self._offsets.append(len(self._blob))
+        self._id_lengths.append(len(message_id))
+        self._blob += message_id
+        self._blob += text.encode()
+
+        seq = self._base_seq + len(self._timestamps) - 1
+        if message_id:
+            self._index.setdefault(("message_id", hash(message_id.decode())), seq)
+        self._index.setdefault(("text", hash(text)), seq)
+        if message.get("chatId"):
+            # The latest message of a chat, so the chat is found as long as any of its messages is stored
+            self._index[("chat_id", message["chatId"])] = seq
+
+        self._enforce_retention()
+
+    def _over_budget(self) -> bool:
+        if not len(self):
+            return False
+        if self.retention.policy == RetentionPolicy.RING:
+            return len(self) > self.retention.max_messages
+        return self._live_bytes() > self.retention.max_bytes
+
+    def _enforce_retention(self):
+        while self._over_budget():
+            self._evict_head()
+        if self._head >= _COMPACT_MIN_ENTRIES and self._head * 2 >= len(self._timestamps):
+            self._compact()
+
+    def _evict_head(self):
+        seq = self._base_seq + self._head
+        message_id, text = self._record(self._head)
+        for key in (("message_id", hash(message_id)), ("text", hash(text))):
+            if self._index.get(key) == seq:
+                del self._index[key]
+        self._head += 1
+        self.dropped += 1
+
+    def _compact(self):
+        if self._head == 0:
+            return
+        cut = self._offsets[self._head] if len(self) else len(self._blob)
+        del self._blob[:cut]
+        del self._timestamps[:self._head]
+        self._offsets = array("Q", (offset - cut for offset in self._offsets[self._head:]))
+        del self._id_lengths[:self._head]
+        self._base_seq += self._head
+        self._head = 0
+
+    def find(self, key: str, value: str) -> Optional[MessageEntry]:
+        lookup_key = (key, value) if key == "chat_id" else (key, hash(value))
+        seq = self._index.get(lookup_key)
+        if seq is None:
+            return None
+        position = seq - self._base_seq
+        if position < self._head:
+            del self._index[lookup_key]
+            return None
+        if key != "chat_id":
+            message_id, text = self._record(position)
+            if (message_id if key == "message_id" else text) != value:
+                return None
+        return self._entry(position)
+
+    def clear(self):
+        self._base_seq += len(self._timestamps)
+        self._timestamps = array("d")
+        self._offsets = array("Q")
+        self._id_lengths = array("I")
+        self._blob = bytearray()
+        self._index.clear()
+        self._head = 0
+        self.received = 0
+        self.dropped = 0
+        self.first_timestamp = None
+        self.last_timestamp = None
+
+    def memory_usage(self) -> dict:
+        return {"stored": len(self), "received": self.received, "dropped": self.dropped, "bytes": self.nbytes}
+
+
+def deep_sizeof(obj, _seen: Optional[set] = None) -> int:
+    # Rough deep size of decoded signals, only following the containers json produces
+    _seen = _seen if _seen is not None else set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, _seen) + deep_sizeof(v, _seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, deque)):
+        size += sum(deep_sizeof(item, _seen) for item in obj)
+    return size
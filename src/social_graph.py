@@ -0,0 +1,184 @@
+# Python Imports
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass, asdict
+from typing import Optional
+
+# Project Imports
+from src.json_store import read_json_store, update_json_store
+from src.status_backend import StatusBackend
+
+logger = logging.getLogger(__name__)
+
+# Topologies built by the scenarios (communities, accepted contacts, group chats) are kept here, so later runs against
+# the same fleet can reuse them instead of building them again. Set it to an empty string to always build them.
+SOCIAL_GRAPH_FIXTURES_PATH = os.getenv("BENCHMARK_FIXTURES",
+                                       os.path.expanduser("~/.status-benchmarks/fixtures.json"))
+
+COMMUNITY = "community"
+CONTACTS = "contacts"
+GROUP_CHATS = "group_chats"
+
+
+@dataclass
+class SocialGraphFixture:
+    kind: str
+    # Pod -> public key of every node in the topology, a different key means the account was created again
+    nodes: dict[str, str]
+    # community: owner, community_id, chat_id, members
+    # contacts: pairs of [sender, receiver]
+    # group_chats: members_per_admin and group_ids, in the same order
+    data: dict
+    created_at: int
+
+
+def fixture_key(name: str, pods: list[str]) -> str:
+    # Fixtures are kept per fleet, the fleet being the pod name prefixes (status-backend-relay, ...)
+    fleet = "+".join(sorted({pod.rsplit("-", 1)[0] for pod in pods}))
+    return f"{fleet}/{name}"
+
+
+def build_fixture(kind: str, nodes: dict[str, StatusBackend], pods: list[str], **data) -> SocialGraphFixture:
+    return SocialGraphFixture(kind=kind, nodes={pod: nodes[pod].public_key for pod in pods}, data=data,
+                              created_at=int(time.time()))
+
+
+class FixtureStore:
+    """
+    File backed store of social graph fixtures, saved as soon as they are put. Several processes (see sharding) can
+    save to the same file.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.fixtures: dict[str, SocialGraphFixture] = self._read()
+
+    def _read(self) -> dict[str, SocialGraphFixture]:
+        return {key: SocialGraphFixture(**fixture) for key, fixture in read_json_store(self.path).items()}
+
+    def get(self, key: str) -> Optional[SocialGraphFixture]:
+        return self.fixtures.get(key)
+
+    def put(self, key: str, fixture: SocialGraphFixture):
+        self._save({key: asdict(fixture)})
+        logger.info(f"Saved {fixture.kind} fixture {key} to {self.path}")
+
+    def remove(self, key: str):
+        if key in self.fixtures:
+            self._save({key: None})
+            logger.info(f"Removed fixture {key} from {self.path}")
+
+    def _save(self, updates: dict[str, Optional[dict]]):
+        data = update_json_store(self.path, updates)
+        self.fixtures = {key: SocialGraphFixture(**fixture) for key, fixture in data.items()}
+
+
+async def _joined_communities(node: StatusBackend) -> set[str]:
+    response = await node.wakuext_service.joined_communities()
+    return {community.get("id") for community in response.get("result") or []}
+
+
+async def _mutual_contacts(node: StatusBackend) -> set[str]:
+    response = await node.wakuext_service.contacts()
+    return {contact.get("id") for contact in response.get("result") or [] if contact.get("mutual")}
+
+
+async def _active_chats(node: StatusBackend) -> set[str]:
+    response = await node.wakuext_service.chats()
+    return {chat.get("id") for chat in response.get("result") or [] if chat.get("active")}
+
+
+async def _missing_community_members(nodes: dict[str, StatusBackend], data: dict) -> list[str]:
+    pods = [data["owner"], *data["members"]]
+    joined = await asyncio.gather(*[_joined_communities(nodes[pod]) for pod in pods])
+    return [pod for pod, communities in zip(pods, joined) if data["community_id"] not in communities]
+
+
+async def _missing_contacts(nodes: dict[str, StatusBackend], data: dict) -> list[str]:
+    receivers_per_sender: dict[str, list[str]] = {}
+    for sender, receiver in data["pairs"]:
+        receivers_per_sender.setdefault(sender, []).append(receiver)
+    senders = list(receivers_per_sender)
+    contacts = await asyncio.gather(*[_mutual_contacts(nodes[sender]) for sender in senders])
+    return [f"{sender}->{receiver}" for sender, mutual in zip(senders, contacts)
+            for receiver in receivers_per_sender[sender] if nodes[receiver].public_key not in mutual]
+
+
+async def _missing_group_members(nodes: dict[str, StatusBackend], data: dict) -> list[str]:
+    memberships = [(pod, group_id) for (admin, members), group_id in zip(data["members_per_admin"].items(),
+                                                                          data["group_ids"])
+                   for pod in [admin, *members]]
+    chats = await asyncio.gather(*[_active_chats(nodes[pod]) for pod, _ in memberships])
+    return [f"{pod} in {group_id}" for (pod, group_id), active in zip(memberships, chats) if group_id not in active]
+
+
+_VERIFIERS = {
+    COMMUNITY: _missing_community_members,
+    CONTACTS: _missing_contacts,
+    GROUP_CHATS: _missing_group_members,
+}
+
+
+async def verify_fixture(nodes: dict[str, StatusBackend], key: str, fixture: SocialGraphFixture) -> bool:
+    """
+    Checks that the topology of the fixture still exists on the nodes: same accounts, and every membership or
+    contact is still there.
+    """
+    changed = [pod for pod, public_key in fixture.nodes.items()
+               if pod not in nodes or nodes[pod].public_key != public_key]
+    if changed:
+        logger.info(f"Fixture {key} is stale, {len(changed)} nodes are missing or have a new account: {changed[:10]}")
+        return False
+    try:
+        missing = await _VERIFIERS[fixture.kind](nodes, fixture.data)
+    except Exception as e:
+        logger.warning(f"Failed to verify fixture {key}: {type(e).__name__}: {e}")
+        return False
+    if missing:
+        logger.info(f"Fixture {key} is stale, {len(missing)} {fixture.kind} entries are missing: {missing[:10]}")
+        return False
+    logger.info(f"Fixture {key} verified on {len(fixture.nodes)} nodes")
+    return True
+
+
+async def find_fixture(nodes: dict[str, StatusBackend], key: str, kind: str, pods: list[str],
+                       **expected) -> Optional[SocialGraphFixture]:
+    """
+    Returns the stored fixture of key if it was built with the same pods and expected data, and it still exists on
+    the nodes. Stale fixtures are removed.
+    """
+    store = get_fixture_store()
+    fixture = store.get(key) if store is not None else None
+    if fixture is None:
+        return None
+    if fixture.kind != kind or set(fixture.nodes) != set(pods) or \
+            any(fixture.data.get(name) != value for name, value in expected.items()):
+        logger.info(f"Fixture {key} was built for a different topology, building it again")
+        return None
+    if not await verify_fixture(nodes, key, fixture):
+        store.remove(key)
+        return None
+    return fixture
+
+
+def save_fixture(key: str, fixture: SocialGraphFixture):
+    store = get_fixture_store()
+    if store is not None:
+        store.put(key, fixture)
+
+
+_fixture_store: Optional[FixtureStore] = None
+
+
+def get_fixture_store() -> Optional[FixtureStore]:
+    global _fixture_store
+    if _fixture_store is None and SOCIAL_GRAPH_FIXTURES_PATH:
+        _fixture_store = FixtureStore(SOCIAL_GRAPH_FIXTURES_PATH)
+    return _fixture_store
+
+
+def configure_fixture_store(path: str) -> FixtureStore:
+    global _fixture_store
+    _fixture_store = FixtureStore(path)
+    return _fixture_store
@@ -0,0 +1,265 @@
+# Python Imports
+import asyncio
+import contextlib
+import logging
+import math
+import os
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable
+from dataclasses import dataclass, field
+from typing import Optional
+
+# Project Imports
+from src.account_registry import AccountRecord, AccountRegistry
+from src.connection_pool import ConnectionManager, get_connection_manager
+from src.histogram import get_latency_histograms
+from src.metrics_server import get_metrics_registry
+from src.pod_discovery import PodDiscovery
+from src.result_sink import record_result
+from src.retry_policy import RetryPolicy
+from src.signal_store import SignalRetention
+from src.status_backend import StatusBackend
+
+logger = logging.getLogger(__name__)
+
+# URL of the status-backend of a pod, BENCHMARK_NODE_URL points the harness to another backend, like the mock server
+NODE_URL = os.getenv("BENCHMARK_NODE_URL", "http://{pod_name}:3333")
+
+AWAITED_SIGNALS = ["messages.new", "message.delivered", "node.ready", "node.started", "node.login", "node.stopped"]
+
+
+@dataclass(frozen=True)
+class InitStage:
+    name: str
+    run: Callable[[StatusBackend, dict], Awaitable]
+    # Pods that can be in this stage at the same time
+    concurrency: int
+    timeout: Optional[float] = None
+    retry: RetryPolicy = RetryPolicy(max_attempts=1)
+
+
+async def _initialize_application(node: StatusBackend, options: dict):
+    await node.start_status_backend()
+
+
+async def _login_existing_account(node: StatusBackend, record: AccountRecord) -> bool:
+    if record.key_uid not in {account.get("key-uid") for account in node.accounts}:
+        logger.info(f"Account {record.key_uid} of {node.name} is not in the pod anymore, creating a new one")
+        return False
+    try:
+        await node.login(record.key_uid)
+    except (AssertionError, TimeoutError) as e:
+        logger.warning(f"Failed to log in account {record.key_uid} of {node.name}, creating a new one: {e}")
+        with contextlib.suppress(AssertionError, TimeoutError):
+            await node.logout()
+        return False
+    if node.public_key != record.public_key:
+        logger.warning(f"Account {record.key_uid} of {node.name} logged in with public key {node.public_key}, "
+                       f"{record.public_key} was expected")
+    return True
+
+
+async def _login_or_create_account(node: StatusBackend, options: dict):
+    light_client = options.get("wakuV2LightClient", False)
+    registry: Optional[AccountRegistry] = options.get("account_registry")
+    record = registry.get(node.name) if registry is not None else None
+
+    # The light client setting is chosen when the account is created
+    if record is not None and record.light_client == light_client and await _login_existing_account(node, record):
+        registry.mark_login(node.name)
+        record_result("init_account", node.name, timestamp=time.time_ns(), result="login")
+        return
+
+    await node.create_account_and_login(wakuV2LightClient=light_client)
+    record_result("init_account", node.name, timestamp=time.time_ns(), result="created")
+    if registry is not None:
+        registry.put(node.name, AccountRecord(key_uid=node.find_key_uid(), public_key=node.public_key,
+                                              light_client=light_client, created_at=int(time.time())))
+
+
+async def _start_services(node: StatusBackend, options: dict):
+    await node.start_wallet_and_messenger()
+
+
+# Account creation and login run the KDF with 256k iterations in every pod, so fewer pods go through them at once
+DEFAULT_STAGES = (
+    InitStage("initialize_application", _initialize_application, concurrency=100, timeout=60),
+    InitStage("account", _login_or_create_account, concurrency=50, timeout=120),
+    InitStage("start_services", _start_services, concurrency=100, timeout=60),
+)
+
+
+@dataclass
+class PodInit:
+    pod_name: str
+    node: StatusBackend
+    # Stage name -> seconds spent in it, including the wait for a free slot
+    durations: dict[str, float] = field(default_factory=dict)
+    stage: Optional[str] = None
+    error: Optional[str] = None
+
+
+class StagedInitializer:
+    """
+    Initializes the nodes of a fleet as a pipeline of stages, each one with its own concurrency limit, so pods do not
+    wait for the slowest pod of the previous stage. Ready nodes can be consumed as they come with stream().
+
+    quorum is the amount (int) or fraction (float) of pods that must be ready, failed pods are left out of the
+    result. Once the quorum is reached, straggler_timeout bounds how long the remaining pods are waited for.
+
+    pod_names can be a PodDiscovery, pods are then initialized as soon as they are ready in Kubernetes. The quorum is
+    counted over all the replicas, and straggler_timeout starts once the discovery is over.
+    """
+    def __init__(self, pod_names: list[str] | PodDiscovery, stages: tuple[InitStage, ...] = DEFAULT_STAGES,
+                 quorum: int | float = 1.0, straggler_timeout: Optional[float] = None,
+                 connection_manager: Optional[ConnectionManager] = None,
+                 signal_retention: Optional[dict[str, SignalRetention]] = None, node_url: str = NODE_URL,
+                 **options):
+        self.discovery = pod_names if isinstance(pod_names, PodDiscovery) else None
+        self.pod_names = [] if self.discovery is not None else pod_names
+        self.stages = stages
+        self.quorum = quorum
+        self.expected = len(self.pod_names)
+        self.required = self._required(self.expected)
+        self.straggler_timeout = straggler_timeout
+        self.connection_manager = connection_manager or get_connection_manager()
+        self.signal_retention = signal_retention
+        self.node_url = node_url
+        self.options = options
+        self.pods: dict[str, PodInit] = {}
+        self.ready: dict[str, StatusBackend] = {}
+        self.failed: dict[str, PodInit] = {}
+        self._slots = {stage.name: asyncio.Semaphore(stage.concurrency) for stage in stages}
+        self._ready_queue: asyncio.Queue[Optional[tuple[str, StatusBackend]]] = asyncio.Queue()
+        self._quorum_reached = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []
+
+    def _required(self, expected: int) -> int:
+        return self.quorum if isinstance(self.quorum, int) else math.ceil(self.quorum * expected)
+
+    def _create_node(self, pod_name: str) -> StatusBackend:
+        return StatusBackend(url=self.node_url.format(pod_name=pod_name), await_signals=AWAITED_SIGNALS,
+                             connection_manager=self.connection_manager, signal_retention=self.signal_retention,
+                             name=pod_name.split(".")[0])
+
+    async def _run_stage(self, pod: PodInit, stage: InitStage):
+        start = time.monotonic()
+        pod.stage = stage.name
+        async with self._slots[stage.name]:
+            try:
+                await asyncio.wait_for(stage.retry.run(f"init {stage.name}", stage.run, pod.node, self.options,
+                                                       description=pod.pod_name), stage.timeout)
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"Stage {stage.name} did not finish in {stage.timeout} seconds")
+        duration = time.monotonic() - start
+        pod.durations[stage.name] = duration
+        get_latency_histograms().record(f"init_{stage.name}", pod.pod_name, duration)
+        record_result("init_stage", pod.pod_name, timestamp=time.time_ns(), result=stage.name, value=duration)
+
+    async def _init_pod(self, pod_name: str):
+        name = pod_name.split(".")[0]
+        pod = self.pods[name] = PodInit(pod_name, self._create_node(pod_name))
+        try:
+            for stage in self.stages:
+                await self._run_stage(pod, stage)
+        except asyncio.CancelledError:
+            # Stragglers are cancelled once the quorum is reached
+            await self._fail(pod, "cancelled")
+            return
+        except Exception as e:
+            await self._fail(pod, f"{type(e).__name__}: {e}")
+            return
+
+        pod.stage = None
+        self.ready[name] = pod.node
+        get_metrics_registry().track_node(name, pod.node)
+        self._ready_queue.put_nowait((name, pod.node))
+        if len(self.ready) >= self.required:
+            self._quorum_reached.set()
+
+    async def _fail(self, pod: PodInit, error: str):
+        pod.error = error
+        self.failed[pod.pod_name.split(".")[0]] = pod
+        logger.error(f"Error initializing StatusBackend for pod {pod.pod_name} in stage {pod.stage}: {error}")
+        try:
+            await pod.node.close()
+        except Exception as e:
+            logger.debug(f"Error closing failed node {pod.pod_name}: {e}")
+
+    async def _discover(self):
+        await self.discovery.start()
+        self.expected = self.discovery.expected
+        self.required = self._required(self.expected)
+        try:
+            async for pod_name in self.discovery:
+                self.pod_names.append(pod_name)
+                self._tasks.append(asyncio.create_task(self._init_pod(pod_name)))
+        except Exception as e:
+            # The pods found so far are still initialized, the quorum decides if that is enough
+            logger.error(f"Pod discovery failed after {len(self.pod_names)} pods: {type(e).__name__}: {e}")
+
+    async def _supervise(self):
+        if self.discovery is not None:
+            await self._discover()
+        else:
+            self._tasks = [asyncio.create_task(self._init_pod(pod_name)) for pod_name in self.pod_names]
+        everything = asyncio.gather(*self._tasks)
+        if self.straggler_timeout is None:
+            await everything
+        else:
+            quorum = asyncio.create_task(self._quorum_reached.wait())
+            await asyncio.wait([everything, quorum], return_when=asyncio.FIRST_COMPLETED)
+            quorum.cancel()
+            if not everything.done():
+                _, pending = await asyncio.wait(self._tasks, timeout=self.straggler_timeout)
+                if pending:
+                    logger.warning(f"Cancelling {len(pending)} pods still initializing {self.straggler_timeout} "
+                                   f"seconds after reaching the quorum")
+                    self.cancel_pending()
+                await everything
+        self._ready_queue.put_nowait(None)
+
+    def cancel_pending(self) -> int:
+        """
+        Cancels the pods still initializing, they are counted as failed. Returns how many were cancelled.
+        """
+        pending = [task for task in self._tasks if not task.done()]
+        for task in pending:
+            task.cancel()
+        return len(pending)
+
+    async def stream(self) -> AsyncIterator[tuple[str, StatusBackend]]:
+        supervisor = asyncio.create_task(self._supervise())
+        try:
+            while (item := await self._ready_queue.get()) is not None:
+                yield item
+        finally:
+            await supervisor
+        if self.options.get("account_registry") is not None:
+            self.options["account_registry"].save()
+        self.log_summary()
+        if len(self.ready) < self.required:
+            await asyncio.gather(*[node.close() for node in self.ready.values()], return_exceptions=True)
+            raise RuntimeError(f"Only {len(self.ready)}/{self.expected} nodes were initialized, "
+                               f"{self.required} are required. Failed pods: {list(self.failed)}")
+
+    async def run(self) -> dict[str, StatusBackend]:
+        async for _ in self.stream():
+            pass
+        return self.ready
+
+    def stage_durations(self) -> dict[str, dict[str, float]]:
+        return {name: dict(pod.durations) for name, pod in self.pods.items()}
+
+    def log_summary(self, slowest: int = 5):
+        logger.info(f"{len(self.ready)}/{self.expected} nodes initialized, {len(self.failed)} failed")
+        histograms = get_latency_histograms()
+        for stage in self.stages:
+            histograms.log_summary(f"init_{stage.name}")
+            timed = [(pod.durations[stage.name], name) for name, pod in self.pods.items()
+                     if stage.name in pod.durations]
+            if timed:
+                logger.info(f"Slowest pods in {stage.name}: "
+                            f"{[(name, round(duration, 3)) for duration, name in sorted(timed)[-slowest:][::-1]]}")
+        for name, pod in self.failed.items():
+            logger.info(f"Pod {name} failed in {pod.stage} after {pod.durations}: {pod.error}")
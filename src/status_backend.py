@@ -1,16 +1,19 @@
 # Python Imports
 import logging
-import json
 import time
-from typing import List, Dict, cast
+from typing import List, Dict, Optional, cast
+from urllib.parse import urlparse
 from aiohttp import ClientSession, ClientTimeout
 
 # Project Imports
+from src import json_codec
 from src.account_service import AccountAsyncService
+from src.connection_pool import ConnectionManager
 from src.enums import SignalType
 from src.logger import TraceLogger
-from src.rpc_client import AsyncRpcClient
+from src.rpc_client import AsyncRpcClient, JSON_HEADERS, decode_json_response
 from src.signal_client import AsyncSignalClient
+from src.signal_store import SignalRetention
 from src.wakuext_service import WakuextAsyncService
 from src.wallet_service import WalletAsyncService
 
@@ -18,16 +21,32 @@ logger = cast(TraceLogger, logging.getLogger(__name__))
 
 
 class StatusBackend:
-    def __init__(self, url: str, await_signals: List[str] = None):
+    def __init__(self, url: str, await_signals: List[str] = None,
+                 connection_manager: Optional[ConnectionManager] = None,
+                 signal_retention: Optional[Dict[str, SignalRetention]] = None, name: Optional[str] = None):
         self.base_url = url
+        self.name = name or urlparse(url).hostname.split(".")[0]
         self.api_url = f"{url}/statusgo"
         self.ws_url = url.replace("http", "ws")
         self.rpc_url = f"{url}/statusgo/CallRPC"
         self.public_key = ""
-
-        self.rpc = AsyncRpcClient(self.rpc_url)
-        self.signal = AsyncSignalClient(self.ws_url, await_signals)
-        self.session = ClientSession(timeout=ClientTimeout(total=10))
+        # Accounts found in the data dir by InitializeApplication
+        self.accounts: List[dict] = []
+
+        self.connection_manager = connection_manager
+        if connection_manager is not None:
+            # Shared sessions are owned by the connection manager, so they are not closed on shutdown
+            self._owns_session = False
+            self.session = connection_manager.http_session
+            self.rpc = AsyncRpcClient(self.rpc_url, session=self.session)
+            self.signal = AsyncSignalClient(self.ws_url, await_signals, session=connection_manager.ws_session,
+                                            retention=signal_retention, node_name=self.name)
+        else:
+            self._owns_session = True
+            self.session = ClientSession(timeout=ClientTimeout(total=10))
+            self.rpc = AsyncRpcClient(self.rpc_url)
+            self.signal = AsyncSignalClient(self.ws_url, await_signals, retention=signal_retention,
+                                            node_name=self.name)
 
         self.wakuext_service = WakuextAsyncService(self.rpc)
         self.wallet_service = WalletAsyncService(self.rpc)
@@ -36,6 +55,8 @@ class StatusBackend:
     async def __aenter__(self):
         await self.rpc.__aenter__()
         await self.signal.__aenter__()
+        if self.connection_manager is not None:
+            self.connection_manager.websocket_opened()
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
@@ -44,37 +65,46 @@ class StatusBackend:
 
     async def shutdown(self):
         await self.logout()
+        await self.close()
+
+    async def close(self):
+        # Closes the connections without logging out, also for nodes that failed to start
+        websocket_open = self.signal.ws is not None and not self.signal.ws.closed
         await self.signal.__aexit__(None, None, None)
+        if self.connection_manager is not None and websocket_open:
+            self.connection_manager.websocket_closed()
         await self.rpc.__aexit__(None, None, None)
-        await self.session.close()
+        if self._owns_session:
+            await self.session.close()
 
     async def call_rpc(self, method: str, params: List = None):
         return await self.rpc.rpc_valid_request(method, params or [])
 
+    async def start_wallet_and_messenger(self) -> List[dict]:
+        # Both services are started with a single batch request, or one after the other without batches
+        return await self.rpc.rpc_valid_batch_request([("wallet_startWallet", []), ("wakuext_startMessenger", [])],
+                                                      sequential=True)
+
     async def api_request(self, method: str, data: Dict) -> dict:
         url = f"{self.api_url}/{method}"
-        logger.trace(f"Sending POST to {url} with data: {data}")
-        async with self.session.post(url, json=data) as response:
+        trace_enabled = logger.isEnabledFor(TraceLogger.TRACE)
+        if trace_enabled:
+            logger.trace(f"Sending POST to {url} with data: {data}")
+        async with self.session.post(url, data=json_codec.dumps_bytes(data), headers=JSON_HEADERS) as response:
+            body = await response.read()
+        if trace_enabled:
             logger.trace(f"Received response from {method}: {response.status}")
 
-            if response.status != 200:
-                body = await response.text()
-                raise AssertionError(f"Bad HTTP status: {response.status}, body: {body}")
-
-            try:
-                json_data = await response.json()
-            except json.JSONDecodeError:
-                body = await response.text()
-                raise AssertionError(f"Invalid JSON in response: {body}")
+        json_data = decode_json_response(response.status, body)
+        if json_data.get("error"):
+            raise AssertionError(f"API error: {json_data['error']}")
 
-            if json_data.get("error"):
-                raise AssertionError(f"API error: {json_data['error']}")
-
-            return json_data
+        return json_data
 
     async def api_valid_request(self, method: str, data: Dict) -> dict:
         json_data = await self.api_request(method, data)
-        logger.trace(f"Valid response from {method}: {json_data}")
+        if logger.isEnabledFor(TraceLogger.TRACE):
+            logger.trace(f"Valid response from {method}: {json_data}")
         return json_data
 
     async def start_status_backend(self) -> dict:
@@ -93,7 +123,9 @@ class StatusBackend:
             "wakuFleetsConfigFilePath": "/static/configs/config.json"
             # TODO check wakuFleetsConfigFilePath?
         }
-        return await self.api_valid_request(method, data)
+        response = await self.api_valid_request(method, data)
+        self.accounts = response.get("accounts") or []
+        return response
 
     def _set_networks(self, data: Dict):
         anvil_network = {
@@ -156,7 +188,7 @@ class StatusBackend:
         })
         signal = await self.signal.wait_for_login()
         self.set_public_key(signal)
-        self.last_login = int(time.time())
+        self.last_login = time.time()
         return response
 
     async def logout(self, clean_signals = False) -> dict:
@@ -1,5 +1,5 @@
 # Python Imports
-from typing import Dict
+from typing import Dict, List, Tuple
 
 # Project Imports
 from src.rpc_client import AsyncRpcClient
@@ -34,6 +34,10 @@ class WakuextAsyncService(AsyncService):
         json_response = await self.rpc_request("fetchCommunity", params)
         return json_response
 
+    async def joined_communities(self) -> dict:
+        json_response = await self.rpc_request("joinedCommunities")
+        return json_response
+
     async def request_to_join_community(self, community_id: str, address: str = "fakeaddress") -> dict:
         params = [{"communityId": community_id, "addressesToReveal": [address], "airdropAddress": address}]
         json_response = await self.rpc_request("requestToJoinCommunity", params)
@@ -70,6 +74,14 @@ class WakuextAsyncService(AsyncService):
         json_response = await self.rpc_request("declineContactRequest", params)
         return json_response
 
+    async def contacts(self) -> dict:
+        json_response = await self.rpc_request("contacts")
+        return json_response
+
+    async def chats(self) -> dict:
+        json_response = await self.rpc_request("chats")
+        return json_response
+
     async def send_one_to_one_message(self, contact_id: str, message: str):
         params = [{"id": contact_id, "message": message}]
         json_response = await self.rpc_request("sendOneToOneMessage", params)
@@ -89,3 +101,24 @@ class WakuextAsyncService(AsyncService):
         params = [{"id": contact_id, "nickname": "fake_nickname", "displayName": displayName, "ensName": ""}]
         json_response = await self.rpc_request("addContact", params)
         return json_response
+
+    async def add_contacts(self, contacts: List[Tuple[str, str]]) -> List[dict]:
+        # Contacts are (contact id, display name)
+        calls = [("addContact", [{"id": contact_id, "nickname": "fake_nickname", "displayName": display_name,
+                                  "ensName": ""}])
+                 for contact_id, display_name in contacts]
+        return await self.rpc_batch_request(calls)
+
+    async def send_chat_messages(self, chat_id: str, messages: List[str], content_type: int = 1) -> List[dict]:
+        calls = [("sendChatMessage", [{"chatId": chat_id, "text": message, "contentType": content_type}])
+                 for message in messages]
+        # Messages and requests are not sent again when the batch may have been executed
+        return await self.rpc_batch_request(calls, idempotent=False)
+
+    async def send_one_to_one_messages(self, contact_id: str, messages: List[str]) -> List[dict]:
+        calls = [("sendOneToOneMessage", [{"id": contact_id, "message": message}]) for message in messages]
+        return await self.rpc_batch_request(calls, idempotent=False)
+
+    async def send_contact_requests(self, contact_ids: List[str], message: str) -> List[dict]:
+        calls = [("sendContactRequest", [{"id": contact_id, "message": message}]) for contact_id in contact_ids]
+        return await self.rpc_batch_request(calls, idempotent=False)
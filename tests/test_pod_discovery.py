@@ -0,0 +1,101 @@
+# Python Imports
+import asyncio
+import threading
+import time
+import unittest
+
+# Project Imports
+from src.fake_kubernetes import FakePodApi
+from src.pod_discovery import PodDiscovery
+from src.pod_resolver import PodResolver
+
+NAMESPACE = "status-go-test"
+
+
+class CountingPodApi(FakePodApi):
+    """
+    FakePodApi that counts the events sent by its watches, to check they are not replayed when a watch reconnects.
+    """
+    def __init__(self):
+        super().__init__(NAMESPACE)
+        self.watched_events = 0
+
+    def watch_pods(self, namespace, label_selector, resource_version, timeout_seconds):
+        for event in super().watch_pods(namespace, label_selector, resource_version, timeout_seconds):
+            self.watched_events += 1
+            yield event
+
+
+def _in_background(*steps):
+    # Runs (delay, callable) steps in order in a thread, like pods changing while the discovery watches them
+    def _run():
+        for delay, step in steps:
+            time.sleep(delay)
+            step()
+
+    thread = threading.Thread(target=_run, daemon=True)
+    thread.start()
+    return thread
+
+
+class PodDiscoveryTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.api = CountingPodApi()
+        self.api.add_stateful_set("status-backend-relay", 3)
+        self.resolver = PodResolver(use_api=False)
+
+    def discovery(self, timeout: float = 10) -> PodDiscovery:
+        return PodDiscovery(["status-backend-relay"], NAMESPACE, timeout=timeout, api=self.api,
+                            resolver=self.resolver, watch_timeout=1)
+
+    @staticmethod
+    def host(ordinal: int) -> str:
+        return f"status-backend-relay-{ordinal}.status-backend-relay.{NAMESPACE}"
+
+    async def test_pods_are_yielded_as_they_become_ready(self):
+        self.api.set_ready("status-backend-relay-1", ip="10.0.0.2")
+        _in_background((0.1, lambda: self.api.set_ready("status-backend-relay-2", ip="10.0.0.3")),
+                       (0.1, lambda: self.api.set_ready("status-backend-relay-0", ip="10.0.0.1")))
+
+        hosts = [host async for host in self.discovery().stream()]
+
+        self.assertEqual(hosts, [self.host(1), self.host(2), self.host(0)])
+        self.assertEqual(self.resolver.addresses, {self.host(0): "10.0.0.1", self.host(1): "10.0.0.2",
+                                                   self.host(2): "10.0.0.3"})
+
+    async def test_restarted_pod_is_registered_with_its_new_ip(self):
+        self.api.set_ready("status-backend-relay-0", ip="10.0.0.1")
+        _in_background((0.1, lambda: self.api.delete_pod("status-backend-relay-0")),
+                       (0.1, lambda: self.api.set_ready("status-backend-relay-0", ip="10.0.1.1")),
+                       (0.1, lambda: self.api.set_ready("status-backend-relay-1", ip="10.0.0.2")),
+                       (0.1, lambda: self.api.set_ready("status-backend-relay-2", ip="10.0.0.3")))
+
+        hosts = [host async for host in self.discovery().stream()]
+
+        self.assertEqual(hosts, [self.host(0), self.host(1), self.host(2)])
+        self.assertEqual(self.resolver.addresses[self.host(0)], "10.0.1.1")
+
+    async def test_watch_resumes_after_the_last_event(self):
+        # Every change comes after the watch timeout, so each one is seen by a new watch request
+        _in_background(*[(1.5, lambda ordinal=ordinal: self.api.set_ready(f"status-backend-relay-{ordinal}"))
+                         for ordinal in range(3)])
+
+        hosts = await self.discovery().list()
+
+        self.assertEqual(hosts, [self.host(0), self.host(1), self.host(2)])
+        self.assertEqual(self.api.watched_events, 3)
+
+    async def test_pods_not_ready_before_the_timeout_are_left_out(self):
+        self.api.set_ready("status-backend-relay-2")
+        discovery = self.discovery(timeout=0.5)
+
+        start = time.monotonic()
+        hosts = await discovery.list()
+
+        self.assertEqual(hosts, [self.host(2)])
+        self.assertEqual(discovery.expected, 3)
+        self.assertLess(time.monotonic() - start, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()